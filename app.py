@@ -2,15 +2,31 @@ import streamlit as st
 import streamlit.components.v1 as components
 from streamlit.errors import StreamlitSecretNotFoundError
 import pandas as pd
+import numpy as np
 import altair as alt
 from io import BytesIO
 import random
+import secrets
+import functools
+import hashlib
+import hmac
 import math
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
 
 from datetime import datetime, timezone, timedelta, date
 from google.api_core.exceptions import AlreadyExists
 
-from db import build_filter, init_db, mongo
+from db import AccountNotFound, BatchWriteError, InsufficientBalance, build_filter, ensure_indexes, get_database, init_db, mongo
+from db import cache_generations
+from db import LiveCollections
+from db import identity_map as db_identity_map
+from db import profiler as db_profiler
+from migrations import backfill_savings_maturity
 
 # (학급 확장용) PDF 텍스트 파싱(간단)
 import re
@@ -22,6 +38,11 @@ import json
 APP_TITLE = "🏫학급 경제 시스템🪙"
 st.set_page_config(page_title=APP_TITLE, layout="wide")
 
+# ✅ DB 프로파일러: 이번 rerun에서 발생한 Mongo 명령을 한 묶음(trace)으로 기록 (⚙️ 성능 탭)
+db_profiler.begin_rerun("app")
+# ✅ rerun 단위 문서 캐시(같은 students/<id>를 여러 번 get해도 DB는 1회만 조회)
+db_identity_map.reset()
+
 KST = timezone(timedelta(hours=9))
 
 # ✅ 기존 관리자 유지(교사)
@@ -678,7 +699,19 @@ def get_db():
     db_name = str(cfg.get("db_name", "class_point_app")).strip()
     if not uri:
         raise ValueError("`[mongodb] uri`가 secrets.toml에 설정되지 않았습니다.")
-    return init_db(uri=uri, db_name=db_name)
+    client = init_db(uri=uri, db_name=db_name)
+    # ✅ 쿼리가 의존하는 인덱스를 프로세스 시작 시 1회 보장(이미 있으면 no-op)
+    try:
+        ensure_indexes(get_database())
+    except Exception as e:
+        # 만기/조회 쿼리가 인덱스를 전제로 하므로 실패를 삼키지 않고 서버 로그에 남김
+        print(f"[get_db] ensure_indexes 실패: {type(e).__name__}: {e}", file=sys.stderr)
+    # ✅ 레플리카 간 캐시 일관성: 다른 인스턴스의 쓰기를 cache_versions로 받아 같은 키만 무효화
+    try:
+        cache_generations.start_coherence(get_database())
+    except Exception:
+        pass
+    return client
 
 try:
     db = get_db()
@@ -690,6 +723,9 @@ except Exception as e:
     st.error(f"MongoDB 초기화 실패: {e}")
     st.stop()
 
+# ✅ 다른 레플리카가 바꾼 캐시 키 반영(change stream 감시 중이면 no-op, 아니면 1초 간격 폴링)
+cache_generations.sync()
+
 # =========================
 # Utils (너 코드 유지 + 권한 유틸 추가)
 # =========================
@@ -702,12 +738,16 @@ def toast(msg: str, icon: str = "✅"):
     else:
         st.success(msg)
 
-def toast_and_rerun(msg: str, icon: str = "✅"):
-    """rerun 직전에도 알림이 누락되지 않도록 다음 실행에서 한 번 더 보여준다."""
+def toast_and_rerun(msg: str, icon: str = "✅", scope: str = "app"):
+    """rerun 직전에도 알림이 누락되지 않도록 다음 실행에서 한 번 더 보여준다.
+    - scope="fragment": 현재 프래그먼트만 다시 실행(rerun_fragment)
+    """
     queue_key = "_pending_toasts_after_rerun"
     q = list(st.session_state.get(queue_key, []) or [])
     q.append({"msg": str(msg), "icon": str(icon or "✅")})
     st.session_state[queue_key] = q
+    if scope == "fragment":
+        rerun_fragment()
     st.rerun()
 
 def flush_pending_toasts():
@@ -782,6 +822,17 @@ def format_kr_datetime_no_year(val) -> str:
     return re.sub(r"^\d{4}년\s*", "", formatted)
 
 
+def _fmt_kor_date_short(iso_utc: str) -> str:
+    # "0월 0일(요일한글자)" 형태 (📊 통계청 · 💳 신용등급 · 📊 통계/신용 탭 공용)
+    try:
+        # 예: 2026-02-07T00:00:00Z
+        dt = datetime.fromisoformat(str(iso_utc).replace("Z", "+00:00")).astimezone(KST)
+        wd = ["월", "화", "수", "목", "금", "토", "일"][dt.weekday()]
+        return f"{dt.month}월 {dt.day}일({wd})"
+    except Exception:
+        return ""
+
+
 def _to_utc_datetime(ts):
     if ts is None or ts == "":
         return None
@@ -839,20 +890,65 @@ def savings_active_total(savings_list: list[dict]) -> int:
         if str(s.get("status", "")).lower().strip() in ("active", "running")
     )
 
-@st.cache_data(ttl=20, show_spinner=False)
-def _list_active_students_full_cached() -> list[dict]:
-    """활성 학생 전체를 1회 조회 후 재사용(리렌더/버튼 rerun read 절감)."""
-    docs = db.collection("students").where(filter=build_filter("is_active", "==", True)).stream()
-    rows = []
-    for d in docs:
-        x = d.to_dict() or {}
-        rows.append({"student_id": d.id, **x})
-    return rows
+# 목록 화면 기본 필드(PIN/권한 등 민감·대용량 필드는 필요한 화면에서만 추가 요청)
+STUDENT_LIST_FIELDS = ("name", "no", "balance")
 
 
-@st.cache_data(ttl=60, show_spinner=False)
-def _get_invest_products_map_cached() -> dict[str, tuple[str, float, float]]:
-    """invest_products 전체 스냅샷 캐시(학생별 요약 계산 시 중복 stream 방지)."""
+STUDENT_ROWS_TTL_SEC = 300
+
+
+@st.cache_resource(show_spinner=False)
+def _student_rows_store() -> dict:
+    """fields별 활성 학생 행 {student_id: row} + 마지막으로 반영한 캐시 세대(seq)."""
+    return {"lock": threading.Lock(), "views": {}}
+
+
+def _list_active_students_full_cached(fields: tuple = STUDENT_LIST_FIELDS) -> list[dict]:
+    """활성 학생 전체를 1회 조회 후 재사용(리렌더/버튼 rerun read 절감).
+    - fields: 가져올 필드(projection). 화면별로 필요한 필드만 받아 전송량/디코딩 비용 절감
+    - ✅ 학생 1명이 바뀌면(students:<id> 세대 증가) 그 학생 행만 다시 읽어 제자리 패치
+      (여러 문서를 한꺼번에 바꾼 쓰기이거나 TTL이 지나면 전체 재조회)
+    """
+    fields = tuple(fields)
+    store = _student_rows_store()
+    with store["lock"]:
+        view = store["views"].get(fields)
+        now = time.monotonic()
+        if (
+            view is None
+            or cache_generations.get("students") > view["seq"]
+            or now - view["loaded_at"] > STUDENT_ROWS_TTL_SEC
+        ):
+            seq = cache_generations.seq
+            docs = (
+                db.collection("students")
+                .where(filter=build_filter("is_active", "==", True))
+                .select(list(fields))
+                .stream()
+            )
+            rows = {}
+            for d in docs:
+                x = d.to_dict() or {}
+                rows[d.id] = {"student_id": d.id, **x}
+            view = {"seq": seq, "loaded_at": now, "rows": rows}
+            store["views"][fields] = view
+        else:
+            # seq를 먼저 읽어야 그 사이 들어온 bump가 "이미 반영"으로 찍히지 않음(다음 호출에서 다시 패치)
+            seq = cache_generations.seq
+            changed = cache_generations.changed_since("students", view["seq"])
+            if changed:
+                for snap in db.collection("students").get_many(changed):
+                    x = snap.to_dict()
+                    if x is None or not x.get("is_active", False):
+                        view["rows"].pop(snap.id, None)
+                    else:
+                        view["rows"][snap.id] = {"student_id": snap.id, **{f: x[f] for f in fields if f in x}}
+                view["seq"] = seq
+        return [dict(r) for r in view["rows"].values()]
+
+
+@st.cache_data(ttl=1800, show_spinner=False, max_entries=16)
+def _load_invest_products_map(gen: int) -> dict[str, tuple[str, float, float]]:
     prod_map = {}
     for d in db.collection(INV_PROD_COL).stream():
         x = d.to_dict() or {}
@@ -870,9 +966,13 @@ def _get_invest_products_map_cached() -> dict[str, tuple[str, float, float]]:
     return prod_map
 
 
-@st.cache_data(ttl=60, show_spinner=False)
-def _get_role_lookup_cached() -> tuple[dict[str, str], dict[str, list[str]]]:
-    """roles + job_salary를 캐시해 학생별 직업명 조회 read를 최소화."""
+def _get_invest_products_map_cached() -> dict[str, tuple[str, float, float]]:
+    """invest_products 전체 스냅샷 캐시(학생별 요약 계산 시 중복 stream 방지)."""
+    return _load_invest_products_map(cache_generations.collection_gen(INV_PROD_COL))
+
+
+@st.cache_data(ttl=1800, show_spinner=False, max_entries=16)
+def _load_role_lookup(roles_gen: int, jobs_gen: int) -> tuple[dict[str, str], dict[str, list[str]]]:
     role_by_id = {}
     for d in db.collection("roles").stream():
         x = d.to_dict() or {}
@@ -891,15 +991,21 @@ def _get_role_lookup_cached() -> tuple[dict[str, str], dict[str, list[str]]]:
                 jobs_by_student[sid].append(jname)
     return role_by_id, jobs_by_student
 
+
+def _get_role_lookup_cached() -> tuple[dict[str, str], dict[str, list[str]]]:
+    """roles + job_salary를 캐시해 학생별 직업명 조회 read를 최소화."""
+    return _load_role_lookup(cache_generations.collection_gen("roles"), cache_generations.collection_gen("job_salary"))
+
 # =========================
 # (관리자 개별조회용) 요약 정보 helpers
 # - 학생 번호(no) 기준 정렬 + 접힘/펼침 한 줄 요약
 # =========================
 INV_PROD_COL = "invest_products"
 INV_LEDGER_COL = "invest_ledger"
+SAV_COL = "savings"
 
-@st.cache_data(ttl=60, show_spinner=False)
-def _get_role_name_by_student_id(student_id: str) -> str:
+def _resolve_role_name(student_id: str) -> str:
+    """students 문서 + roles/job_salary 조회로 직업명 계산(캐시 없음)."""
     try:
         sid = str(student_id or "").strip()
         if not sid:
@@ -957,12 +1063,71 @@ def _get_role_name_by_student_id(student_id: str) -> str:
     except Exception:
         return "없음"
 
-@st.cache_data(ttl=30, show_spinner=False)
-def _get_invest_summary_by_student_id(student_id: str) -> tuple[str, int]:
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _get_role_name_by_student_id(student_id: str) -> str:
+    return _resolve_role_name(student_id)
+
+def _aggregate_invest_positions(student_id: str | None = None) -> dict[str, list[tuple[str, float, float | None, int]]]:
+    """
+    ✅ 미환매 투자 보유분을 한 번의 aggregate로 집계 (student_id를 주면 그 학생만)
+    - return: {student_id: [(product_id, buy_price, point_profit_pct, invest_amount 합계), ...]}
+    - 평가 규칙(매입가 기준 등락)이 동일하도록 (학생, 종목, 매입가, 수익률) 단위로 묶는다.
+    """
+    match = {
+        "redeemed": {"$ne": True},
+        "product_id": {"$nin": [None, ""]},
+        "invest_amount": {"$gt": 0},
+    }
+    if student_id is not None:
+        match["student_id"] = str(student_id)
+    pipeline = [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": {
+                    "student_id": "$student_id",
+                    "product_id": "$product_id",
+                    "buy_price": "$buy_price",
+                    "point_profit_pct": "$point_profit_pct",
+                },
+                "invest_amount": {"$sum": "$invest_amount"},
+            }
+        },
+    ]
+    positions: dict[str, list[tuple[str, float, float | None, int]]] = {}
+    for row in db.collection(INV_LEDGER_COL).aggregate(pipeline):
+        key = row.get("_id") or {}
+        sid = str(key.get("student_id", "") or "")
+        if not sid:
+            continue
+        pct = key.get("point_profit_pct")
+        positions.setdefault(sid, []).append(
+            (
+                str(key.get("product_id", "") or ""),
+                float(key.get("buy_price", 0.0) or 0.0),
+                float(pct) if pct else None,
+                int(row.get("invest_amount", 0) or 0),
+            )
+        )
+    return positions
+
+
+@st.cache_data(ttl=1800, show_spinner=False, max_entries=16)
+def _load_invest_positions(gen: int) -> dict[str, list[tuple[str, float, float | None, int]]]:
+    return _aggregate_invest_positions()
+
+
+def _get_invest_positions_cached() -> dict[str, list[tuple[str, float, float | None, int]]]:
+    """학급 전체 보유 집계 캐시 (invest_ledger 쓰기 시 세대 번호로 자동 무효화)"""
+    return _load_invest_positions(cache_generations.collection_gen(INV_LEDGER_COL))
+
+
+def _get_invest_summary_by_student_id(student_id: str, positions: list | None = None) -> tuple[str, int]:
     """
     ✅ return (표시문구, 투자총액_현재가치추정)
     - 표시문구 예: "국어 100드림" / 여러개면 "국어 100드림, 수학 50드림"
-    - invest_ledger: redeemed=False 항목을 보유로 간주
+    - invest_ledger: redeemed=False 항목을 보유로 간주 (positions 생략 시 _get_invest_positions_cached 집계 사용)
     - invest_products: current_price 사용 + 종목명(name/label/title/subject) 대응
     """
     try:
@@ -971,24 +1136,14 @@ def _get_invest_summary_by_student_id(student_id: str) -> tuple[str, int]:
         # 1) 종목 정보 맵 (id -> (name, current_price))
         prod_map = _get_invest_products_map_cached()
 
-        # 2) 보유 장부(미환매) → 종목별 현재가치 합산
-        q = db.collection(INV_LEDGER_COL).where(filter=build_filter("student_id", "==", sid)).stream()
+        # 2) 보유 집계(미환매) → 종목별 현재가치 합산
         per_prod_val = {}  # pid -> value
 
-        for d in q:
-            x = d.to_dict() or {}
-            if bool(x.get("redeemed", False)):
-                continue
-
-            pid = str(x.get("product_id", "") or "")
-            if not pid:
-                continue
-
-            buy_price = float(x.get("buy_price", 0.0) or 0.0)
-            invest_amount = int(x.get("invest_amount", 0) or 0)
-
+        if positions is None:
+            positions = _get_invest_positions_cached().get(sid, [])
+        for pid, buy_price, lot_pct, invest_amount in positions:
             pname, cur_price, point_profit_pct = prod_map.get(pid, (pid, 0.0, DEFAULT_POINT_PROFIT_PCT))
-            point_profit_pct = float(x.get("point_profit_pct", point_profit_pct) or point_profit_pct)
+            point_profit_pct = float(lot_pct or point_profit_pct)
 
             # 현재 평가금은 투자 회수(지급) 계산과 동일 규칙 사용
             _, _, cur_val = _calc_invest_redeem_projection(
@@ -1062,8 +1217,7 @@ def _calc_invest_redeem_projection(
     return diff, profit, redeem_amt
     
 
-@st.cache_data(ttl=30, show_spinner=False)
-def _get_invest_principal_by_student_id(student_id: str) -> tuple[str, int]:
+def _get_invest_principal_by_student_id(student_id: str, positions: list | None = None) -> tuple[str, int]:
     """
     ✅ return (표시문구, 투자원금합계)
     - 표시문구 예: "국어 100드림, 수학 50드림"
@@ -1075,23 +1229,11 @@ def _get_invest_principal_by_student_id(student_id: str) -> tuple[str, int]:
         # 1) 종목 정보 맵 (id -> name)
         prod_name = {k: v[0] for k, v in _get_invest_products_map_cached().items()}
 
-        # 2) 보유 장부(미환매) → 종목별 원금 합산
-        q = db.collection(INV_LEDGER_COL).where(filter=build_filter("student_id", "==", sid)).stream()
+        # 2) 보유 집계(미환매) → 종목별 원금 합산
         per_prod_amt = {}  # pid -> principal(sum invest_amount)
-
-        for d in q:
-            x = d.to_dict() or {}
-            if bool(x.get("redeemed", False)):
-                continue
-
-            pid = str(x.get("product_id", "") or "")
-            if not pid:
-                continue
-
-            invest_amount = int(x.get("invest_amount", 0) or 0)
-            if invest_amount <= 0:
-                continue
-
+        if positions is None:
+            positions = _get_invest_positions_cached().get(sid, [])
+        for pid, _, _, invest_amount in positions:
             per_prod_amt[pid] = per_prod_amt.get(pid, 0) + invest_amount
 
         if not per_prod_amt:
@@ -1138,8 +1280,8 @@ def _score_to_grade(score: int) -> int:
         return 9
     return 10
 
-@st.cache_data(ttl=60, show_spinner=False)
-def _get_credit_cfg():
+@st.cache_data(ttl=1800, show_spinner=False, max_entries=16)
+def _load_credit_cfg(gen: int):
     ref = db.collection("config").document("credit_scoring")
     snap = ref.get()
     if not snap.exists:
@@ -1152,6 +1294,9 @@ def _get_credit_cfg():
         "tri": int(d.get("tri", 0) if d.get("tri", None) is not None else 0),
     }
 
+def _get_credit_cfg():
+    return _load_credit_cfg(cache_generations.collection_gen("config"))
+
 def _norm_status(v) -> str:
     v = str(v or "").strip().upper()
     if v in ("O", "○"):
@@ -1166,6 +1311,7 @@ def _sum_manual_credit_delta(student_id: str) -> int:
         q = (
             db.collection("credit_adjustments")
             .where(filter=build_filter("student_id", "==", str(student_id)))
+            .select(["delta"])
             .stream()
         )
         for d in q:
@@ -1175,42 +1321,198 @@ def _sum_manual_credit_delta(student_id: str) -> int:
         return 0
     return int(total)
 
+# =========================
+# ✅ 신용 엔진: 학생별 누적 점수를 credit_scores 문서에 저장
+# - 통계 누적(stat_score): 최근 CREDIT_WINDOW_COLS개 제출물을 과거→최신으로 더하며 0~100 클램프
+# - 최종 점수 = clamp(stat_score + 수동 조정 합계)
+# - 제출물 추가: 저장된 stat_score에 새 칸 1개만 누적 / 표 저장: 값이 바뀐 학생만 재계산
+# - 제출물 삭제·창(window) 밀림·배점(_get_credit_cfg) 변경 시에만 전체 재계산
+# =========================
+CREDIT_SCORES_COL = "credit_scores"
+CREDIT_WINDOW_COLS = 200
+
+
+def _credit_cfg_sig(cfg: dict) -> str:
+    return f"{int(cfg.get('base', 50))}:{int(cfg.get('o', 1))}:{int(cfg.get('x', -3))}:{int(cfg.get('tri', 0))}"
+
+
+def _clamp_credit(score: int) -> int:
+    return max(0, min(100, int(score)))
+
+
+def _credit_status_delta(v, cfg: dict) -> int:
+    v = _norm_status(v)
+    if v == "O":
+        return int(cfg.get("o", 1))
+    if v == "△":
+        return int(cfg.get("tri", 0))
+    return int(cfg.get("x", -3))
+
+
+def _replay_credit_stat_scores(student_ids: list[str], stat_cols: dict, cfg: dict) -> np.ndarray:
+    """
+    ✅ 학생 × 제출물 상태 행렬로 학급 전체 stat_score를 한 번에 계산
+    - api_list_stat_columns의 열 코드 문자열(X/O/△ → 0/1/2)을 그대로 행렬로 변환
+    - 상태 코드 행렬을 배점 배열로 매핑해 점수 변화량 행렬 생성
+    - 클램프 누적은 칸(과거→최신)마다 학생 벡터 전체에 np.clip 한 번씩
+    """
+    cols = list(reversed(stat_cols.get("columns", []) or []))  # 과거 → 최신
+    stat_ids = list(stat_cols.get("student_ids", []) or [])
+    codes = np.zeros((len(student_ids), len(cols)), dtype=np.int8)  # 없는 학생은 X
+    pos = {sid: k for k, sid in enumerate(stat_ids)}
+    pairs = [(i, pos[sid]) for i, sid in enumerate(student_ids) if sid in pos]
+    if cols and pairs:
+        raw = np.frombuffer("".join(c["codes"] for c in cols).encode("ascii"), dtype=np.uint8)
+        stat_mat = (raw - ord("0")).astype(np.int8).reshape(len(cols), len(stat_ids)).T
+        rows, stat_rows = zip(*pairs)
+        codes[list(rows)] = stat_mat[list(stat_rows)]
+
+    points = np.array([int(cfg.get("x", -3)), int(cfg.get("o", 1)), int(cfg.get("tri", 0))], dtype=np.int64)
+    deltas = points[codes]
+    scores = np.full(len(student_ids), int(cfg.get("base", 50)), dtype=np.int64)
+    for j in range(deltas.shape[1]):
+        scores = np.clip(scores + deltas[:, j], 0, 100)
+    return scores
+
+
+def _credit_state(stat_score: int, manual_delta: int, n_cols: int, sig: str) -> dict:
+    score = _clamp_credit(int(stat_score) + int(manual_delta))
+    return {
+        "stat_score": int(stat_score),
+        "manual_delta": int(manual_delta),
+        "n_cols": int(n_cols),
+        "cfg_sig": sig,
+        "score": score,
+        "grade": _score_to_grade(score),
+        "updated_at": datetime.utcnow(),
+    }
+
+
+def _write_credit_states(states: dict) -> None:
+    if not states:
+        return
+    batch = db.batch()
+    for sid, state in states.items():
+        batch.set(db.collection(CREDIT_SCORES_COL).document(str(sid)), state)
+    batch.commit()
+
+
+def _manual_credit_deltas(student_ids: list[str] | None = None) -> dict[str, int]:
+    """credit_adjustments 수동 조정 합계를 aggregate 1회로 → {student_id: delta 합계}"""
+    pipeline = []
+    if student_ids is not None:
+        pipeline.append({"$match": {"student_id": {"$in": [str(x) for x in student_ids]}}})
+    pipeline.append({"$group": {"_id": "$student_id", "delta": {"$sum": "$delta"}}})
+    return {
+        str(row.get("_id") or ""): int(row.get("delta", 0) or 0)
+        for row in db.collection("credit_adjustments").aggregate(pipeline)
+    }
+
+
+def credit_engine_recompute(student_ids: list[str] | None = None) -> dict[str, dict]:
+    """
+    지정 학생(None이면 전체: 활성 학생 + 기존 엔진 문서)의 누적 점수를 재계산해 저장.
+    제출물은 캐시된 최근 CREDIT_WINDOW_COLS개 1회 조회, 수동 조정은 aggregate 1회.
+    """
+    cfg = _get_credit_cfg()
+    sig = _credit_cfg_sig(cfg)
+    stat_cols = api_list_stat_columns(limit_cols=CREDIT_WINDOW_COLS)
+
+    if student_ids is None:
+        ids = [str(s.get("student_id", "") or "") for s in _list_active_students_full_cached()]
+        ids += [d.id for d in db.collection(CREDIT_SCORES_COL).select([]).stream()]
+        manual = _manual_credit_deltas()
+    else:
+        ids = [str(x) for x in student_ids]
+        manual = _manual_credit_deltas(ids)
+    ids = [x for x in dict.fromkeys(ids) if x]
+
+    stat_scores = _replay_credit_stat_scores(ids, stat_cols, cfg)
+    n_cols = len(stat_cols["columns"])
+    states = {
+        sid: _credit_state(int(stat_scores[i]), manual.get(sid, 0), n_cols, sig)
+        for i, sid in enumerate(ids)
+    }
+    _write_credit_states(states)
+    return states
+
+
+def credit_engine_add_submission(statuses: dict) -> None:
+    """새 제출물(가장 최신 칸) 1개를 저장된 stat_score에 누적 (statuses는 학생ID → 상태, 디코딩된 값)"""
+    cfg = _get_credit_cfg()
+    sig = _credit_cfg_sig(cfg)
+    states, replay = {}, []
+    for d in db.collection(CREDIT_SCORES_COL).stream():
+        x = d.to_dict() or {}
+        n_cols = int(x.get("n_cols", 0) or 0)
+        if x.get("cfg_sig") != sig or n_cols >= CREDIT_WINDOW_COLS:
+            # 배점이 바뀌었거나 창이 가득 차 가장 오래된 칸이 빠지는 경우 → 누적 불가, 재계산
+            replay.append(d.id)
+            continue
+        stat_score = _clamp_credit(int(x.get("stat_score", 0) or 0) + _credit_status_delta(statuses.get(d.id, "X"), cfg))
+        states[d.id] = _credit_state(stat_score, int(x.get("manual_delta", 0) or 0), n_cols + 1, sig)
+    _write_credit_states(states)
+    if replay:
+        credit_engine_recompute(replay)
+
+
+def credit_engine_add_manual(student_id: str, delta: int) -> None:
+    """수동 조정 1건 반영: 저장된 manual_delta에만 더함"""
+    sid = str(student_id)
+    snap = db.collection(CREDIT_SCORES_COL).document(sid).get()
+    x = snap.to_dict() if snap.exists else None
+    if not x or x.get("cfg_sig") != _credit_cfg_sig(_get_credit_cfg()):
+        credit_engine_recompute([sid])
+        return
+    _write_credit_states(
+        {
+            sid: _credit_state(
+                int(x.get("stat_score", 0) or 0),
+                int(x.get("manual_delta", 0) or 0) + int(delta),
+                int(x.get("n_cols", 0) or 0),
+                str(x.get("cfg_sig")),
+            )
+        }
+    )
+
+
+CREDIT_ENGINE_META_DOC = "credit_engine"  # config/credit_engine: 마지막으로 전체 재계산한 배점 시그니처
+
+
+def _claim_credit_full_recompute(sig: str) -> bool:
+    """
+    배점 변경 후 전체 재계산을 맡을 실행 1곳만 선점(config/credit_engine.cfg_sig 조건부 교체)
+    - 이미 다른 세션/레플리카가 같은 시그니처로 선점했으면 False
+    """
+    ref = db.collection("config").document(CREDIT_ENGINE_META_DOC)
+    snap = ref.get()
+    if not snap.exists:
+        try:
+            ref.create({"cfg_sig": sig, "updated_at": datetime.utcnow()})
+            return True
+        except AlreadyExists:
+            return False
+    prev = (snap.to_dict() or {}).get("cfg_sig")
+    if prev == sig:
+        return False
+    return ref.update_if({"cfg_sig": sig, "updated_at": datetime.utcnow()}, [build_filter("cfg_sig", "==", prev)])
+
+
 def _calc_credit_score_for_student(student_id: str):
-    credit_cfg = _get_credit_cfg()
-    base = int(credit_cfg.get("base", 50) if credit_cfg.get("base", None) is not None else 50)
-    o_pt = int(credit_cfg.get("o", 1) if credit_cfg.get("o", None) is not None else 1)
-    x_pt = int(credit_cfg.get("x", -3) if credit_cfg.get("x", None) is not None else -3)
-    tri_pt = int(credit_cfg.get("tri", 0) if credit_cfg.get("tri", None) is not None else 0)
-
-    def _delta(v) -> int:
-        v = _norm_status(v)
-        if v == "O":
-            return o_pt
-        if v == "△":
-            return tri_pt
-        return x_pt
-
-    res = api_list_stat_submissions_cached(limit_cols=200)
-    rows_desc = list(res.get("rows", []) or []) if res.get("ok") else []
-
-    score = int(base)
-    # rows_desc는 최신→과거 / 누적은 과거→최신으로
-    for sub in reversed(rows_desc):
-        statuses = dict(sub.get("statuses", {}) or {})
-        v_raw = statuses.get(str(student_id), "X")
-        score = int(score + _delta(v_raw))
-        if score > 100:
-            score = 100
-        if score < 0:
-            score = 0
-    score = int(score + _sum_manual_credit_delta(student_id))
-    if score > 100:
-        score = 100
-    if score < 0:
-        score = 0            
-
-    grade = _score_to_grade(score)
-    return score, grade
+    """
+    credit_scores 문서 1회 읽기 → (score, grade)
+    - 배점이 바뀌었으면 선점한 1곳만 전체 재계산, 나머지는 이 학생만 재계산
+    """
+    sid = str(student_id)
+    snap = db.collection(CREDIT_SCORES_COL).document(sid).get()
+    x = snap.to_dict() if snap.exists else None
+    sig = _credit_cfg_sig(_get_credit_cfg())
+    if x and x.get("cfg_sig") == sig:
+        return int(x.get("score", DEFAULT_CREDIT_SCORE)), int(x.get("grade", DEFAULT_CREDIT_GRADE))
+    full = bool(x) and _claim_credit_full_recompute(sig)
+    states = credit_engine_recompute(None if full else [sid])
+    state = states.get(sid) or credit_engine_recompute([sid])[sid]
+    return state["score"], state["grade"]
 
 
 def _render_user_bank_header(student_id: str):
@@ -1220,39 +1522,17 @@ def _render_user_bank_header(student_id: str):
         if not sid:
             return
 
-        # 통장잔액
-        bal_now = 0
-        try:
-            snap = db.collection("students").document(sid).get()
-            if snap.exists:
-                bal_now = int((snap.to_dict() or {}).get("balance", 0) or 0)
-        except Exception:
-            bal_now = 0
-
-        # 적금 총 원금(진행중만: 해지/만기 제외)
-        sv_total = 0
-        try:
-            sdocs = (
-                db.collection("savings")
-                .where(filter=build_filter("student_id", "==", sid))
-                .stream()
-            )
-            for d in sdocs:
-                s = d.to_dict() or {}
-                status = str(s.get("status", "")).lower().strip()
-                if status in ("active", "running"):
-                    sv_total += int(s.get("principal", 0) or 0)
-        except Exception:
-            sv_total = 0
-
-        # 투자: 원금 / 현재평가
-        inv_principal_text, inv_principal_total = _get_invest_principal_by_student_id(sid)
-        inv_eval_text, inv_eval_total = _get_invest_summary_by_student_id(sid)
-
-
-        # 직업 / 신용도
-        role_name = _get_role_name_by_student_id(sid)
-        credit_score, credit_grade = _safe_credit(sid)
+        # 통장잔액 / 적금(진행중) / 투자 원금·현재평가 / 직업 / 신용도: student_assets 1회 읽기
+        assets = _get_student_assets(sid)
+        bal_now = int(assets.get("balance", 0) or 0)
+        sv_total = int(assets.get("savings_principal", 0) or 0)
+        inv_principal_text = str(assets.get("invest_principal_text", "없음") or "없음")
+        inv_principal_total = int(assets.get("invest_principal", 0) or 0)
+        inv_eval_text = str(assets.get("invest_eval_text", "없음") or "없음")
+        inv_eval_total = int(assets.get("invest_eval", 0) or 0)
+        role_name = str(assets.get("role_name", "") or "")
+        credit_score = int(assets.get("credit_score", DEFAULT_CREDIT_SCORE) or 0)
+        credit_grade = int(assets.get("credit_grade", DEFAULT_CREDIT_GRADE) or 0)
 
         # 총 자산(투자는 현재평가 기준)
         asset_total = int(bal_now) + int(sv_total) + int(inv_eval_total)
@@ -1339,7 +1619,205 @@ def _safe_credit(student_id: str):
 
     except Exception:
         return (DEFAULT_CREDIT_SCORE, DEFAULT_CREDIT_GRADE)
-        
+
+
+# =========================
+# ✅ student_assets: 학생별 자산 요약 문서 (잔액/적금/투자/직업/신용)
+# - 헤더·개별조회는 이 문서 1회 읽기로 끝 (적금 stream/투자 집계/직업·신용 계산 없음)
+# - 원본 컬렉션 쓰기 → db 쓰기 훅은 (항목, 학생)만 메모리에 모아 두고(추가 DB 왕복 없음)
+#   rerun/스케줄러 실행 경계와 assets 조회 직전에 한 번에 dirty 카운터 +1
+# - 다음 조회 때 dirty/누락 항목만 다시 계산해 저장(읽은 카운터 그대로일 때만 0으로 되돌림)
+# =========================
+STUDENT_ASSETS_COL = "student_assets"
+ASSET_PARTS = {
+    "balance": ("balance",),
+    "savings": ("savings_principal",),
+    "invest": ("invest_principal", "invest_principal_text", "invest_eval", "invest_eval_text"),
+    "role": ("role_name",),
+    "credit": ("credit_score", "credit_grade"),
+}
+
+
+def _student_savings_principal(student_id: str) -> int:
+    """진행중 적금(해지/만기 제외) 원금 합계"""
+    total = 0
+    q = (
+        db.collection(SAV_COL)
+        .where(filter=build_filter("student_id", "==", str(student_id)))
+        .where(filter=build_filter("status", "in", ["active", "running"]))
+        .select(["principal"])
+        .stream()
+    )
+    for d in q:
+        total += int((d.to_dict() or {}).get("principal", 0) or 0)
+    return total
+
+
+def _compute_asset_parts(student_id: str, parts) -> dict:
+    sid = str(student_id)
+    out = {}
+    if "balance" in parts:
+        snap = db.collection("students").document(sid).get()
+        out["balance"] = int(((snap.to_dict() or {}) if snap.exists else {}).get("balance", 0) or 0)
+    if "savings" in parts:
+        out["savings_principal"] = _student_savings_principal(sid)
+    if "invest" in parts:
+        positions = _aggregate_invest_positions(sid).get(sid, [])
+        p_text, p_total = _get_invest_principal_by_student_id(sid, positions)
+        e_text, e_total = _get_invest_summary_by_student_id(sid, positions)
+        out.update(
+            invest_principal=int(p_total),
+            invest_principal_text=p_text,
+            invest_eval=int(e_total),
+            invest_eval_text=e_text,
+        )
+    if "role" in parts:
+        out["role_name"] = _resolve_role_name(sid)
+    if "credit" in parts:
+        sc, gr = _safe_credit(sid)
+        out.update(credit_score=int(sc), credit_grade=int(gr))
+    return out
+
+
+def _refresh_student_assets(student_id: str, doc: dict | None) -> dict:
+    """읽어온 assets 문서(없으면 None)에서 dirty/누락 항목만 다시 계산해 저장 후 반환"""
+    sid = str(student_id)
+    data = dict(doc or {})
+    dirty = dict(data.get("dirty", {}) or {})
+    stale = [
+        part
+        for part, fields in ASSET_PARTS.items()
+        if int(dirty.get(part, 0) or 0) > 0 or any(f not in data for f in fields)
+    ]
+    if not stale:
+        return data
+
+    fresh = _compute_asset_parts(sid, stale)
+    data.update(fresh)
+    payload = {**fresh, "updated_at": datetime.now(timezone.utc)}
+    ref = db.collection(STUDENT_ASSETS_COL).document(sid)
+    try:
+        if doc is None:
+            # 계산 중 쓰기 훅이 먼저 문서를 만들었으면 그쪽 dirty가 남도록 저장 생략
+            ref.create({**payload, "dirty": {}})
+        else:
+            for part in stale:
+                payload[f"dirty.{part}"] = 0
+            # 계산 중 같은 항목에 새 쓰기가 들어왔으면(카운터 변경) 저장 생략 → 다음 조회에서 재계산
+            ref.update_if(payload, [build_filter(f"dirty.{part}", "==", dirty.get(part)) for part in stale])
+    except AlreadyExists:
+        pass
+    return data
+
+
+def _get_student_assets(student_id: str) -> dict:
+    sid = str(student_id)
+    flush_student_assets_dirty()
+    snap = db.collection(STUDENT_ASSETS_COL).document(sid).get()
+    return _refresh_student_assets(sid, snap.to_dict() if snap.exists else None)
+
+
+def _get_student_assets_many(student_ids: list[str]) -> dict[str, dict]:
+    """여러 학생 assets를 get_many 한 번으로 읽기 → {student_id: assets}"""
+    flush_student_assets_dirty()
+    snaps = db.collection(STUDENT_ASSETS_COL).get_many([str(x) for x in student_ids])
+    return {s.id: _refresh_student_assets(s.id, s.to_dict() if s.exists else None) for s in snaps}
+
+
+_assets_dirty_lock = threading.Lock()
+_assets_dirty_pending: dict[str, set | None] = {}  # part → 학생 ids (None: 전체 학생)
+_assets_owner_pending: dict[tuple, set] = {}  # (collection, parts) → 학생을 아직 모르는 문서 ids
+
+
+def _merge_dirty(pending: dict, parts, student_ids) -> None:
+    for part in parts:
+        if student_ids is None:
+            pending[part] = None
+        elif pending.get(part, set()) is not None:
+            pending.setdefault(part, set()).update(str(x) for x in student_ids if x)
+
+
+def _mark_student_assets_dirty(parts, student_ids=None):
+    """쓰기 훅용: 메모리에만 기록(student_ids=None이면 전체 학생) → flush_student_assets_dirty()가 저장"""
+    with _assets_dirty_lock:
+        _merge_dirty(_assets_dirty_pending, parts, student_ids)
+
+
+def _mark_owner_assets_dirty(collection: str, parts, doc_ids):
+    """student_id가 문서 안에만 있는 컬렉션: 문서 ids만 모아 두고 학생은 flush 때 한 번에 조회"""
+    with _assets_dirty_lock:
+        if doc_ids is None:
+            _merge_dirty(_assets_dirty_pending, parts, None)
+        else:
+            _assets_owner_pending.setdefault((collection, tuple(parts)), set()).update(doc_ids)
+
+
+def _owner_student_ids(collection: str, doc_ids):
+    """쓰기된 문서들의 student_id (삭제 등으로 알 수 없으면 None → 전체)"""
+    if doc_ids is None:
+        return None
+    snaps = db.collection(collection).get_many(doc_ids)
+    if not all(s.exists for s in snaps):
+        return None
+    return [str((s.to_dict() or {}).get("student_id", "") or "") for s in snaps]
+
+
+def flush_student_assets_dirty() -> None:
+    """모아 둔 dirty 표시를 저장: 컬렉션별 소유 학생 get_many 1회 + 같은 항목 묶음마다 bulk write 1회"""
+    with _assets_dirty_lock:
+        if not _assets_dirty_pending and not _assets_owner_pending:
+            return
+        pending = dict(_assets_dirty_pending)
+        owners = dict(_assets_owner_pending)
+        _assets_dirty_pending.clear()
+        _assets_owner_pending.clear()
+    try:
+        for (collection, parts), doc_ids in owners.items():
+            _merge_dirty(pending, parts, _owner_student_ids(collection, sorted(doc_ids)))
+
+        col = db.collection(STUDENT_ASSETS_COL)
+        everyone = [part for part, ids in pending.items() if ids is None]
+        if everyone:
+            col.increment_many({f"dirty.{p}": 1 for p in everyone})
+        parts_by_student: dict[str, set] = {}
+        for part, ids in pending.items():
+            for sid in ids or ():
+                parts_by_student.setdefault(sid, set()).add(part)
+        ids_by_parts: dict[tuple, list] = {}
+        for sid, parts in parts_by_student.items():
+            ids_by_parts.setdefault(tuple(sorted(parts)), []).append(sid)
+        for parts, ids in ids_by_parts.items():
+            col.increment_many({f"dirty.{p}": 1 for p in parts}, ids)
+    except Exception:
+        # 저장 실패 시 다음 flush에서 다시 시도(누락되면 assets가 오래된 값을 보여 주므로 버리지 않음)
+        with _assets_dirty_lock:
+            for part, ids in pending.items():
+                _merge_dirty(_assets_dirty_pending, (part,), ids)
+
+
+@st.cache_resource(show_spinner=False)
+def _register_student_assets_hooks() -> bool:
+    """원본 컬렉션 → student_assets 항목 매핑 (프로세스당 1회 등록)"""
+    on = cache_generations.on_write
+    on("students", lambda ids: _mark_student_assets_dirty(("balance", "role"), ids))
+    on(SAV_COL, lambda ids: _mark_owner_assets_dirty(SAV_COL, ("savings",), ids))
+    on(INV_LEDGER_COL, lambda ids: _mark_owner_assets_dirty(INV_LEDGER_COL, ("invest",), ids))
+    on(INV_PROD_COL, lambda ids: _mark_student_assets_dirty(("invest",)))
+    on("roles", lambda ids: _mark_student_assets_dirty(("role",)))
+    on("job_salary", lambda ids: _mark_student_assets_dirty(("role",)))
+    on(CREDIT_SCORES_COL, lambda ids: _mark_student_assets_dirty(("credit",), ids))
+    on(
+        "config",
+        lambda ids: _mark_student_assets_dirty(("credit",)) if ids is None or "credit_scoring" in ids else None,
+    )
+    return True
+
+
+_register_student_assets_hooks()
+# ✅ 이전 rerun이 st.rerun()/st.stop()으로 끊겨 남은 dirty 표시가 있으면 먼저 저장
+flush_student_assets_dirty()
+
+
 def _fmt_admin_one_line(
     no: int,
     name: str,
@@ -1424,6 +1902,76 @@ def api_set_goal(name: str, pin: str, goal_amount: int, goal_date_str: str):
 
     # ✅ 목표 저장은 student_id 문서에 1개로 고정(로그아웃/재로그인 후에도 그대로 불러옴)
     return api_set_goal_by_student_id(student_doc.id, int(goal_amount), goal_date_str)
+# =========================
+# 세션 토큰 (로그인 1회 이름 조회 → 이후 student_id로 바로 조회)
+# =========================
+@st.cache_resource
+def _session_token_secret() -> bytes:
+    secret = ""
+    try:
+        secret = str(st.secrets.get("auth", {}).get("token_secret", "") or "")
+    except Exception:
+        secret = ""
+    secret = secret or os.environ.get("SESSION_TOKEN_SECRET", "")
+    # 설정이 없으면 프로세스 단위 임의 키(재시작 시 토큰만 무효 → 이름+PIN으로 1회 재인증)
+    return (secret or secrets.token_hex(32)).encode("utf-8")
+
+
+def _new_auth_version() -> str:
+    """PIN/역할/권한이 바뀔 때 students.auth_version에 새 값을 찍어 기존 세션 토큰을 무효화."""
+    return uuid.uuid4().hex[:12]
+
+
+def _sign_session_token(student_id: str, auth_version: str) -> str:
+    payload = f"{student_id}.{auth_version}"
+    sig = hmac.new(_session_token_secret(), payload.encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"{payload}.{sig}"
+
+
+def _verify_session_token(token):
+    """서명이 맞으면 (student_id, auth_version), 아니면 None."""
+    try:
+        payload, sig = str(token or "").rsplit(".", 1)
+        student_id, auth_version = payload.rsplit(".", 1)
+    except ValueError:
+        return None
+    if not student_id:
+        return None
+    expected = _sign_session_token(student_id, auth_version).rsplit(".", 1)[1]
+    if not hmac.compare_digest(sig, expected):
+        return None
+    return student_id, auth_version
+
+
+def _session_student_doc(name: str, pin: str):
+    """
+    ✅ 현재 로그인 세션의 (이름, PIN)이면 서명 토큰의 student_id로 students/<id> 1건만 조회
+    - auth_version이 다르면(PIN/역할 변경) None → 호출부가 이름+PIN으로 재인증
+    """
+    name = (name or "").strip()
+    try:
+        if not name or name != str(st.session_state.get("login_name", "") or ""):
+            return None
+        if str(pin) != str(st.session_state.get("login_pin", "") or ""):
+            return None
+        claims = _verify_session_token(st.session_state.get("auth_token"))
+    except Exception:
+        return None
+    if not claims:
+        return None
+
+    student_id, auth_version = claims
+    snap = db.collection("students").document(student_id).get()
+    if not snap.exists:
+        return None
+    data = snap.to_dict() or {}
+    if not data.get("is_active", False) or str(data.get("name", "") or "") != name:
+        return None
+    if str(data.get("auth_version", "") or "") != auth_version:
+        return None
+    return snap
+
+
 # =========================
 # mongo helpers (students/auth) - 너 코드 유지
 # =========================
@@ -1438,10 +1986,13 @@ def fs_get_student_doc_by_name(name: str):
         .limit(1)
         .stream()
     )
-    docs = list(q)
-    return docs[0] if docs else None
+    return next(q, None)
 
 def fs_auth_student(name: str, pin: str):
+    # ✅ 로그인 세션이면 이름 쿼리 대신 토큰(student_id)으로 조회
+    doc = _session_student_doc(name, pin)
+    if doc:
+        return doc
     doc = fs_get_student_doc_by_name(name)
     if not doc:
         return None
@@ -1455,8 +2006,10 @@ def _set_login_student_context_from_doc(doc):
     """로그인 시점 1회만 student 스냅샷 저장(렌더링 중 재인증 read 방지)."""
     if not doc:
         st.session_state["login_student_ctx"] = {}
+        st.session_state.pop("auth_token", None)
         return
     data = doc.to_dict() or {}
+    st.session_state["auth_token"] = _sign_session_token(str(doc.id), str(data.get("auth_version", "") or ""))
     st.session_state["login_student_ctx"] = {
         "student_id": str(doc.id),
         "name": str(data.get("name", "") or ""),
@@ -1480,12 +2033,8 @@ def _get_my_permissions_from_ctx(student_ctx: dict, is_admin: bool):
     perms = set()
     role_id = str(student_ctx.get("role_id", "") or "")
     if role_id:
-        # 역할 문서는 캐시 함수 사용(렌더링 중 직접 get 방지)
-        role_rows = api_list_roles_cached().get("roles", [])
-        for r in role_rows:
-            if str(r.get("role_id", "")) == role_id:
-                perms |= set(list(r.get("permissions", []) or []))
-                break
+        # 역할 권한은 roles_version 인덱스에서 O(1) 조회(렌더링 중 roles 재조회/선형 탐색 없음)
+        perms |= _role_permissions(role_id)
 
     extra = student_ctx.get("extra_permissions", []) or []
     if isinstance(extra, list):
@@ -1495,8 +2044,8 @@ def _get_my_permissions_from_ctx(student_ctx: dict, is_admin: bool):
 # =========================
 # Cached lists
 # =========================
-@st.cache_data(ttl=30, show_spinner=False)
 def api_list_accounts_cached():
+    # 학생 행 캐시(제자리 패치)에서 바로 만듦 → 입출금 후에도 전체 재조회 없음
     items = []
     for s in _list_active_students_full_cached():
         nm = s.get("name", "")
@@ -1506,8 +2055,8 @@ def api_list_accounts_cached():
     return {"ok": True, "accounts": items}
 
 
-@st.cache_data(ttl=300, show_spinner=False)
-def api_list_templates_cached():
+@st.cache_data(ttl=1800, show_spinner=False, max_entries=16)
+def _api_list_templates_cached(gen: int):
     docs = db.collection("templates").stream()
     templates = []
     for d in docs:
@@ -1528,6 +2077,10 @@ def api_list_templates_cached():
             )
     templates.sort(key=lambda x: (int(x.get("order", 999999)), str(x.get("label", ""))))
     return {"ok": True, "templates": templates}
+
+
+def api_list_templates_cached():
+    return _api_list_templates_cached(cache_generations.collection_gen("templates"))
 # =========================
 # ✅ (관리자) 입금/출금용 helpers
 # - templates 컬렉션: {label, category?, base_label?, kind, amount, order}
@@ -1565,47 +2118,43 @@ def _template_category_for_excel(template_row: dict) -> str:
         return category
     return "없음"
 
-def api_admin_bulk_deposit(admin_pin: str, amount: int, memo: str):
-    """✅ 전체 일괄 지급"""
-    if not is_admin_pin(admin_pin):
-        return {"ok": False, "error": "관리자 PIN이 틀립니다."}
-    amount = int(amount or 0)
-    memo = (memo or "").strip() or "일괄 지급"
-    recorder = _get_recorder_label(True, str(globals().get("login_name", "") or "").strip())
-    if amount <= 0:
-        return {"ok": False, "error": "금액은 1 이상이어야 합니다."}
+def _bulk_post_active_students(signed_amount: int, tx_type: str, memo: str, recorder: str) -> dict:
+    """✅ 활성 학생 전체에 같은 금액 반영(update_many 1회 + 잔액 조회 1회 + insert_many 1회)
+    - return: {ok, count, total(부호 포함 합계), rows:[{student_id, tx_id, balance_after}]}
+    """
+    try:
+        rows = db.post_ledger_bulk(
+            [build_filter("is_active", "==", True)],
+            int(signed_amount),
+            {
+                "type": str(tx_type),
+                "memo": memo,
+                "recorder": recorder,
+                "created_at": datetime.utcnow(),
+            },
+        )
+    except Exception as e:
+        return {"ok": False, "error": f"일괄 처리 실패: {e}"}
 
-    docs = list(db.collection("students").where(filter=build_filter("is_active", "==", True)).stream())
-    count = 0
-    for d in docs:
-        student_id = d.id
-        student_ref = db.collection("students").document(student_id)
-        tx_ref = db.collection("transactions").document()
+    return {
+        "ok": True,
+        "count": len(rows),
+        "total": int(signed_amount) * len(rows),
+        "rows": rows,
+    }
 
-        @mongo.transactional
-        def _do(transaction):
-            snap = student_ref.get(transaction=transaction)
-            bal = int((snap.to_dict() or {}).get("balance", 0))
-            new_bal = bal + amount
-            transaction.update(student_ref, {"balance": new_bal})
-            transaction.set(
-                tx_ref,
-                {
-                    "student_id": student_id,
-                    "type": "deposit",
-                    "amount": amount,
-                    "balance_after": new_bal,
-                    "memo": memo,
-                    "recorder": recorder,
-                    "created_at": datetime.utcnow(),
-                },
-            )
 
-        _do(db.transaction())
-        count += 1
+def api_admin_bulk_deposit(admin_pin: str, amount: int, memo: str):
+    """✅ 전체 일괄 지급"""
+    if not is_admin_pin(admin_pin):
+        return {"ok": False, "error": "관리자 PIN이 틀립니다."}
+    amount = int(amount or 0)
+    memo = (memo or "").strip() or "일괄 지급"
+    recorder = _get_recorder_label(True, str(globals().get("login_name", "") or "").strip())
+    if amount <= 0:
+        return {"ok": False, "error": "금액은 1 이상이어야 합니다."}
 
-    api_list_accounts_cached.clear()
-    return {"ok": True, "count": count}
+    return _bulk_post_active_students(int(amount), "deposit", memo, recorder)
 
 
 def api_admin_bulk_withdraw(admin_pin: str, amount: int, memo: str):
@@ -1618,37 +2167,7 @@ def api_admin_bulk_withdraw(admin_pin: str, amount: int, memo: str):
     if amount <= 0:
         return {"ok": False, "error": "금액은 1 이상이어야 합니다."}
 
-    docs = list(db.collection("students").where(filter=build_filter("is_active", "==", True)).stream())
-    count = 0
-    for d in docs:
-        student_id = d.id
-        student_ref = db.collection("students").document(student_id)
-        tx_ref = db.collection("transactions").document()
-
-        @mongo.transactional
-        def _do(transaction):
-            snap = student_ref.get(transaction=transaction)
-            bal = int((snap.to_dict() or {}).get("balance", 0))
-            new_bal = bal - amount
-            transaction.update(student_ref, {"balance": new_bal})
-            transaction.set(
-                tx_ref,
-                {
-                    "student_id": student_id,
-                    "type": "withdraw",
-                    "amount": -amount,
-                    "balance_after": new_bal,
-                    "memo": memo,
-                    "recorder": recorder,
-                    "created_at": datetime.utcnow(),
-                },
-            )
-
-        _do(db.transaction())
-        count += 1
-
-    api_list_accounts_cached.clear()
-    return {"ok": True, "count": count}
+    return _bulk_post_active_students(-int(amount), "withdraw", memo, recorder)
 
 
 def api_admin_upsert_template(admin_pin: str, template_id: str, base_label: str, category: str, kind: str, amount: int, order: int):
@@ -1685,7 +2204,6 @@ def api_admin_upsert_template(admin_pin: str, template_id: str, base_label: str,
     else:
         db.collection("templates").document().set(payload)
 
-    api_list_templates_cached.clear()
     return {"ok": True}
 
 
@@ -1696,7 +2214,6 @@ def api_admin_delete_template(admin_pin: str, template_id: str):
     if not template_id:
         return {"ok": False, "error": "template_id가 필요합니다."}
     db.collection("templates").document(template_id).delete()
-    api_list_templates_cached.clear()
     return {"ok": True}
 
 
@@ -1720,7 +2237,6 @@ def api_admin_backfill_template_order(admin_pin: str):
             batch.set(ref, {"order": idx}, merge=True)
     batch.commit()
 
-    api_list_templates_cached.clear()
     return {"ok": True, "count": len(items)}
 
 
@@ -1749,7 +2265,6 @@ def api_admin_normalize_template_order(admin_pin: str):
         batch.set(ref, {"order": idx}, merge=True)
     batch.commit()
 
-    api_list_templates_cached.clear()
     return {"ok": True, "count": len(items)}
 
 
@@ -1765,7 +2280,6 @@ def api_admin_save_template_orders(admin_pin: str, ordered_template_ids: list[st
             batch.set(ref, {"order": idx}, merge=True)
         batch.commit()
 
-        api_list_templates_cached.clear()
         return {"ok": True, "count": len(ordered_template_ids)}
     except Exception as e:
         return {"ok": False, "error": str(e)}
@@ -1807,8 +2321,8 @@ def _decode_stat_statuses(raw_statuses: dict) -> dict:
     return out
 
 
-@st.cache_data(ttl=60, show_spinner=False)
-def api_list_stat_templates_cached():
+@st.cache_data(ttl=1800, show_spinner=False, max_entries=16)
+def _api_list_stat_templates_cached(gen: int):
     docs = db.collection("stat_templates").stream()
     items = []
     for d in docs:
@@ -1825,28 +2339,101 @@ def api_list_stat_templates_cached():
     return {"ok": True, "templates": items}
 
 
-@st.cache_data(ttl=30, show_spinner=False)
-def api_list_stat_submissions_cached(limit_cols: int = 10):
+def api_list_stat_templates_cached():
+    return _api_list_stat_templates_cached(cache_generations.collection_gen("stat_templates"))
+
+
+# =========================
+# ✅ 통계청 제출물: 열(column) 단위 표현 + 페이지 로딩
+# - student_ids: 공통 학생 인덱스 / 제출물(열)마다 codes 문자열 1개 ("0"=X, "1"=O, "2"=△, 인덱스 순)
+# - 최신순 STAT_PAGE_COLS개씩 페이지 캐시 → "더 불러오기"는 다음 페이지만 조회
+# =========================
+STAT_STATUS_CHARS = ("X", "O", "△")
+STAT_PAGE_COLS = 28
+
+
+def _stat_status_code(v) -> str:
+    return str(STAT_STATUS_CHARS.index(_norm_status(v)))
+
+
+@st.cache_data(ttl=1800, show_spinner=False, max_entries=64)
+def _api_stat_columns_page(gen: int, page: int, page_size: int):
     q = (
         db.collection("stat_submissions")
         .order_by("created_at", direction=mongo.Query.DESCENDING)
-        .limit(int(limit_cols))
+        .offset(int(page) * int(page_size))
+        .limit(int(page_size) + 1)
         .stream()
     )
-    rows = []
+    metas, maps = [], []
     for d in q:
         s = d.to_dict() or {}
-        rows.append(
+        metas.append(
             {
                 "submission_id": d.id,
                 "label": str(s.get("label", "") or ""),
                 "date_iso": str(s.get("date_iso", "") or ""),
                 "date_display": str(s.get("date_display", "") or ""),
                 "created_at": _to_utc_datetime(s.get("created_at")),
-                "statuses": _decode_stat_statuses(s.get("statuses", {}) or {}),
             }
         )
-    return {"ok": True, "rows": rows}
+        maps.append(_decode_stat_statuses(s.get("statuses", {}) or {}))
+
+    has_more = len(metas) > int(page_size)
+    metas, maps = metas[: int(page_size)], maps[: int(page_size)]
+    student_ids = tuple(sorted({sid for m in maps for sid in m}))
+    columns = [
+        {**meta, "codes": "".join(_stat_status_code(m.get(sid, "X")) for sid in student_ids)}
+        for meta, m in zip(metas, maps)
+    ]
+    return {"student_ids": student_ids, "columns": columns, "has_more": has_more}
+
+
+def api_list_stat_columns(limit_cols: int = 10) -> dict:
+    """
+    최신 limit_cols개 제출물(최신→과거)을 열 단위로
+    - return: {"ok", "student_ids", "columns": [{submission_id, label, date_iso, date_display, created_at, codes}], "has_more"}
+    """
+    limit_cols = max(0, int(limit_cols))
+    gen = cache_generations.collection_gen("stat_submissions")
+    pages, n_cols, page = [], 0, 0
+    while n_cols < limit_cols:
+        p = _api_stat_columns_page(gen, page, STAT_PAGE_COLS)
+        pages.append(p)
+        n_cols += len(p["columns"])
+        page += 1
+        if not p["has_more"]:
+            break
+
+    student_ids = sorted({sid for p in pages for sid in p["student_ids"]})
+    columns = []
+    for p in pages:
+        if list(p["student_ids"]) == student_ids:
+            columns.extend(p["columns"])
+            continue
+        # 페이지마다 학생 인덱스가 다르면 공통 인덱스로 다시 정렬(없는 학생은 X)
+        pos = {sid: k for k, sid in enumerate(p["student_ids"])}
+        for c in p["columns"]:
+            codes = c["codes"]
+            columns.append({**c, "codes": "".join(codes[pos[sid]] if sid in pos else "0" for sid in student_ids)})
+
+    has_more = bool(pages and pages[-1]["has_more"]) or len(columns) > limit_cols
+    return {"ok": True, "student_ids": student_ids, "columns": columns[:limit_cols], "has_more": has_more}
+
+
+def _stat_columns_to_rows(res: dict) -> list[dict]:
+    """열 단위 결과 → 기존 행 형식({..., "statuses": {학생ID: 상태}})"""
+    student_ids = list(res.get("student_ids", []) or [])
+    rows = []
+    for c in res.get("columns", []) or []:
+        row = {k: v for k, v in c.items() if k != "codes"}
+        row["statuses"] = {sid: STAT_STATUS_CHARS[int(ch)] for sid, ch in zip(student_ids, c["codes"])}
+        rows.append(row)
+    return rows
+
+
+def api_list_stat_submissions_cached(limit_cols: int = 10):
+    return {"ok": True, "rows": _stat_columns_to_rows(api_list_stat_columns(limit_cols))}
 
 
 def api_admin_upsert_stat_template(admin_pin: str, template_id: str, label: str, order: int):
@@ -1893,7 +2480,6 @@ def api_admin_upsert_stat_template(admin_pin: str, template_id: str, label: str,
         batch.set(ref, payload, merge=True)
     batch.commit()
 
-    api_list_stat_templates_cached.clear()
     return {"ok": True}
 
 
@@ -1904,7 +2490,6 @@ def api_admin_delete_stat_template(admin_pin: str, template_id: str):
     if not template_id:
         return {"ok": False, "error": "template_id가 필요합니다."}
     db.collection("stat_templates").document(template_id).delete()
-    api_list_stat_templates_cached.clear()
     return {"ok": True}
 
 
@@ -1937,16 +2522,23 @@ def api_admin_add_stat_submission(admin_pin: str, label: str, active_accounts: l
             "created_at": datetime.utcnow(),
         }
     )
-
-    api_list_stat_submissions_cached.clear()
+    credit_engine_add_submission(_decode_stat_statuses(statuses))
     return {"ok": True}
 
 
-def api_admin_save_stat_table(admin_pin: str, submission_ids: list[str], edited: dict, accounts: list[dict]):
+def api_admin_save_stat_table(
+    admin_pin: str,
+    submission_ids: list[str],
+    edited: dict,
+    accounts: list[dict],
+    loaded_rows: list[dict] | None = None,
+):
     """
     ✅ 표 상단 저장버튼:
     - 클릭 때마다 DB 저장 금지(로컬 상태만 변경)
-    - 저장 버튼 누를 때 제출물(컬럼) 단위로 statuses map을 한 번에 업데이트(컬럼 수만큼 write)
+    - 저장 버튼 누를 때 편집본을 불러온 값(loaded_rows = 표가 불러온 제출물 행)과 비교해
+      바뀐 칸만 statuses.<학생ID> 경로로 $set (제출물당 1 update, 전체 bulk write 1회)
+    - 바뀐 칸의 학생만 신용 엔진 재계산
     """
     if not is_admin_pin(admin_pin):
         return {"ok": False, "error": "관리자 PIN이 틀립니다."}
@@ -1955,25 +2547,45 @@ def api_admin_save_stat_table(admin_pin: str, submission_ids: list[str], edited:
 
     # 활성 학생 목록 (계정 추가 시 자동 반영)
     active_sids = [str(a.get("student_id", "") or "") for a in (accounts or []) if str(a.get("student_id", "") or "")]
-    active_sids_set = set(active_sids)
 
+    # 비교 기준: 화면이 불러온 행 (없으면 DB에서 직접)
+    if loaded_rows is None:
+        before = {
+            snap.id: _decode_stat_statuses((snap.to_dict() or {}).get("statuses", {}) or {})
+            for snap in db.collection("stat_submissions").get_many([str(x) for x in submission_ids])
+        }
+    else:
+        before = {str(r.get("submission_id")): dict(r.get("statuses", {}) or {}) for r in loaded_rows}
+
+    changed_sids = set()
+    changed_subs = 0
     batch = db.batch()
     for sub_id in submission_ids:
         sub_id = str(sub_id)
-        ref = db.collection("stat_submissions").document(sub_id)
-
-        # 기존 + 편집본 병합: 활성 학생은 모두 키가 존재하도록 보정
+        old_map = before.get(sub_id, {})
         cur_map = dict((edited or {}).get(sub_id, {}) or {})
-        merged = {}
+
+        # 없는 칸은 X로 읽히므로(기본값) 활성 학생 중 값이 달라진 칸만 기록
+        diff = {}
         for sid in active_sids:
             v = str(cur_map.get(sid, "X") or "X")
-            merged[_stat_status_key_encode(sid)] = v if v in ("X", "O", "△") else "X"
-            
-        batch.set(ref, {"statuses": merged}, merge=True)
-
-    batch.commit()
-    api_list_stat_submissions_cached.clear()
-    return {"ok": True, "count": len(submission_ids)}
+            v = v if v in ("X", "O", "△") else "X"
+            if _norm_status(old_map.get(sid, "X")) != v:
+                diff[f"statuses.{_stat_status_key_encode(sid)}"] = v
+                changed_sids.add(sid)
+        if diff:
+            batch.update(db.collection("stat_submissions").document(sub_id), diff)
+            changed_subs += 1
+
+    if not changed_subs:
+        return {"ok": True, "count": 0}
+    try:
+        batch.commit()
+    except BatchWriteError as e:
+        credit_engine_recompute(sorted(changed_sids))
+        return {"ok": False, "error": f"일부 제출물 저장 실패: {', '.join(e.failed_ids)}"}
+    credit_engine_recompute(sorted(changed_sids))
+    return {"ok": True, "count": changed_subs}
 
 
 def api_admin_delete_stat_submission(admin_pin: str, submission_id: str):
@@ -1982,9 +2594,37 @@ def api_admin_delete_stat_submission(admin_pin: str, submission_id: str):
     submission_id = (submission_id or "").strip()
     if not submission_id:
         return {"ok": False, "error": "submission_id가 필요합니다."}
-    db.collection("stat_submissions").document(submission_id).delete()
-    api_list_stat_submissions_cached.clear()
-    return {"ok": True}
+    return api_admin_delete_stat_submissions(admin_pin, [submission_id])
+
+
+def api_admin_delete_stat_submissions(admin_pin: str, submission_ids: list[str] | None = None):
+    """
+    ✅ 제출물 여러 개를 bulk write 1회로 삭제 (submission_ids=None이면 전체)
+    - 중간 칸이 빠지면 이후 누적(클램프)이 모두 달라지므로 삭제 후 신용 전체 재계산 1회
+    """
+    if not is_admin_pin(admin_pin):
+        return {"ok": False, "error": "관리자 PIN이 틀립니다."}
+    if submission_ids is None:
+        ids = [d.id for d in db.collection("stat_submissions").select([]).stream()]
+    else:
+        ids = [x for x in dict.fromkeys(str(x or "").strip() for x in submission_ids) if x]
+    if not ids:
+        return {"ok": True, "count": 0}
+
+    batch = db.batch()
+    for sub_id in ids:
+        batch.delete(db.collection("stat_submissions").document(sub_id))
+    try:
+        batch.commit()
+    except BatchWriteError as e:
+        credit_engine_recompute()
+        return {
+            "ok": False,
+            "count": len(ids) - len(e.failed_ids),
+            "error": f"일부 제출물 삭제 실패: {', '.join(e.failed_ids)}",
+        }
+    credit_engine_recompute()
+    return {"ok": True, "count": len(ids)}
 
 
 def _cycle_mark(v: str) -> str:
@@ -2019,7 +2659,6 @@ def api_create_account(name, pin):
             "created_at": datetime.utcnow(),
         }
     )
-    api_list_accounts_cached.clear()
     return {"ok": True}
 
 def api_delete_account(name, pin):
@@ -2027,7 +2666,6 @@ def api_delete_account(name, pin):
     if not doc:
         return {"ok": False, "error": "이름 또는 비밀번호가 틀립니다."}
     db.collection("students").document(doc.id).update({"is_active": False})
-    api_list_accounts_cached.clear()
     return {"ok": True}
 
 def api_change_pin_student(name: str, old_pin: str, new_pin: str):
@@ -2050,8 +2688,7 @@ def api_change_pin_student(name: str, old_pin: str, new_pin: str):
     if not doc:
         return {"ok": False, "error": "이름 또는 기존 비밀번호가 틀립니다."}
 
-    db.collection("students").document(doc.id).update({"pin": str(new_pin)})
-    api_list_accounts_cached.clear()
+    db.collection("students").document(doc.id).update({"pin": str(new_pin), "auth_version": _new_auth_version()})
     return {"ok": True}
 
 def api_admin_set_role(admin_pin: str, student_id: str, role_id: str):
@@ -2059,13 +2696,54 @@ def api_admin_set_role(admin_pin: str, student_id: str, role_id: str):
         return {"ok": False, "error": "관리자 PIN이 틀립니다."}
     if not student_id:
         return {"ok": False, "error": "student_id가 없습니다."}
-    db.collection("students").document(student_id).update({"role_id": str(role_id or "")})
-    api_list_accounts_cached.clear()
+    db.collection("students").document(student_id).update(
+        {"role_id": str(role_id or ""), "auth_version": _new_auth_version()}
+    )
     return {"ok": True}
 
 # =========================
 # Transactions (너 코드 그대로)
 # =========================
+def _post_student_tx(
+    student_id: str,
+    amount: int,
+    tx_type: str,
+    memo: str,
+    recorder: str,
+    min_balance: int | None = None,
+    extra: dict | None = None,
+    insufficient_msg: str = "잔액이 부족합니다.",
+    not_found_msg: str = "계정을 찾지 못했습니다.",
+) -> int:
+    """✅ 학생 잔액 변경 + transactions 기록(공용 장부 엔진)
+    - 잔액은 서버 측 $inc 1회로 반영(find_one_and_update) → 동시 클릭에도 갱신 유실 없음
+    - min_balance 지정 시 '잔액 부족' 검사도 같은 왕복에서 처리
+    - return: balance_after
+    """
+    tx_data = {
+        "student_id": str(student_id),
+        "type": str(tx_type),
+        "amount": int(amount),
+        "memo": memo,
+        "recorder": recorder,
+        "created_at": datetime.utcnow(),
+    }
+    if extra:
+        tx_data.update(extra)
+    try:
+        res = db.post_ledger(str(student_id), int(amount), tx_data, min_balance=min_balance)
+    except InsufficientBalance:
+        raise ValueError(insufficient_msg) from None
+    except AccountNotFound:
+        raise ValueError(not_found_msg) from None
+    return int(res.get("balance_after", 0) or 0)
+
+
+def _reverse_student_tx(student_id: str, amount: int, memo: str, recorder: str) -> int:
+    """✅ 이미 반영한 학생 거래를 반대 금액으로 되돌림(국고 반영 실패 등 후속 단계 실패 시)"""
+    return _post_student_tx(str(student_id), -int(amount), "revert", f"{memo} (처리 실패로 취소)", recorder)
+
+
 def api_add_tx(name, pin, memo, deposit, withdraw):
     """✅ 학생 거래(국고 반영 없는 기본 버전)"""
     memo = (memo or "").strip()
@@ -2081,38 +2759,14 @@ def api_add_tx(name, pin, memo, deposit, withdraw):
     if not student_doc:
         return {"ok": False, "error": "이름 또는 비밀번호가 틀립니다."}
 
-    student_ref = db.collection("students").document(student_doc.id)
-    tx_ref = db.collection("transactions").document()
     recorder = str((student_doc.to_dict() or {}).get("name", "") or name or "")
 
     amount = deposit if deposit > 0 else -withdraw
     tx_type = "deposit" if deposit > 0 else "withdraw"
 
-    @mongo.transactional
-    def _do(transaction):
-        snap = student_ref.get(transaction=transaction)
-        bal = int((snap.to_dict() or {}).get("balance", 0) or 0)
-
-        # ✅ 관리자 출금은 잔액 부족이어도 허용(벌금 등 음수 잔액 반영)
-
-        new_bal = int(bal + amount)
-        transaction.update(student_ref, {"balance": int(new_bal)})
-        transaction.set(
-            tx_ref,
-            {
-                "student_id": student_doc.id,
-                "type": tx_type,
-                "amount": int(amount),
-                "balance_after": int(new_bal),
-                "memo": memo,
-                "recorder": recorder,
-                "created_at": datetime.utcnow(),
-            },
-        )
-        return new_bal
-
     try:
-        new_bal = _do(db.transaction())
+        # ✅ 관리자 출금은 잔액 부족이어도 허용(벌금 등 음수 잔액 반영)
+        new_bal = _post_student_tx(student_doc.id, amount, tx_type, memo, recorder)
         return {"ok": True, "balance": int(new_bal)}
     except ValueError as e:
         return {"ok": False, "error": str(e)}
@@ -2145,41 +2799,14 @@ def api_admin_add_tx_by_student_id(
     if not student_id:
         return {"ok": False, "error": "student_id가 없습니다."}
 
-    student_ref = db.collection("students").document(str(student_id))
-    tx_ref = db.collection("transactions").document()
     recorder = _get_admin_action_recorder(recorder_override)
     
     amount = deposit if deposit > 0 else -withdraw
     tx_type = "deposit" if deposit > 0 else "withdraw"
 
-    @mongo.transactional
-    def _do(transaction):
-        snap = student_ref.get(transaction=transaction)
-        if not snap.exists:
-            raise ValueError("계정을 찾지 못했습니다.")
-        bal = int((snap.to_dict() or {}).get("balance", 0) or 0)
-
-        # ✅ 관리자 출금은 잔액 부족이어도 허용(벌금 등 음수 잔액 반영)
-
-        new_bal = int(bal + amount)
-        transaction.update(student_ref, {"balance": int(new_bal)})
-        transaction.set(
-            tx_ref,
-            {
-                "student_id": str(student_id),
-                "type": tx_type,
-                "amount": int(amount),
-                "balance_after": int(new_bal),
-                "memo": memo,
-                "recorder": recorder,
-                "created_at": datetime.utcnow(),
-            },
-        )
-        return new_bal
-
     try:
-        new_bal = _do(db.transaction())
-        api_list_accounts_cached.clear()
+        # ✅ 관리자 출금은 잔액 부족이어도 허용(벌금 등 음수 잔액 반영)
+        new_bal = _post_student_tx(str(student_id), amount, tx_type, memo, recorder)
         return {"ok": True, "balance": int(new_bal)}
     except ValueError as e:
         return {"ok": False, "error": str(e)}
@@ -2217,44 +2844,19 @@ def api_broker_deposit_by_student_id(actor_student_id: str, student_id: str, mem
             rid = str(actor.get("role_id", "") or "")
             if not rid:
                 return {"ok": False, "error": "투자 회수 권한이 없습니다."}
-            roles = api_list_roles_cached()
-            role_name = ""
-            for r in roles:
-                if str(r.get("role_id")) == rid:
-                    role_name = str(r.get("role_name", "") or "")
-                    break
-            if role_name != "투자증권":
+            if _role_name(rid) != "투자증권":
                 return {"ok": False, "error": "투자 회수 권한이 없습니다."}
         except Exception:
             return {"ok": False, "error": "권한 확인 실패."}
 
-        student_ref = db.collection("students").document(student_id)
-        tx_ref = db.collection("transactions").document()
-
-        @mongo.transactional
-        def _do(transaction):
-            snap = student_ref.get(transaction=transaction)
-            if not snap.exists:
-                raise ValueError("대상 학생을 찾지 못했어요.")
-            bal = int((snap.to_dict() or {}).get("balance", 0) or 0)
-            new_bal = bal + int(deposit)
-
-            transaction.update(student_ref, {"balance": new_bal})
-            transaction.set(
-                tx_ref,
-                {
-                    "student_id": student_id,
-                    "type": "deposit",
-                    "amount": int(deposit),
-                    "balance_after": new_bal,
-                    "memo": memo,
-                    "recorder": _get_admin_action_recorder(),
-                    "created_at": datetime.utcnow(),
-                },
-            )
-            return new_bal
-
-        new_bal = _do(db.transaction())
+        new_bal = _post_student_tx(
+            student_id,
+            int(deposit),
+            "deposit",
+            memo,
+            _get_admin_action_recorder(),
+            not_found_msg="대상 학생을 찾지 못했어요.",
+        )
         return {"ok": True, "balance": int(new_bal)}
     except Exception as e:
         return {"ok": False, "error": str(e)}
@@ -2262,26 +2864,17 @@ def api_broker_deposit_by_student_id(actor_student_id: str, student_id: str, mem
 def api_get_txs_by_student_id(student_id: str, limit=200):
     if not student_id:
         return {"ok": False, "error": "student_id가 없습니다."}
-    try:
-        q = (
-            db.collection("transactions")
-            .where(filter=build_filter("student_id", "==", student_id))
-            .order_by("created_at", direction=mongo.Query.DESCENDING)
-            .limit(int(limit))
-            .stream()
-        )
-        tx_docs = list(q)
-    except Exception:
-        # 신규 배포 환경에서 복합 인덱스가 준비되지 않은 경우를 대비
-        fallback_q = (
-            db.collection("transactions")
-            .where(filter=build_filter("student_id", "==", student_id))
-            .stream()
-        )
-        tx_docs = list(fallback_q)
-        
+    # transactions(student_id, created_at desc) 인덱스로 최신순 limit 조회
+    q = (
+        db.collection("transactions")
+        .where(filter=build_filter("student_id", "==", student_id))
+        .order_by("created_at", direction=mongo.Query.DESCENDING)
+        .limit(int(limit))
+        .stream()
+    )
+
     rows = []
-    for d in tx_docs:
+    for d in q:
         tx = d.to_dict() or {}
         created_dt_utc = _to_utc_datetime(tx.get("created_at"))
         amt = int(tx.get("amount", 0) or 0)
@@ -2300,8 +2893,6 @@ def api_get_txs_by_student_id(student_id: str, limit=200):
             }
         )
 
-    rows.sort(key=lambda x: x.get("created_at_utc") or datetime.min.replace(tzinfo=timezone.utc), reverse=True)
-    rows = rows[: int(limit)]
     return {"ok": True, "rows": rows}
 
 def api_get_balance(login_name, login_pin):
@@ -2505,18 +3096,6 @@ def api_admin_approve_deposit_request(admin_pin: str, request_id: str):
 
     try:
         new_bal = _do(db.transaction())
-
-        # 캐시 갱신
-        try:
-            api_list_accounts_cached.clear()
-        except Exception:
-            pass
-        try:
-            api_get_treasury_state_cached.clear()
-            api_list_treasury_ledger_cached.clear()
-        except Exception:
-            pass
-
         return {"ok": True, "balance": int(new_bal)}
     except ValueError as e:
         return {"ok": False, "error": str(e)}
@@ -2745,16 +3324,19 @@ def render_deposit_approval_ui(admin_pin: str, prefix: str = "dep_approve", allo
 # =========================
 # Admin rollback (너 코드 그대로)
 # =========================
-def _already_rolled_back(student_id: str, tx_id: str) -> bool:
+def _rolled_back_tx_ids(student_id: str, tx_ids: list[str]) -> set[str]:
+    """tx_ids 중 이미 rollback 기록이 있는 거래 id 집합(related_tx in [...] 조회 1회)."""
+    if not tx_ids:
+        return set()
     q = (
         db.collection("transactions")
         .where(filter=build_filter("student_id", "==", student_id))
         .where(filter=build_filter("type", "==", "rollback"))
-        .where(filter=build_filter("related_tx", "==", tx_id))
-        .limit(1)
+        .where(filter=build_filter("related_tx", "in", list(tx_ids)))
+        .select(["related_tx"])
         .stream()
     )
-    return len(list(q)) > 0
+    return {str((d.to_dict() or {}).get("related_tx", "") or "") for d in q}
 
 def api_admin_rollback_selected(admin_pin: str, student_id: str, tx_ids: list[str]):
     if not is_admin_pin(admin_pin):
@@ -2764,19 +3346,21 @@ def api_admin_rollback_selected(admin_pin: str, student_id: str, tx_ids: list[st
 
     student_ref = db.collection("students").document(student_id)
 
+    # ✅ 선택 거래를 $in 1회로 조회(거래당 get 1회 → 전체 1회)
     tx_docs = []
-    for tid in tx_ids:
-        snap = db.collection("transactions").document(tid).get()
+    for snap in db.collection("transactions").get_many(tx_ids):
         if not snap.exists:
             continue
         tx = snap.to_dict() or {}
         if tx.get("student_id") != student_id:
             continue
-        tx_docs.append((tid, tx))
+        tx_docs.append((snap.id, tx))
 
     if not tx_docs:
         return {"ok": False, "error": "유효한 거래를 찾지 못했습니다."}
 
+    rolled_back = _rolled_back_tx_ids(student_id, [tid for tid, _ in tx_docs])
+
     blocked, valid = [], []
     for tid, tx in tx_docs:
         ttype = str(tx.get("type", "") or "")
@@ -2790,7 +3374,7 @@ def api_admin_rollback_selected(admin_pin: str, student_id: str, tx_ids: list[st
         if _is_invest_memo(memo):
             blocked.append((tid, "투자 내역"))
             continue
-        if _already_rolled_back(student_id, tid):
+        if tid in rolled_back:
             blocked.append((tid, "이미 되돌린 거래"))
             continue
         valid.append((tid, tx))
@@ -2896,8 +3480,8 @@ def api_savings_list_by_student_id(student_id: str):
                         "interest": int(s.get("interest", 0) or 0),
 
                         # ✅ 둘 중 뭐가 와도 처리
-                        "start_date": _to_utc_datetime(s.get("start_date") or s.get("start_utc") or s.get("created_at")),
-                        "maturity_date": _to_utc_datetime(s.get("maturity_date") or s.get("maturity_utc")),
+                        "start_date": _to_utc_datetime(s.get("start_utc") or s.get("start_date") or s.get("created_at")),
+                        "maturity_date": _to_utc_datetime(s.get("maturity_utc") or s.get("maturity_date")),
 
                         # ✅ 상태도 스키마 차이 흡수
                         "status": str(s.get("status", "active") or "active"),
@@ -2992,8 +3576,8 @@ def api_savings_create(login_name: str, login_pin: str, principal: int, weeks: i
                 "principal": principal,
                 "weeks": weeks,
                 "interest": interest,
-                "start_date": datetime.utcnow(),
-                "maturity_date": maturity_date,
+                "start_utc": datetime.now(timezone.utc),
+                "maturity_utc": maturity_date,
                 "status": "active",
             },
         )
@@ -3072,27 +3656,22 @@ def api_process_maturities(login_name: str, login_pin: str):
     if not student_doc:
         return {"ok": False, "error": "이름 또는 비밀번호가 틀립니다."}
 
-    student_ref = db.collection("students").document(student_doc.id)
     now = datetime.now(timezone.utc)
 
     q = (
         db.collection(SAV_COL if "SAV_COL" in globals() else "savings")
         .where(filter=build_filter("student_id", "==", student_doc.id))
         .where(filter=build_filter("status", "==", "active"))
+        .where(filter=build_filter("maturity_utc", "<=", now))
         .stream()
     )
 
-    matured = []
-    for d in q:
-        s = d.to_dict() or {}
-        m_dt = _to_utc_datetime(s.get("maturity_date"))
-        if m_dt and m_dt <= now:
-            matured.append((d.id, s))
+    matured = [(d.id, d.to_dict() or {}) for d in q]
 
     if not matured:
         return {"ok": True, "matured_count": 0, "paid_total": 0}
 
-    matured_count, paid_total = 0, 0
+    matured_count, paid_total, errors = 0, 0, []
     for sid, s in matured:
         principal = int(s.get("principal", 0) or 0)
         interest = int(s.get("interest", 0) or 0)
@@ -3100,34 +3679,28 @@ def api_process_maturities(login_name: str, login_pin: str):
         weeks = int(s.get("weeks", 0) or 0)
 
         savings_ref = db.collection(SAV_COL if "SAV_COL" in globals() else "savings").document(sid)
-        tx_ref = db.collection("transactions").document()
-
-        @mongo.transactional
-        def _do_one(transaction):
-            st_snap = student_ref.get(transaction=transaction)
-            bal = int((st_snap.to_dict() or {}).get("balance", 0) or 0)
-            new_bal = bal + amount
 
-            transaction.update(student_ref, {"balance": new_bal})
-            transaction.update(savings_ref, {"status": "matured"})
-            transaction.set(
-                tx_ref,
-                {
-                    "student_id": student_doc.id,
-                    "type": "maturity",
-                    "amount": amount,
-                    "balance_after": new_bal,
-                    "memo": f"적금 만기({weeks}주)",
-                    "recorder": _get_recorder_label(False, str((student_doc.to_dict() or {}).get("name", "") or login_name or "")),
-                    "created_at": datetime.utcnow(),
-                },
+        # ✅ 상태 전환(active→matured)을 조건부 update로 선점 → 다른 실행과 중복 지급 방지
+        if not savings_ref.update_if({"status": "matured"}, [build_filter("status", "==", "active")]):
+            continue
+        try:
+            _post_student_tx(
+                student_doc.id,
+                amount,
+                "maturity",
+                f"적금 만기({weeks}주)",
+                _get_recorder_label(False, str((student_doc.to_dict() or {}).get("name", "") or login_name or "")),
             )
-            return new_bal
-
-        _do_one(db.transaction())
+        except Exception as e:
+            # 지급 실패 → 선점 해제(active 복구)해서 다음 실행에서 다시 지급
+            savings_ref.update_if({"status": "active"}, [build_filter("status", "==", "matured")])
+            errors.append(f"적금 만기({weeks}주) 지급 실패: {e}")
+            continue
         matured_count += 1
         paid_total += amount
 
+    if errors:
+        return {"ok": False, "error": " / ".join(errors), "matured_count": matured_count, "paid_total": paid_total}
     return {"ok": True, "matured_count": matured_count, "paid_total": paid_total}
 
 # =========================
@@ -3136,8 +3709,8 @@ def api_process_maturities(login_name: str, login_pin: str):
 
 TREASURY_UNIT = "드림"   # ✅ 표시 단위만 드림(시스템 숫자는 그대로 int)
 
-@st.cache_data(ttl=30, show_spinner=False)
-def api_get_treasury_state_cached():
+@st.cache_data(ttl=300, show_spinner=False, max_entries=16)
+def _api_get_treasury_state_cached(gen: int):
     ref = db.collection("treasury").document("state")
     snap = ref.get()
     if not snap.exists:
@@ -3146,6 +3719,10 @@ def api_get_treasury_state_cached():
     d = snap.to_dict() or {}
     return {"ok": True, "balance": int(d.get("balance", 0) or 0)}
 
+
+def api_get_treasury_state_cached():
+    return _api_get_treasury_state_cached(cache_generations.collection_gen("treasury"))
+
 def api_add_treasury_tx(
     admin_pin: str,
     memo: str,
@@ -3215,8 +3792,6 @@ def api_add_treasury_tx(
 
     try:
         new_bal = _do(db.transaction())
-        api_get_treasury_state_cached.clear()
-        api_list_treasury_ledger_cached.clear()
         return {"ok": True, "balance": int(new_bal)}
     except Exception as e:
         return {"ok": False, "error": f"국고 저장 실패: {e}"}
@@ -3295,8 +3870,6 @@ def api_add_tx_with_treasury(name, pin, memo, deposit, withdraw, apply_treasury:
     if not student_doc:
         return {"ok": False, "error": "이름 또는 비밀번호가 틀립니다."}
 
-    student_ref = db.collection("students").document(student_doc.id)
-    tx_ref = db.collection("transactions").document()
     recorder = str((student_doc.to_dict() or {}).get("name", "") or name or "")
 
     amount = deposit if deposit > 0 else -withdraw
@@ -3311,45 +3884,35 @@ def api_add_tx_with_treasury(name, pin, memo, deposit, withdraw, apply_treasury:
 
     @mongo.transactional
     def _do(transaction):
-        snap = student_ref.get(transaction=transaction)
-        bal = int((snap.to_dict() or {}).get("balance", 0))
-
-        # 일반 출금은 잔액 부족이면 불가
-        if tx_type == "withdraw" and bal < withdraw:
-            raise ValueError("잔액보다 큰 출금은 불가합니다.")
+        # 일반 출금은 잔액 부족이면 불가(잔액 가드는 $inc와 같은 왕복에서 검사)
+        new_bal = _post_student_tx(
+            student_doc.id,
+            amount,
+            tx_type,
+            memo,
+            recorder,
+            min_balance=0 if tx_type == "withdraw" else None,
+            insufficient_msg="잔액보다 큰 출금은 불가합니다.",
+        )
 
-        # ✅ 국고 반영(같은 트랜잭션) - 반드시 WRITE(학생/tx) 전에 처리(READ 먼저!)
+        # ✅ 국고 반영 - 학생 장부가 확정된 뒤에만 처리(잔액 부족 시 국고 미반영)
         if tre_signed != 0:
-            _treasury_apply_in_transaction(
-                transaction,
-                memo=str(treasury_memo or memo),
-                signed_amount=int(tre_signed),
-                actor=str(actor or "auto"),
-                recorder_override=recorder,
-            )
-
-        new_bal = bal + amount
-        transaction.update(student_ref, {"balance": new_bal})
-        transaction.set(
-            tx_ref,
-            {
-                "student_id": student_doc.id,
-                "type": tx_type,
-                "amount": amount,
-                "balance_after": new_bal,
-                "memo": memo,
-                "recorder": recorder,
-                "created_at": datetime.utcnow(),
-            },
-        )
+            try:
+                _treasury_apply_in_transaction(
+                    transaction,
+                    memo=str(treasury_memo or memo),
+                    signed_amount=int(tre_signed),
+                    actor=str(actor or "auto"),
+                    recorder_override=recorder,
+                )
+            except Exception:
+                _reverse_student_tx(student_doc.id, amount, memo, recorder)
+                raise
 
         return new_bal
 
     try:
         new_bal = _do(db.transaction())
-        # 캐시 갱신
-        api_get_treasury_state_cached.clear()
-        api_list_treasury_ledger_cached.clear()
         return {"ok": True, "balance": new_bal}
     except ValueError as e:
         return {"ok": False, "error": str(e)}
@@ -3383,8 +3946,6 @@ def api_admin_add_tx_by_student_id_with_treasury(
     if not student_id:
         return {"ok": False, "error": "student_id가 없습니다."}
 
-    student_ref = db.collection("students").document(student_id)
-    tx_ref = db.collection("transactions").document()
     recorder = _get_admin_action_recorder(recorder_override)
     
     amount = deposit if deposit > 0 else -withdraw
@@ -3396,44 +3957,28 @@ def api_admin_add_tx_by_student_id_with_treasury(
 
     @mongo.transactional
     def _do(transaction):
-        snap = student_ref.get(transaction=transaction)
-        bal = int((snap.to_dict() or {}).get("balance", 0))
-
         # ✅ 관리자 모드(💰입금/출금): 출금 시 잔액 부족이어도 허용
         #    (벌금 등으로 통장 음수 반영이 필요)
+        new_bal = _post_student_tx(str(student_id), amount, tx_type, memo, recorder)
 
-        # ✅ 국고 반영(같은 트랜잭션) - 먼저 처리(READ 먼저, WRITE는 나중)
+        # ✅ 국고 반영 - 학생 장부 확정 후 처리(계정 없음 등 실패 시 국고 미반영)
         if tre_signed != 0:
-            _treasury_apply_in_transaction(
-                transaction,
-                memo=str(treasury_memo or memo),
-                signed_amount=int(tre_signed),
-                actor=str(actor or "auto"),
-                recorder_override=recorder,
-            )
-
-        new_bal = bal + amount
-        transaction.update(student_ref, {"balance": new_bal})
-        transaction.set(
-            tx_ref,
-            {
-                "student_id": str(student_id),
-                "type": tx_type,
-                "amount": amount,
-                "balance_after": new_bal,
-                "memo": memo,
-                "recorder": recorder,
-                "created_at": datetime.utcnow(),
-            },
-        )
+            try:
+                _treasury_apply_in_transaction(
+                    transaction,
+                    memo=str(treasury_memo or memo),
+                    signed_amount=int(tre_signed),
+                    actor=str(actor or "auto"),
+                    recorder_override=recorder,
+                )
+            except Exception:
+                _reverse_student_tx(str(student_id), amount, memo, recorder)
+                raise
 
         return new_bal
 
     try:
         new_bal = _do(db.transaction())
-        api_get_treasury_state_cached.clear()
-        api_list_treasury_ledger_cached.clear()
-        api_list_accounts_cached.clear()
         return {"ok": True, "balance": new_bal}
     except ValueError as e:
         return {"ok": False, "error": str(e)}
@@ -3491,14 +4036,12 @@ def api_treasury_auto_bulk_adjust(memo: str, signed_amount: int, actor: str = "a
 
     try:
         _do(db.transaction())
-        api_get_treasury_state_cached.clear()
-        api_list_treasury_ledger_cached.clear()
         return {"ok": True}
     except Exception as e:
         return {"ok": False, "error": f"국고 저장 실패: {e}"}
 
-@st.cache_data(ttl=30, show_spinner=False)
-def api_list_treasury_ledger_cached(limit=300):
+@st.cache_data(ttl=300, show_spinner=False, max_entries=16)
+def _api_list_treasury_ledger_cached(gen: int, limit=300):
     q = (
         db.collection("treasury_ledger")
         .order_by("created_at", direction=mongo.Query.DESCENDING)
@@ -3522,9 +4065,13 @@ def api_list_treasury_ledger_cached(limit=300):
         )
     return {"ok": True, "rows": rows}
 
+
+def api_list_treasury_ledger_cached(limit=300):
+    return _api_list_treasury_ledger_cached(cache_generations.collection_gen("treasury_ledger"), limit)
+
 # ---------- 국고 전용 템플릿 ----------
-@st.cache_data(ttl=120, show_spinner=False)
-def api_list_treasury_templates_cached():
+@st.cache_data(ttl=1800, show_spinner=False, max_entries=16)
+def _api_list_treasury_templates_cached(gen: int):
     docs = db.collection("treasury_templates").stream()
     templates = []
     for d in docs:
@@ -3543,6 +4090,10 @@ def api_list_treasury_templates_cached():
     templates.sort(key=lambda x: (int(x.get("order", 999999)), str(x.get("label", ""))))
     return {"ok": True, "templates": templates}
 
+
+def api_list_treasury_templates_cached():
+    return _api_list_treasury_templates_cached(cache_generations.collection_gen("treasury_templates"))
+
 def api_upsert_treasury_template(admin_pin: str, template_id: str, label: str, kind: str, amount: int, order: int):
     if not is_admin_pin(admin_pin):
         return {"ok": False, "error": "관리자 PIN이 틀립니다."}
@@ -3575,7 +4126,6 @@ def api_upsert_treasury_template(admin_pin: str, template_id: str, label: str, k
         merge=True,
     )
 
-    api_list_treasury_templates_cached.clear()
     return {"ok": True}
 
 def api_delete_treasury_template(admin_pin: str, template_id: str):
@@ -3584,7 +4134,6 @@ def api_delete_treasury_template(admin_pin: str, template_id: str):
     if not template_id:
         return {"ok": False, "error": "template_id가 없습니다."}
     db.collection("treasury_templates").document(str(template_id)).delete()
-    api_list_treasury_templates_cached.clear()
     return {"ok": True}
 
 def treasury_template_display(t):
@@ -3644,9 +4193,6 @@ def render_treasury_trade_ui(prefix: str, templates_list: list, template_by_disp
             st.session_state[inc_key] = 0
             st.session_state[exp_key] = amt
     
-    _frag = getattr(st, "fragment", None)
-    use_fragment = callable(_frag)
-    
     def _draw_ui():
         # 템플릿 선택
         tpl_labels = ["(직접 입력)"] + [treasury_template_display(t) for t in templates_list]
@@ -3677,13 +4223,8 @@ def render_treasury_trade_ui(prefix: str, templates_list: list, template_by_disp
         with c2:
             st.number_input("세출", min_value=0, step=1, key=exp_key)
 
-    if use_fragment:
-        @_frag
-        def _frag_draw():
-            _draw_ui()
-        _frag_draw()
-    else:
-        _draw_ui()
+    # ✅ 입력 패널만 프래그먼트로 실행(빠른 금액/템플릿 클릭 시 전체 스크립트 rerun 없음)
+    fragment_if_available(_draw_ui)()
 
     # ✅ 함수 안에서 return (return outside function 방지)
     memo = str(st.session_state.get(memo_key, "") or "").strip()
@@ -3790,8 +4331,7 @@ def render_admin_trade_ui(prefix: str, templates_list: list, template_by_display
             st.session_state[mode_key] = "금액(-)"
         st.session_state[f"{prefix}_quick_skip_once"] = True
     
-    _frag = getattr(st, "fragment", None)
-    use_fragment = callable(_frag)
+    use_fragment = callable(getattr(st, "fragment", None))
 
     def _draw_ui():
         tpl_prev_key = f"{prefix}_tpl_prev"
@@ -3885,13 +4425,8 @@ def render_admin_trade_ui(prefix: str, templates_list: list, template_by_display
         wd = int(st.session_state.get(wd_key, 0) or 0)
         st.session_state[out_key] = (memo, dep, wd)
 
-    if use_fragment:
-        @_frag
-        def _frag_draw():
-            _draw_ui()
-        _frag_draw()
-    else:
-        _draw_ui()
+    # ✅ 입력 패널만 프래그먼트로 실행(빠른 금액/템플릿 클릭 시 전체 스크립트 rerun 없음)
+    fragment_if_available(_draw_ui)()
 
     memo, dep, wd = st.session_state.get(out_key, ("", 0, 0))
     return memo, dep, wd
@@ -3995,6 +4530,57 @@ def render_round_amount_picker(prefix: str, plus_label: str, minus_label: str, a
 # =========================
 # 🏷️ 경매
 # =========================
+# =========================
+# 경매/복권 라이브 상태 (change stream 1개로 회차/입찰/참여 목록을 메모리에 유지)
+# =========================
+LIVE_REFRESH_SEC = float(os.environ.get("LIVE_REFRESH_SEC", "2") or 2)
+
+
+@st.cache_resource(show_spinner=False)
+def _live_rounds() -> LiveCollections:
+    live = LiveCollections(
+        {
+            "lottery_rounds": None,
+            "lottery_entries": "round_id",
+            "auction_rounds": None,
+            "auction_bids": "round_id",
+        }
+    )
+    live.start(get_database())
+    return live
+
+
+def _pick_open_round(rows: list[dict]) -> dict | None:
+    """메모리 회차 목록에서 진행 중(open)인 최신 회차(round_no 최대)."""
+    open_rows = [r for r in rows if str(r.get("status", "")).strip() == "open"]
+    if not open_rows:
+        return None
+    row = max(open_rows, key=lambda r: int(r.get("round_no", 0) or 0))
+    row["round_id"] = str(row.get("_id", "") or "")
+    return row
+
+
+def _render_live_probe(probe_key: str, watch: tuple):
+    """
+    ✅ 경매/복권 화면 자동 갱신(라이브 감시 중일 때만)
+    - run_every 틱마다 메모리의 버전 번호만 비교(DB 조회·화면 그리기 없음)
+    - 이 서버의 change stream이 watch 대상((컬렉션, round_id) 목록) 변경을 받았을 때만 rerun
+    """
+    if not _live_rounds().live or not callable(getattr(st, "fragment", None)):
+        return
+
+    @st.fragment(run_every=LIVE_REFRESH_SEC)
+    def _probe():
+        seen_key = f"_live_seen_{probe_key}"
+        cur = tuple(_live_rounds().version(col, grp) for col, grp in watch)
+        prev = st.session_state.get(seen_key)
+        st.session_state[seen_key] = cur
+        if prev is not None and prev != cur:
+            st.rerun()
+
+    _probe()
+
+
 AUC_STATE_DOC = "auction_state"
 
 def _fmt_auction_dt(val) -> str:
@@ -4019,12 +4605,19 @@ def _get_auction_state() -> dict:
     }
 
 def api_get_open_auction_round() -> dict:
+    live_rows = _live_rounds().snapshot("auction_rounds")
+    if live_rows is not None:
+        row = _pick_open_round(live_rows)
+        if row:
+            return {"ok": True, "round": row}
+        return {"ok": False, "error": "진행 중인 경매가 없습니다."}
+
     stt = _get_auction_state()
     rid = str(stt.get("current_round_id", "") or "")
     if rid:
         snap = db.collection("auction_rounds").document(rid).get()
         if snap.exists:
-            row = snap.to_dict() or {}
+            row = snap.to_dict(copy=True) or {}
             if str(row.get("status", "")).strip() == "open":
                 row["round_id"] = snap.id
                 return {"ok": True, "round": row}
@@ -4038,7 +4631,7 @@ def api_get_open_auction_round() -> dict:
             .stream()
         )
         for d in q:
-            row = d.to_dict() or {}
+            row = d.to_dict(copy=True) or {}
             row["round_id"] = d.id
             return {"ok": True, "round": row}
     except Exception:
@@ -4051,7 +4644,7 @@ def api_get_open_auction_round() -> dict:
         )
         best_row = None
         for d in fallback_docs:
-            row = d.to_dict() or {}
+            row = d.to_dict(copy=True) or {}
             row["round_id"] = d.id
             round_no = int(row.get("round_no", 0) or 0)
             if not best_row or round_no > best_row["round_no"]:
@@ -4146,61 +4739,51 @@ def api_submit_auction_bid(name: str, pin: str, amount: int):
     student_name = str(st_data.get("name", name) or name)
 
     bid_ref = db.collection("auction_bids").document(f"{round_id}_{student_id}")
-    student_ref = db.collection("students").document(student_id)
     round_ref = db.collection("auction_rounds").document(round_id)
-    tx_ref = db.collection("transactions").document()
 
     memo = f"[경매 {int(round_row.get('round_no', 0) or 0):02d}회] {str(round_row.get('bid_name', '') or '')} 입찰 제출"
 
-    @mongo.transactional
-    def _do(tx):
-        b_snap = bid_ref.get(transaction=tx)
-        if b_snap.exists:
-            raise ValueError("이미 이번 경매에 입찰표를 제출했습니다.")
-
-        r_snap = round_ref.get(transaction=tx)
+    def _do():
+        r_snap = round_ref.get()
         if (not r_snap.exists) or (str((r_snap.to_dict() or {}).get("status", "")) != "open"):
             raise ValueError("경매가 마감되어 제출할 수 없습니다.")
 
-        s_snap = student_ref.get(transaction=tx)
-        if not s_snap.exists:
-            raise ValueError("학생 계정을 찾을 수 없습니다.")
-        bal = int((s_snap.to_dict() or {}).get("balance", 0) or 0)
-        if bal < amount:
-            raise ValueError("잔액이 부족하여 제출할 수 없습니다.")
+        # ✅ 입찰표 문서를 create로 먼저 선점(중복 제출 차단) → 출금은 $inc + 잔액 가드 1회
+        try:
+            bid_ref.create(
+                {
+                    "round_id": round_id,
+                    "round_no": int(round_row.get("round_no", 0) or 0),
+                    "student_id": student_id,
+                    "student_no": int(student_no),
+                    "student_name": student_name,
+                    "affiliation": str(round_row.get("affiliation", "") or ""),
+                    "bid_name": str(round_row.get("bid_name", "") or ""),
+                    "amount": int(amount),
+                    "submitted_at": datetime.utcnow(),
+                    "status": "submitted",
+                }
+            )
+        except AlreadyExists:
+            raise ValueError("이미 이번 경매에 입찰표를 제출했습니다.") from None
 
-        new_bal = int(bal - amount)
-        tx.update(student_ref, {"balance": int(new_bal)})
-        tx.set(
-            tx_ref,
-            {
-                "student_id": student_id,
-                "type": "withdraw",
-                "amount": int(-amount),
-                "balance_after": int(new_bal),
-                "memo": memo,
-                "recorder": str(student_name or name or ""),
-                "created_at": datetime.utcnow(),
-            },
-        )
-        tx.set(
-            bid_ref,
-            {
-                "round_id": round_id,
-                "round_no": int(round_row.get("round_no", 0) or 0),
-                "student_id": student_id,
-                "student_no": int(student_no),
-                "student_name": student_name,
-                "affiliation": str(round_row.get("affiliation", "") or ""),
-                "bid_name": str(round_row.get("bid_name", "") or ""),
-                "amount": int(amount),
-                "submitted_at": datetime.utcnow(),
-                "status": "submitted",
-            },
-        )
+        try:
+            _post_student_tx(
+                student_id,
+                int(-amount),
+                "withdraw",
+                memo,
+                str(student_name or name or ""),
+                min_balance=0,
+                insufficient_msg="잔액이 부족하여 제출할 수 없습니다.",
+                not_found_msg="학생 계정을 찾을 수 없습니다.",
+            )
+        except Exception:
+            bid_ref.delete()
+            raise
 
     try:
-        _do(db.transaction())
+        _do()
         return {"ok": True}
     except ValueError as e:
         return {"ok": False, "error": str(e)}
@@ -4242,14 +4825,18 @@ def api_list_auction_bids(round_id: str):
     if not round_id:
         return {"ok": True, "rows": []}
 
-    q = db.collection("auction_bids").where(filter=build_filter("round_id", "==", round_id)).stream()
+    live_docs = _live_rounds().snapshot("auction_bids", round_id)
+    if live_docs is not None:
+        docs = [(str(x.get("_id", "") or ""), x) for x in live_docs]
+    else:
+        q = db.collection("auction_bids").where(filter=build_filter("round_id", "==", round_id)).stream()
+        docs = [(d.id, d.to_dict() or {}) for d in q]
     rows = []
-    for d in q:
-        r = d.to_dict() or {}
+    for bid_id, r in docs:
         dt_utc = _to_utc_datetime(r.get("submitted_at"))
         rows.append(
             {
-                "bid_id": d.id,
+                "bid_id": bid_id,
                 "round_no": int(r.get("round_no", 0) or 0),
                 "student_id": str(r.get("student_id", "") or ""),
                 "student_no": int(r.get("student_no", 0) or 0),
@@ -4273,7 +4860,7 @@ def api_get_latest_closed_auction_round():
             .stream()
         )
         for d in q:
-            row = d.to_dict() or {}
+            row = d.to_dict(copy=True) or {}
             row["round_id"] = d.id
             return {"ok": True, "round": row}
     except Exception:
@@ -4285,7 +4872,7 @@ def api_get_latest_closed_auction_round():
         )
         best_row = None
         for d in fallback_docs:
-            row = d.to_dict() or {}
+            row = d.to_dict(copy=True) or {}
             row["round_id"] = d.id
             round_no = int(row.get("round_no", 0) or 0)
             if not best_row or round_no > best_row["round_no"]:
@@ -4315,7 +4902,7 @@ def api_list_closed_auction_rounds(limit: int = 30):
 
     rows = []
     for d in docs:
-        row = d.to_dict() or {}
+        row = d.to_dict(copy=True) or {}
         row["round_id"] = d.id
         rows.append(row)
 
@@ -4489,8 +5076,9 @@ def _normalize_lottery_numbers(nums) -> list[int]:
     out = sorted(list(dict.fromkeys(out)))
     return out
 
-@st.cache_data(ttl=5, show_spinner=False)
-def _get_lottery_state() -> dict:
+# ✅ 복권 캐시는 세대 키로 무효화: "lottery"(상태/진행 회차), "lottery:<round_id>"(해당 회차 참여 목록)
+@st.cache_data(ttl=5, show_spinner=False, max_entries=16)
+def _load_lottery_state(gen: int) -> dict:
     snap = db.collection("config").document(LOT_STATE_DOC).get()
     if not snap.exists:
         return {"current_round_no": 0, "current_round_id": "", "status": "idle"}
@@ -4501,14 +5089,18 @@ def _get_lottery_state() -> dict:
         "status": str(d.get("status", "idle") or "idle"),
     }
 
-@st.cache_data(ttl=5, show_spinner=False)
-def api_get_open_lottery_round() -> dict:
+
+def _get_lottery_state() -> dict:
+    return _load_lottery_state(cache_generations.get("lottery"))
+
+@st.cache_data(ttl=5, show_spinner=False, max_entries=16)
+def _api_get_open_lottery_round(gen: int) -> dict:
     stt = _get_lottery_state()
     rid = str(stt.get("current_round_id", "") or "")
     if rid:
         snap = db.collection("lottery_rounds").document(rid).get()
         if snap.exists:
-            row = snap.to_dict() or {}
+            row = snap.to_dict(copy=True) or {}
             if str(row.get("status", "")).strip() == "open":
                 row["round_id"] = snap.id
                 return {"ok": True, "round": row}
@@ -4522,14 +5114,14 @@ def api_get_open_lottery_round() -> dict:
             .stream()
         )
         for d in q:
-            row = d.to_dict() or {}
+            row = d.to_dict(copy=True) or {}
             row["round_id"] = d.id
             return {"ok": True, "round": row}
     except Exception:
         fallback_docs = db.collection("lottery_rounds").where(filter=build_filter("status", "==", "open")).stream()
         best_row = None
         for d in fallback_docs:
-            row = d.to_dict() or {}
+            row = d.to_dict(copy=True) or {}
             row["round_id"] = d.id
             round_no = int(row.get("round_no", 0) or 0)
             if (best_row is None) or (round_no > best_row["round_no"]):
@@ -4539,6 +5131,16 @@ def api_get_open_lottery_round() -> dict:
 
     return {"ok": False, "error": "개시된 복권이 없습니다."}
 
+
+def api_get_open_lottery_round() -> dict:
+    live_rows = _live_rounds().snapshot("lottery_rounds")
+    if live_rows is not None:
+        row = _pick_open_round(live_rows)
+        if row:
+            return {"ok": True, "round": row}
+        return {"ok": False, "error": "개시된 복권이 없습니다."}
+    return _api_get_open_lottery_round(cache_generations.get("lottery"))
+
 def api_open_lottery(admin_pin: str, cfg: dict):
     if not is_admin_pin(admin_pin):
         return {"ok": False, "error": "관리자 PIN이 틀립니다."}
@@ -4610,8 +5212,7 @@ def api_open_lottery(admin_pin: str, cfg: dict):
 
     try:
         no = int(_do(db.transaction()))
-        _get_lottery_state.clear()
-        api_get_open_lottery_round.clear()
+        cache_generations.bump("lottery")
         return {"ok": True, "round_no": no}
     except ValueError as e:
         return {"ok": False, "error": str(e)}
@@ -4646,68 +5247,64 @@ def api_close_lottery(admin_pin: str):
 
     try:
         out = _do(db.transaction())
-        _get_lottery_state.clear()
-        api_get_open_lottery_round.clear()
+        cache_generations.bump("lottery")
         return {"ok": True, **out}
     except ValueError as e:
         return {"ok": False, "error": str(e)}
     except Exception as e:
         return {"ok": False, "error": f"복권 마감 실패: {e}"}
 
-@st.cache_data(ttl=5, show_spinner=False)
-def api_list_lottery_entries(round_id: str):
+def _lottery_entry_row(entry_id: str, x, rid: str) -> dict:
+    nums = _normalize_lottery_numbers(x.get("numbers", []))
+    return {
+        "entry_id": entry_id,
+        "round_id": rid,
+        "round_no": int(x.get("round_no", 0) or 0),
+        "student_id": str(x.get("student_id", "") or ""),
+        "student_no": int(x.get("student_no", 0) or 0),
+        "student_name": str(x.get("student_name", "") or ""),
+        "numbers": nums,
+        "numbers_text": ", ".join([f"{n:02d}" for n in nums]),
+        "submitted_at": x.get("submitted_at"),
+        "submitted_at_text": _fmt_lottery_dt(x.get("submitted_at")),
+        "is_admin": bool(x.get("is_admin", False)),
+        "treasury_applied": bool(x.get("treasury_applied", False)),
+    }
+
+
+def _lottery_submitted_ts(x) -> float:
+    dt = _to_utc_datetime(x.get("submitted_at"))
+    return dt.timestamp() if dt else float("-inf")
+
+
+@st.cache_data(ttl=5, show_spinner=False, max_entries=16)
+def _api_list_lottery_entries(gen: int, round_id: str):
     rid = str(round_id or "").strip()
     if not rid:
         return {"ok": True, "rows": []}
 
-    def _rows_from_stream(stream_docs):
-        out = []
-        for d in stream_docs:
-            x = d.to_dict() or {}
-            nums = _normalize_lottery_numbers(x.get("numbers", []))
-            out.append(
-                {
-                    "entry_id": d.id,
-                    "round_id": rid,
-                    "round_no": int(x.get("round_no", 0) or 0),
-                    "student_id": str(x.get("student_id", "") or ""),
-                    "student_no": int(x.get("student_no", 0) or 0),
-                    "student_name": str(x.get("student_name", "") or ""),
-                    "numbers": nums,
-                    "numbers_text": ", ".join([f"{n:02d}" for n in nums]),
-                    "submitted_at": x.get("submitted_at"),
-                    "submitted_at_text": _fmt_lottery_dt(x.get("submitted_at")),
-                    "is_admin": bool(x.get("is_admin", False)),
-                    "treasury_applied": bool(x.get("treasury_applied", False)),
-                }
-            )
-        return out
+    # lottery_entries(round_id, submitted_at) 인덱스로 서버 정렬
+    q = (
+        db.collection("lottery_entries")
+        .where(filter=build_filter("round_id", "==", rid))
+        .order_by("submitted_at", direction=mongo.Query.ASCENDING)
+        .stream()
+    )
+    return {"ok": True, "rows": [_lottery_entry_row(d.id, d.to_dict() or {}, rid) for d in q]}
 
-    try:
-        q = (
-            db.collection("lottery_entries")
-            .where(filter=build_filter("round_id", "==", rid))
-            .order_by("submitted_at", direction=mongo.Query.ASCENDING)
-            .stream()
-        )
-        rows = _rows_from_stream(q)
-    except Exception:
-        # 복합 인덱스가 없어도 동작하도록 서버 정렬 없이 조회 후 앱에서 정렬
-        q = db.collection("lottery_entries").where(filter=build_filter("round_id", "==", rid)).stream()
-        rows = _rows_from_stream(q)
-        rows.sort(
-            key=lambda r: (
-                r.get("submitted_at") is None,
-                r.get("submitted_at") or datetime.min.replace(tzinfo=timezone.utc),
-                str(r.get("entry_id", "") or ""),
-            )
-        )
 
-    return {"ok": True, "rows": rows}
+def api_list_lottery_entries(round_id: str):
+    rid = str(round_id or "").strip()
+    live_docs = _live_rounds().snapshot("lottery_entries", rid) if rid else None
+    if live_docs is not None:
+        # ✅ change stream이 유지하는 메모리 상태에서 바로 구성(DB 조회 없음)
+        live_docs.sort(key=_lottery_submitted_ts)
+        return {"ok": True, "rows": [_lottery_entry_row(str(x.get("_id", "") or ""), x, rid) for x in live_docs]}
+    return _api_list_lottery_entries(cache_generations.get(f"lottery:{rid}"), round_id)
 
 
-@st.cache_data(ttl=5, show_spinner=False)
-def api_list_lottery_entries_by_student(student_id: str, round_id: str = ""):
+@st.cache_data(ttl=5, show_spinner=False, max_entries=16)
+def _api_list_lottery_entries_by_student(gen: int, student_id: str, round_id: str = ""):
     sid = str(student_id or "").strip()
     if not sid:
         return {"ok": True, "rows": []}
@@ -4755,6 +5352,27 @@ def api_list_lottery_entries_by_student(student_id: str, round_id: str = ""):
             r.pop("_submitted_at", None)
     return {"ok": True, "rows": rows}
 
+
+def api_list_lottery_entries_by_student(student_id: str, round_id: str = ""):
+    rid = str(round_id or "").strip()
+    sid = str(student_id or "").strip()
+    live_docs = _live_rounds().snapshot("lottery_entries", rid) if (rid and sid) else None
+    if live_docs is not None:
+        mine = [x for x in live_docs if str(x.get("student_id", "") or "") == sid]
+        mine.sort(key=_lottery_submitted_ts, reverse=True)
+        rows = [
+            {
+                "회차": int(x.get("round_no", 0) or 0),
+                "번호": int(x.get("student_no", 0) or 0),
+                "이름": str(x.get("student_name", "") or ""),
+                "복권 참여 번호": ", ".join([f"{n:02d}" for n in _normalize_lottery_numbers(x.get("numbers", []))]),
+            }
+            for x in mine
+        ]
+        return {"ok": True, "rows": rows}
+    gen = cache_generations.get(f"lottery:{rid}") if rid else cache_generations.collection_gen("lottery")
+    return _api_list_lottery_entries_by_student(gen, student_id, round_id)
+
 def api_submit_lottery_entry(name: str, pin: str, numbers: list[int]):
     student_doc = fs_auth_student(name, pin)
     if not student_doc:
@@ -4827,9 +5445,7 @@ def api_submit_lottery_entry(name: str, pin: str, numbers: list[int]):
 
     try:
         nb = int(_do(db.transaction()))
-        api_list_lottery_entries.clear()
-        api_list_lottery_entries_by_student.clear()
-        api_get_open_lottery_round.clear()
+        cache_generations.bump("lottery", f"lottery:{rid}")
         return {"ok": True, "balance": nb}
     except ValueError as e:
         return {"ok": False, "error": str(e)}
@@ -4917,9 +5533,7 @@ def api_submit_lottery_entries(name: str, pin: str, games: list[list[int]]):
 
     try:
         nb = int(_do(db.transaction()))
-        api_list_lottery_entries.clear()
-        api_list_lottery_entries_by_student.clear()
-        api_get_open_lottery_round.clear()
+        cache_generations.bump("lottery", f"lottery:{rid}")
         return {"ok": True, "balance": nb, "count": len(normalized_games)}
     except ValueError as e:
         return {"ok": False, "error": str(e)}
@@ -4941,7 +5555,7 @@ def api_list_closed_lottery_rounds(limit: int = 50):
 
     rows = []
     for d in docs:
-        row = d.to_dict() or {}
+        row = d.to_dict(copy=True) or {}
         status = str(row.get("status", "") or "")
         if status in ("closed", "drawn"):
             row["round_id"] = d.id
@@ -5019,11 +5633,7 @@ def api_submit_admin_lottery_entries(admin_pin: str, game_count: int, apply_trea
 
     try:
         _do(db.transaction())
-        api_get_treasury_state_cached.clear()
-        api_list_treasury_ledger_cached.clear()
-        api_list_lottery_entries.clear()
-        api_list_lottery_entries_by_student.clear()
-        api_get_open_lottery_round.clear()
+        cache_generations.bump("lottery", f"lottery:{rid}")
         return {
             "ok": True,
             "count": count,
@@ -5143,8 +5753,7 @@ def api_draw_lottery(admin_pin: str, round_id: str, winning_numbers: list[int]):
         },
         merge=True,
     )
-    api_list_lottery_entries.clear()
-    api_get_open_lottery_round.clear()
+    cache_generations.bump("lottery", f"lottery:{rid}")
     return {"ok": True, "winners": winner_rows}
 
 def api_pay_lottery_prizes(admin_pin: str, round_id: str):
@@ -5192,8 +5801,7 @@ def api_pay_lottery_prizes(admin_pin: str, round_id: str):
         },
         merge=True,
     )
-    api_list_lottery_entries.clear()
-    api_list_lottery_entries_by_student.clear()
+    cache_generations.bump(f"lottery:{rid}")
     return {"ok": True, "paid_total": int(paid_total)}
 
 def _calc_lottery_financials(round_row: dict) -> dict:
@@ -5751,6 +6359,50 @@ def api_list_roles_cached():
     roles.sort(key=lambda x: x["role_name"])
     return {"ok": True, "roles": roles}
 
+ROLES_VERSION_DOC = "roles_version"
+
+
+def _get_roles_version() -> int:
+    snap = db.collection("config").document(ROLES_VERSION_DOC).get()
+    if not snap.exists:
+        return 0
+    return int((snap.to_dict() or {}).get("version", 0) or 0)
+
+
+def _bump_roles_version() -> int:
+    """roles 문서를 바꾼 뒤 호출 → 모든 세션/레플리카가 다음 rerun에 역할 인덱스를 새로 만듦."""
+    return db.collection("config").document(ROLES_VERSION_DOC).increment("version")
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _build_role_index(roles_version: int) -> dict:
+    """
+    ✅ roles_version마다 1회만 roles 전체를 읽어 조회용 인덱스를 생성(공유 객체이므로 읽기 전용)
+    - perms_by_id: role_id → frozenset(permissions)
+    - name_by_id: role_id → role_name
+    """
+    perms_by_id, name_by_id = {}, {}
+    for d in db.collection("roles").stream():
+        r = d.to_dict() or {}
+        perms_by_id[d.id] = frozenset(str(p) for p in (r.get("permissions", []) or []) if str(p).strip())
+        name_by_id[d.id] = str(r.get("role_name", "") or "").strip()
+    return {"perms_by_id": perms_by_id, "name_by_id": name_by_id}
+
+
+def _get_role_index() -> dict:
+    # config/roles_version 1건(rerun 내 캐시)만 확인하고, 버전이 같으면 기존 인덱스 재사용
+    # (DB에 저장된 버전이라 캐시 전파 실패·앱 밖 수정 후에도 bump만 하면 모든 레플리카가 갱신)
+    return _build_role_index(_get_roles_version())
+
+
+def _role_permissions(role_id: str) -> frozenset:
+    return _get_role_index()["perms_by_id"].get(str(role_id or ""), frozenset())
+
+
+def _role_name(role_id: str) -> str:
+    return _get_role_index()["name_by_id"].get(str(role_id or ""), "")
+
+
 def get_my_permissions(student_id: str, is_admin: bool):
     """로그인 계정의 최종 권한 집합을 반환합니다.
     - 관리자: admin_all
@@ -5771,9 +6423,7 @@ def get_my_permissions(student_id: str, is_admin: bool):
     perms = set()
     role_id = str(sd.get("role_id", "") or "")
     if role_id:
-        rdoc = db.collection("roles").document(role_id).get()
-        if rdoc.exists:
-            perms |= set((rdoc.to_dict() or {}).get("permissions", []) or [])
+        perms |= _role_permissions(role_id)
 
     # 2) 학생 개별 추가 권한 (A안)
     extra = sd.get("extra_permissions", []) or []
@@ -5886,8 +6536,12 @@ def upsert_roles_from_paytable(admin_pin: str, pay_df: pd.DataFrame):
             },
             merge=True,
         )
-    batch.commit()
-    api_list_roles_cached.clear()
+    try:
+        batch.commit()
+    finally:
+        # 일부만 기록되고 BatchWriteError가 나도 캐시 무효화는 반드시 실행
+        api_list_roles_cached.clear()
+        _bump_roles_version()
     return {"ok": True}
 
 def parse_bank_rate_pdf_text(text: str):
@@ -5926,7 +6580,10 @@ def upsert_bank_rates(admin_pin: str, rate_rows: list[dict]):
             continue
         ref = db.collection("bank_products_rates").document(str(weeks))
         batch.set(ref, row, merge=True)
-    batch.commit()
+    try:
+        batch.commit()
+    except BatchWriteError as e:
+        return {"ok": False, "error": f"일부 금리 저장 실패: {', '.join(e.failed_ids)}"}
     return {"ok": True}
 
 def get_bank_rate(weeks: int, credit_grade: int) -> int:
@@ -5964,6 +6621,7 @@ defaults = {
     # =========================
     "stat_edit": {},              # {submission_id: {student_id: "X|O|△"}}
     "stat_loaded_sig": "",        # 로드 시그니처(불필요한 초기화 방지)
+    "stat_cols_loaded": STAT_PAGE_COLS,  # 불러온 제출물(열) 수 (더 불러오기 시 증가)
     "stat_delete_confirm": False, # 삭제 확인
     "stat_tpl_pick_prev": None,   # 템플릿 select 변경 감지
 }
@@ -6285,6 +6943,14 @@ with st.sidebar:
         else:
             res = api_change_pin_student(stu_name, old_pin, new_pin1)
             if res.get("ok"):
+                # ✅ 본인 세션이면 새 PIN으로 이어서 재인증(토큰은 auth_version 변경으로 이미 무효)
+                if (
+                    st.session_state.get("logged_in")
+                    and not st.session_state.get("admin_ok")
+                    and stu_name == str(st.session_state.get("login_name", "") or "")
+                ):
+                    st.session_state.login_pin = new_pin1
+                    _set_auth_query_params(stu_name, new_pin1, is_admin_user=False)
                 toast("비밀번호 변경 완료!", icon="✅")
                 st.session_state.pop("sb_stu_pw_name", None)
                 st.session_state.pop("sb_stu_pw_old", None)
@@ -6329,8 +6995,7 @@ with st.sidebar:
         if not doc:
             return {"ok": False, "error": "해당 이름의 계정을 찾지 못했습니다."}
 
-        db.collection("students").document(doc.id).update({"pin": str(new_pin)})
-        api_list_accounts_cached.clear()
+        db.collection("students").document(doc.id).update({"pin": str(new_pin), "auth_version": _new_auth_version()})
         return {"ok": True}
 
     # ✅ 버튼 3개: 생성 / PIN변경 / 삭제
@@ -6380,8 +7045,6 @@ with st.sidebar:
                     toast(f"계정 생성 완료! (번호 {new_no})", icon="✅")
                     st.session_state.pop("manage_name", None)
                     st.session_state.pop("manage_pin", None)
-                    api_list_accounts_cached.clear()
-                    _list_active_students_full_cached.clear()
                     st.rerun()
 
     with c2:
@@ -6429,7 +7092,6 @@ with st.sidebar:
                         st.error("해당 이름의 계정을 찾지 못했습니다.")
                     else:
                         db.collection("students").document(doc.id).update({"is_active": False})
-                        api_list_accounts_cached.clear()
                         toast("삭제 완료!", icon="🗑️")
                         st.session_state.delete_confirm = False
                         st.session_state.data.pop(manage_name, None)
@@ -6453,6 +7115,18 @@ def _system_paylog_id(month_key: str, student_id: str, job_id: str = "") -> str:
     return f"{month_key}_{student_id}_{str(job_id or '').strip() or '_'}"
 
 
+def _prefetch_paylogs(month_key: str, pairs) -> None:
+    """(학생, 직업id) 쌍의 payroll_log 신규/레거시 문서를 $in 1회로 미리 적재.
+    - get_many 결과가 identity map에 들어가므로 이후 *_already_paid_this_month의 개별 get은 DB 왕복 없음
+    """
+    ids = []
+    for sid, job_id in pairs:
+        ids.append(_system_paylog_id(month_key, sid, job_id))
+        ids.append(f"{month_key}_{sid}")
+    if ids:
+        db.collection("payroll_log").get_many(ids)
+
+
 def _system_already_paid_this_month(month_key: str, student_id: str, job_id: str = "", job_name: str = "") -> bool:
     snap = db.collection("payroll_log").document(_system_paylog_id(month_key, student_id, job_id)).get()
     if bool(snap.exists):
@@ -6479,139 +7153,266 @@ def _system_write_paylog(month_key: str, student_id: str, amount: int, job_name:
     )
 
 
-def _run_system_auto_payouts():
-    """앱 실행 시 자동 적금 만기/월급 지급을 시도한다(관리자 로그인 불필요)."""
-    try:
-        now_utc = datetime.now(timezone.utc)
-        due_docs = []
-        for status in ("running", "active"):
-            for d in db.collection("savings").where(filter=build_filter("status", "==", status)).stream():
-                x = d.to_dict() or {}
-                maturity_dt = _to_utc_datetime(x.get("maturity_utc") or x.get("maturity_date"))
-                if maturity_dt and maturity_dt <= now_utc:
-                    due_docs.append((d.id, x))
-
-        for doc_id, x in due_docs:
-            sid = str(x.get("student_id", "") or "").strip()
-            principal = int(x.get("principal", 0) or 0)
-            interest = int(x.get("interest", 0) or 0)
-            payout = int(x.get("maturity_amount", 0) or 0) or int(principal + interest)
-            weeks = int(x.get("weeks", 0) or 0)
-            if (not sid) or payout <= 0:
-                continue
-
-            @mongo.transactional
-            def _mature_one(transaction, sav_id: str, student_id: str, amount: int, wk: int):
-                sav_ref = db.collection("savings").document(sav_id)
-                stu_ref = db.collection("students").document(student_id)
-                tx_ref = db.collection("transactions").document()
-
-                sav_snap = sav_ref.get(transaction=transaction)
-                if not sav_snap.exists:
-                    return False
-                cur = sav_snap.to_dict() or {}
-                if str(cur.get("status", "")) not in ("running", "active"):
-                    return False
-                maturity2 = _to_utc_datetime(cur.get("maturity_utc") or cur.get("maturity_date"))
-                if (not maturity2) or (maturity2 > datetime.now(timezone.utc)):
-                    return False
+def _system_calc_net(gross: int, cfg: dict) -> int:
+    """실수령액 계산식(config/salary_deductions 기준) - 💼 직업/월급 탭과 자동 월급 지급 공용."""
+    cfg = dict(cfg or {})
+    gross = int(gross or 0)
+    tax_percent = float(cfg.get("tax_percent", 10.0) or 10.0)
+    desk = int(cfg.get("desk_rent", 50) or 50)
+    elec = int(cfg.get("electric_fee", 10) or 10)
+    health = int(cfg.get("health_fee", 10) or 10)
+    tax = int(round(gross * (tax_percent / 100.0)))
+    return max(0, int(gross - tax - desk - elec - health))
 
-                st_snap = stu_ref.get(transaction=transaction)
-                bal = int((st_snap.to_dict() or {}).get("balance", 0) or 0)
-                new_bal = int(bal + amount)
-                transaction.update(stu_ref, {"balance": int(new_bal)})
-                transaction.update(
-                    sav_ref,
-                    {"status": "matured", "result": "matured", "processed_at": datetime.utcnow(), "payout_amount": int(amount)},
-                )
-                transaction.set(
-                    tx_ref,
-                    {
-                        "student_id": str(student_id),
-                        "type": "maturity",
-                        "amount": int(amount),
-                        "balance_after": int(new_bal),
-                        "memo": f"적금 만기 지급 ({int(wk)}주)",
-                        "recorder": "시스템(적금)",
-                        "created_at": datetime.utcnow(),
-                    },
-                )
-                return True
 
-            _mature_one(db.transaction(), doc_id, sid, int(payout), int(weeks))
+def _run_system_auto_payouts() -> dict:
+    """자동 적금 만기/월급 지급을 1회 처리한다(관리자 로그인 불필요).
+    - 스케줄러 스레드에서 주기적으로 호출(페이지 rerun 경로에서는 실행하지 않음)
+    - return: {matured, matured_total, matured_failed, payroll_paid, payroll_total, errors(있을 때만)}
+    """
+    counts = {"matured": 0, "matured_total": 0, "matured_failed": 0, "payroll_paid": 0, "payroll_total": 0}
+    errors = []
 
-        payroll_cfg_snap = db.collection("config").document("salary_payroll").get()
-        payroll_cfg = payroll_cfg_snap.to_dict() if payroll_cfg_snap.exists else {}
-        auto_enabled = bool((payroll_cfg or {}).get("auto_enabled", False))
-        pay_day = max(1, min(31, int((payroll_cfg or {}).get("pay_day", 25) or 25)))
-        now_kst = datetime.now(KST)
-        if not (auto_enabled and int(now_kst.day) == int(pay_day)):
-            return
+    # ✅ (status, maturity_utc) 인덱스 범위 조회: 만기 도래분만 읽음
+    now_utc = datetime.now(timezone.utc)
+    due_q = (
+        db.collection("savings")
+        .where(filter=build_filter("status", "in", ["running", "active"]))
+        .where(filter=build_filter("maturity_utc", "<=", now_utc))
+        .stream()
+    )
+    due_docs = [(d.id, d.to_dict() or {}) for d in due_q]
+
+    for doc_id, x in due_docs:
+        sid = str(x.get("student_id", "") or "").strip()
+        principal = int(x.get("principal", 0) or 0)
+        interest = int(x.get("interest", 0) or 0)
+        payout = int(x.get("maturity_amount", 0) or 0) or int(principal + interest)
+        weeks = int(x.get("weeks", 0) or 0)
+        if (not sid) or payout <= 0:
+            continue
 
-        mkey = _system_month_key(now_kst)
-        run_lock_id = f"{mkey}_{pay_day:02d}"
+        # ✅ 진행중 상태일 때만 matured로 전환(조건부 update 1회) → 선점한 실행만 지급
+        savings_ref = db.collection("savings").document(doc_id)
+        claimed = savings_ref.update_if(
+            {"status": "matured", "result": "matured", "processed_at": datetime.utcnow(), "payout_amount": int(payout)},
+            [build_filter("status", "in", ["running", "active"])],
+        )
+        if not claimed:
+            continue
         try:
-            db.collection("payroll_auto_run").document(run_lock_id).create(
-                {"month": mkey, "pay_day": int(pay_day), "run_at": datetime.utcnow(), "source": "auto_system"}
+            _post_student_tx(sid, int(payout), "maturity", f"적금 만기 지급 ({int(weeks)}주)", "시스템(적금)")
+        except Exception as e:
+            # 지급 실패 → 선점 전 상태로 복구해서 다음 실행에서 다시 지급
+            savings_ref.update_if(
+                {
+                    "status": str(x.get("status", "") or "active"),
+                    "result": x.get("result"),
+                    "processed_at": x.get("processed_at"),
+                    "payout_amount": x.get("payout_amount"),
+                },
+                [build_filter("status", "==", "matured")],
             )
-        except AlreadyExists:
-            return
+            counts["matured_failed"] += 1
+            errors.append(f"적금 {doc_id} 만기 지급 실패: {e}")
+            continue
+        counts["matured"] += 1
+        counts["matured_total"] += int(payout)
+
+    payroll_cfg_snap = db.collection("config").document("salary_payroll").get()
+    payroll_cfg = payroll_cfg_snap.to_dict() if payroll_cfg_snap.exists else {}
+    auto_enabled = bool((payroll_cfg or {}).get("auto_enabled", False))
+    pay_day = max(1, min(31, int((payroll_cfg or {}).get("pay_day", 25) or 25)))
+    now_kst = datetime.now(KST)
+    if errors:
+        counts["errors"] = errors
+    if not (auto_enabled and int(now_kst.day) == int(pay_day)):
+        return counts
+
+    mkey = _system_month_key(now_kst)
+    run_lock_id = f"{mkey}_{pay_day:02d}"
+    try:
+        db.collection("payroll_auto_run").document(run_lock_id).create(
+            {"month": mkey, "pay_day": int(pay_day), "run_at": datetime.utcnow(), "source": "auto_system"}
+        )
+    except AlreadyExists:
+        return counts
+
+    salary_cfg_snap = db.collection("config").document("salary_deductions").get()
+    salary_cfg = salary_cfg_snap.to_dict() if salary_cfg_snap.exists else {}
+    accs = api_list_accounts_cached().get("accounts", []) or []
+    id_to_name = {a.get("student_id"): a.get("name") for a in accs if a.get("student_id")}
+
+    job_docs = list(db.collection("job_salary").order_by("order").stream())
+    _prefetch_paylogs(
+        mkey,
+        [(str(sid or "").strip(), d.id) for d in job_docs for sid in ((d.to_dict() or {}).get("assigned_ids", []) or [])],
+    )
+
+    for d in job_docs:
+        job = d.to_dict() or {}
+        job_id = str(d.id)
+        job_name = str(job.get("job", "") or "")
+        gross = int(job.get("salary", 0) or 0)
+        net_amt = int(_system_calc_net(gross, salary_cfg) or 0)
+        if net_amt <= 0:
+            continue
 
-        salary_cfg_snap = db.collection("config").document("salary_deduction").get()
-        salary_cfg = salary_cfg_snap.to_dict() if salary_cfg_snap.exists else {}
-        accs = api_list_accounts_cached().get("accounts", []) or []
-        id_to_name = {a.get("student_id"): a.get("name") for a in accs if a.get("student_id")}
-
-        for d in db.collection("job_salary").order_by("order").stream():
-            job = d.to_dict() or {}
-            job_id = str(d.id)
-            job_name = str(job.get("job", "") or "")
-            gross = int(job.get("salary", 0) or 0)
-            net_amt = int(_calc_net(gross, salary_cfg) or 0)
-            if net_amt <= 0:
+        for sid in list(job.get("assigned_ids", []) or []):
+            sid = str(sid or "").strip()
+            if not sid:
+                continue
+            if _system_already_paid_this_month(mkey, sid, job_id=job_id, job_name=job_name):
                 continue
 
-            for sid in list(job.get("assigned_ids", []) or []):
-                sid = str(sid or "").strip()
-                if not sid:
-                    continue
-                if _system_already_paid_this_month(mkey, sid, job_id=job_id, job_name=job_name):
-                    continue
+            pay_res = api_admin_add_tx_by_student_id_with_treasury(
+                admin_pin=ADMIN_PIN,
+                student_id=sid,
+                memo=f"월급 {job_name}",
+                deposit=int(net_amt),
+                withdraw=0,
+                apply_treasury=False,
+                treasury_memo="",
+                actor="system_salary",
+                recorder_override="관리자",
+            )
+            if not pay_res.get("ok"):
+                continue
 
-                pay_res = api_admin_add_tx_by_student_id_with_treasury(
+            deduction = int(max(0, gross - net_amt))
+            if deduction > 0:
+                nm = id_to_name.get(sid, "")
+                api_add_treasury_tx(
                     admin_pin=ADMIN_PIN,
-                    student_id=sid,
-                    memo=f"월급 {job_name}",
-                    deposit=int(net_amt),
-                    withdraw=0,
-                    apply_treasury=False,
-                    treasury_memo="",
+                    memo=f"월급 공제 세입({mkey}) {job_name}" + (f" - {nm}" if nm else ""),
+                    income=deduction,
+                    expense=0,
                     actor="system_salary",
                     recorder_override="관리자",
                 )
-                if not pay_res.get("ok"):
-                    continue
+            _system_write_paylog(mkey, sid, int(net_amt), job_name, method="auto", job_id=job_id)
+            counts["payroll_paid"] += 1
+            counts["payroll_total"] += int(net_amt)
 
-                deduction = int(max(0, gross - net_amt))
-                if deduction > 0:
-                    nm = id_to_name.get(sid, "")
-                    api_add_treasury_tx(
-                        admin_pin=ADMIN_PIN,
-                        memo=f"월급 공제 세입({mkey}) {job_name}" + (f" - {nm}" if nm else ""),
-                        income=deduction,
-                        expense=0,
-                        actor="system_salary",
-                        recorder_override="관리자",
-                    )
-                _system_write_paylog(mkey, sid, int(net_amt), job_name, method="auto", job_id=job_id)
+    return counts
 
-        api_list_accounts_cached.clear()
-    except Exception:
-        # 사용자 화면 진입을 막지 않도록 시스템 자동처리는 조용히 실패 처리
-        pass
+
+# =========================
+# 시스템 자동처리 스케줄러(백그라운드 스레드)
+# - 프로세스당 1개(st.cache_resource) / 여러 인스턴스 중 lease를 잡은 1곳만 실행
+# - 실행 결과는 system_jobs/{job} 문서에 기록(관리자 화면 표시용)
+# =========================
+SYSTEM_JOB_NAME = "system_auto_payouts"
+SYSTEM_JOB_INTERVAL_SEC = 60
+SYSTEM_JOB_LEASE_SEC = 300
+
+
+class _SystemJobScheduler:
+    def __init__(self, job_name: str, run_fn, interval_sec: int, lease_sec: int):
+        self.job_name = str(job_name)
+        self.run_fn = run_fn
+        self.interval_sec = int(interval_sec)
+        self.lease_sec = int(lease_sec)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._backfilled = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name=f"scheduler-{self.job_name}", daemon=True)
+
+    def start(self):
+        if not self._thread.is_alive():
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        try:
+            db.release_lease(self.job_name, self.owner)
+        except Exception:
+            pass
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval_sec)
+
+    def run_once(self) -> bool:
+        """lease를 잡은 경우에만 1회 실행하고 결과를 기록. return: 실행 여부"""
+        try:
+            if not db.acquire_lease(self.job_name, self.owner, self.lease_sec):
+                return False
+        except Exception:
+            return False
+
+        started_at = datetime.utcnow()
+        t0 = time.perf_counter()
+        counts, error = {}, ""
+        db_identity_map.reset()  # 이번 실행 범위의 문서 캐시(get_many 선적재 포함)
+        cache_generations.sync()
+        if not self._backfilled:
+            # 레거시 적금 문서(maturity_date / ISO 문자열)를 lease 보유 중 프로세스당 1회 정규화
+            # → 이후 만기 조회는 범위 쿼리만 사용
+            try:
+                backfill_savings_maturity(get_database())
+                self._backfilled = True
+            except Exception:
+                pass
+        try:
+            counts = dict(self.run_fn() or {})
+            error = " / ".join(str(x) for x in counts.pop("errors", []) or [])
+        except Exception as e:
+            error = str(e)
+        finally:
+            flush_student_assets_dirty()  # 이번 실행의 지급/만기 쓰기를 한 번에 dirty 표시
+        duration_ms = int(round((time.perf_counter() - t0) * 1000))
+
+        try:
+            db.collection("system_jobs").document(self.job_name).set(
+                {
+                    "last_run_at": started_at,
+                    "duration_ms": duration_ms,
+                    "counts": counts,
+                    "error": error,
+                    "owner": self.owner,
+                    "interval_sec": self.interval_sec,
+                },
+                merge=True,
+            )
+        except Exception:
+            pass
+        return True
 
 
-_run_system_auto_payouts()
+@st.cache_resource(show_spinner=False)
+def _get_system_job_scheduler() -> _SystemJobScheduler:
+    return _SystemJobScheduler(
+        SYSTEM_JOB_NAME,
+        _run_system_auto_payouts,
+        interval_sec=SYSTEM_JOB_INTERVAL_SEC,
+        lease_sec=SYSTEM_JOB_LEASE_SEC,
+    ).start()
+
+
+def api_get_system_job_status(job_name: str = SYSTEM_JOB_NAME) -> dict:
+    """관리자 화면용: 마지막 실행 시각/소요시간/처리 건수"""
+    try:
+        snap = db.collection("system_jobs").document(str(job_name)).get()
+        if not snap.exists:
+            return {"ok": True, "ran": False}
+        d = snap.to_dict() or {}
+        return {
+            "ok": True,
+            "ran": True,
+            "last_run_at": _to_utc_datetime(d.get("last_run_at")),
+            "duration_ms": int(d.get("duration_ms", 0) or 0),
+            "counts": dict(d.get("counts", {}) or {}),
+            "error": str(d.get("error", "") or ""),
+            "owner": str(d.get("owner", "") or ""),
+        }
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+
+_get_system_job_scheduler()
 
 
 # =========================
@@ -6713,6 +7514,7 @@ else:
         st.session_state.login_pin = ""
         st.session_state.undo_mode = False
         st.session_state["login_student_ctx"] = {}
+        st.session_state.pop("auth_token", None)
         _clear_auth_query_params()
 
         # ✅ (PATCH) 개별조회 지연로딩 상태 완전 초기화 (로그아웃 후 재로그인 시 자동 로드 방지)
@@ -6732,11 +7534,20 @@ login_name = st.session_state.login_name
 login_pin = st.session_state.login_pin
 
 # ✅ 학생 로그인 컨텍스트를 매 실행마다 최신화
-# - 관리자 페이지에서 권한/역할을 변경해도 학생이 즉시 탭 권한을 반영하도록 함
+# - 세션 토큰이 유효하면 students/<id> 1건 조회(이름 쿼리 없음, 같은 rerun의 API 인증은 캐시 적중)
+# - 관리자 페이지에서 권한/역할을 변경하면 auth_version이 바뀌어 이름+PIN으로 재인증 → 즉시 반영
+# - PIN이 바뀌어 재인증에 실패하면 로그아웃
 if not is_admin and login_name and login_pin:
     latest_doc = fs_auth_student(login_name, login_pin)
     if latest_doc:
         _set_login_student_context_from_doc(latest_doc)
+    else:
+        st.session_state.logged_in = False
+        st.session_state.login_name = ""
+        st.session_state.login_pin = ""
+        _set_login_student_context_from_doc(None)
+        _clear_auth_query_params()
+        st.rerun()
 
 
 my_student_id = None
@@ -6766,6 +7577,9 @@ ALL_TABS = [
     "🧾 로그기록",
 ]
 
+# ✅ 관리자 전용 성능 탭(학생 권한 부여 대상이 아니므로 ALL_TABS와 분리)
+PERF_TAB = "⚙️ 성능"
+
 def tab_visible(tab_name: str):
     # 관리자: 전부 표시
     if is_admin:
@@ -6801,17 +7615,63 @@ def tab_visible(tab_name: str):
 
     return False
 
+# -------------------------
+# ✅ 지연 탭 렌더링(탭 라우터)
+# - st.tabs는 숨겨진 탭 본문까지 매 rerun 실행 → DB 조회/엑셀 생성이 탭 수만큼 반복됨
+# - 라우터 모드: 선택된 탭 하나만 tab_map에 등록 → 아래 `if "<탭>" in tabs:` 블록 중 그 탭만 실행
+# - LAZY_TABS=0 이면 기존 st.tabs 방식
+# -------------------------
+LAZY_TABS = os.environ.get("LAZY_TABS", "1").strip() != "0"
+
+
+class _ProfiledTab:
+    """탭 컨테이너 래퍼: with 블록 동안 DB 프로파일러의 현재 탭을 해당 탭으로 설정."""
+
+    def __init__(self, key: str, container):
+        self._key = key
+        self._container = container
+        self._prev_tab = ""
+
+    def __enter__(self):
+        self._prev_tab = db_profiler.current_tab()
+        db_profiler.set_tab(self._key)
+        return self._container.__enter__()
+
+    def __exit__(self, *exc):
+        db_profiler.set_tab(self._prev_tab)
+        return self._container.__exit__(*exc)
+
+
+def _build_tab_map(labels: list[str], keys: list[str], state_key: str) -> dict:
+    """내부키 -> 탭 본문 컨테이너. 라우터 모드에서는 선택된 탭 하나만 반환."""
+    if not LAZY_TABS:
+        objs = st.tabs(labels)
+        return {k: _ProfiledTab(k, objs[i]) for i, k in enumerate(keys)}
+
+    label_by_key = dict(zip(keys, labels))
+    if st.session_state.get(state_key) not in label_by_key:
+        st.session_state[state_key] = keys[0]
+    selected = st.radio(
+        "탭 선택",
+        keys,
+        format_func=lambda k: label_by_key.get(k, k),
+        horizontal=True,
+        key=state_key,
+        label_visibility="collapsed",
+    )
+    return {selected: _ProfiledTab(selected, st.container())}
+
+
 # -------------------------
 # ✅ 탭 구성
 # - 관리자: 기존 ALL_TABS(tab_visible) 그대로
 # - 학생(개별로그인): "거래/투자/적금/목표" (투자 비활성화면 투자 탭 숨김)
 # -------------------------
 if is_admin:
-    tabs = [t for t in ALL_TABS if tab_visible(t)]
+    tabs = [t for t in ALL_TABS if tab_visible(t)] + [PERF_TAB]
     # ✅ 관리자 탭에서만 '🏦 내 통장' 탭 이름을 변경(학생 탭에는 영향 없음)
     tabs_display = [("💰입금/출금" if t == "🏦 내 통장" else t) for t in tabs]
-    tab_objs = st.tabs(tabs_display)
-    tab_map = {name: tab_objs[i] for i, name in enumerate(tabs)}
+    tab_map = _build_tab_map(tabs_display, tabs, "nav_tab_admin")
 else:
     # ✅ 투자 탭 노출 여부(계정 정보/활성화에서 '투자활성화' 꺼진 학생은 숨김)
     inv_ok = True
@@ -6893,137 +7753,25 @@ else:
 
     _render_user_bank_header(my_student_id)
 
-    tab_objs = st.tabs(user_tab_labels)
-
     # -------------------------------------------------
     # tab_map: "내부키" -> tab object
     # -------------------------------------------------
-    tab_map = {}
-
     # 기본 탭(내부키는 기존 로직 재사용)
-    idx = 0
-    tab_map["🏦 내 통장"] = tab_objs[idx]; idx += 1
-    tab_map["🏦 은행(적금)"] = tab_objs[idx]; idx += 1
-    tab_map["📊 통계/신용"] = tab_objs[idx]; idx += 1
+    base_keys = ["🏦 내 통장", "🏦 은행(적금)", "📊 통계/신용"]
     if inv_ok:
-        tab_map["📈 투자"] = tab_objs[idx]
-        idx += 1
-    tab_map["🎯 목표"] = tab_objs[idx]
-    idx += 1
-    tab_map["🛒마트"] = tab_objs[idx]
-    idx += 1    
-    tab_map["🏷️ 경매"] = tab_objs[idx]
-    idx += 1
-    tab_map["🍀 복권"] = tab_objs[idx]
-    idx += 1
-    extra_start = idx
+        base_keys.append("📈 투자")
+    base_keys += ["🎯 목표", "🛒마트", "🏷️ 경매", "🍀 복권"]
 
     # 추가 관리자 탭 매핑
-    for i, (_lab, key_internal) in enumerate(extra_admin_tabs):
-        tab_map[key_internal] = tab_objs[extra_start + i]
+    user_tab_keys = base_keys + [key_internal for (_lab, key_internal) in extra_admin_tabs]
+    tab_map = _build_tab_map(user_tab_labels, user_tab_keys, "nav_tab_user")
 
 
 tabs = list(tab_map.keys())
 
 # =========================
-# (PATCH) 공용: 신용점수/등급 계산 (내 통장 상단 요약에서 먼저 필요)
-# - 탭 실행 순서 때문에 내 통장에서 0등급(0점)으로 뜨는 문제 방지
+# (PATCH) 공용: 신용점수/등급 계산은 앞쪽 Credit helpers(신용 엔진) 사용
 # =========================
-def _score_to_grade(score: int) -> int:
-    s = int(score or 0)
-    if s >= 90:
-        return 1
-    if s >= 80:
-        return 2
-    if s >= 70:
-        return 3
-    if s >= 60:
-        return 4
-    if s >= 50:
-        return 5
-    if s >= 40:
-        return 6
-    if s >= 30:
-        return 7
-    if s >= 20:
-        return 8
-    if s >= 10:
-        return 9
-    return 10
-
-def _get_credit_cfg():
-    ref = db.collection("config").document("credit_scoring")
-    snap = ref.get()
-    if not snap.exists:
-        return {"base": 50, "o": 1, "x": -3, "tri": 0}
-    d = snap.to_dict() or {}
-    return {
-        "base": int(d.get("base", 50) if d.get("base", None) is not None else 50),
-        "o": int(d.get("o", 1) if d.get("o", None) is not None else 1),
-        "x": int(d.get("x", -3) if d.get("x", None) is not None else -3),
-        "tri": int(d.get("tri", 0) if d.get("tri", None) is not None else 0),
-    }
-
-def _norm_status(v) -> str:
-    v = str(v or "").strip().upper()
-    if v in ("O", "○"):
-        return "O"
-    if v in ("△", "▲", "Δ"):
-        return "△"
-    return "X"
-
-def _sum_manual_credit_delta(student_id: str) -> int:
-    total = 0
-    try:
-        q = (
-            db.collection("credit_adjustments")
-            .where(filter=build_filter("student_id", "==", str(student_id)))
-            .stream()
-        )
-        for d in q:
-            x = d.to_dict() or {}
-            total += int(x.get("delta", 0) or 0)
-    except Exception:
-        return 0
-    return int(total)
-
-def _calc_credit_score_for_student(student_id: str):
-    credit_cfg = _get_credit_cfg()
-    base = int(credit_cfg.get("base", 50) if credit_cfg.get("base", None) is not None else 50)
-    o_pt = int(credit_cfg.get("o", 1) if credit_cfg.get("o", None) is not None else 1)
-    x_pt = int(credit_cfg.get("x", -3) if credit_cfg.get("x", None) is not None else -3)
-    tri_pt = int(credit_cfg.get("tri", 0) if credit_cfg.get("tri", None) is not None else 0)
-
-    def _delta(v) -> int:
-        v = _norm_status(v)
-        if v == "O":
-            return o_pt
-        if v == "△":
-            return tri_pt
-        return x_pt
-
-    res = api_list_stat_submissions_cached(limit_cols=200)
-    rows_desc = list(res.get("rows", []) or []) if res.get("ok") else []
-
-    score = int(base)
-    # rows_desc는 최신→과거 / 누적은 과거→최신으로
-    for sub in reversed(rows_desc):
-        statuses = dict(sub.get("statuses", {}) or {})
-        v_raw = statuses.get(str(student_id), "X")
-        score = int(score + _delta(v_raw))
-        if score > 100:
-            score = 100
-        if score < 0:
-            score = 0
-    score = int(score + _sum_manual_credit_delta(student_id))
-    if score > 100:
-        score = 100
-    if score < 0:
-        score = 0
-        
-    grade = _score_to_grade(score)
-    return score, grade
-
 def _to_int_safe(v, default: int = 0) -> int:
     try:
         return int(v or 0)
@@ -7031,15 +7779,13 @@ def _to_int_safe(v, default: int = 0) -> int:
         return int(default)
 
 def _safe_stream_recent(col_name: str, order_field: str = "created_at", limit: int = 300):
-    try:
-        return list(
-            db.collection(col_name)
-            .order_by(order_field, direction=mongo.Query.DESCENDING)
-            .limit(int(limit))
-            .stream()
-        )
-    except Exception:
-        return list(db.collection(col_name).limit(int(limit)).stream())
+    """최신순 limit 조회(지연 스트림). 호출부가 순회하는 동안 배치 단위로만 메모리에 올림."""
+    return (
+        db.collection(col_name)
+        .order_by(order_field, direction=mongo.Query.DESCENDING)
+        .limit(int(limit))
+        .stream(batch_size=200)
+    )
 
 def _category_to_korean(category: str) -> str:
     key = str(category or "").strip().lower()
@@ -7083,7 +7829,7 @@ def _actor_to_korean(actor: str) -> str:
 
 def _build_activity_log_rows(limit_per_source: int = 300, max_rows: int = 1200):
     student_map = {}
-    for d in db.collection("students").stream():
+    for d in db.collection("students").select(["name", "no"]).stream():
         sd = d.to_dict() or {}
         student_map[str(d.id)] = {
             "name": str(sd.get("name", "") or ""),
@@ -7289,7 +8035,7 @@ def _build_activity_log_rows(limit_per_source: int = 300, max_rows: int = 1200):
             )
 
     # 9) 적금(savings) 상태 변경
-    for d in _safe_stream_recent("savings", "start_date", limit_per_source):
+    for d in _safe_stream_recent("savings", "start_utc", limit_per_source):
         x = d.to_dict() or {}
         sid = str(x.get("student_id", "") or "")
         stu = student_map.get(sid, {})
@@ -7472,13 +8218,51 @@ def render_tx_table(df_tx: pd.DataFrame):
         hide_index=True,
     )
 
+def _is_fragment_only_run() -> bool:
+    """현재 실행이 전체 스크립트가 아닌 프래그먼트 단독 rerun인지(판별 불가 시 False)."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+        ctx = get_script_run_ctx()
+        return bool(getattr(ctx, "fragment_ids_this_run", None))
+    except Exception:
+        return False
+
 def fragment_if_available(fn):
     """Streamlit fragment 지원 시 해당 렌더 함수만 부분 rerun."""
     _frag = getattr(st, "fragment", None)
     if callable(_frag):
-        return _frag(fn)
+        last_tab = {"tab": ""}
+
+        @functools.wraps(fn)
+        def _run_with_toasts(*args, **kwargs):
+            # 프래그먼트 단독 rerun에서도 toast_and_rerun 알림이 누락되지 않도록
+            flush_pending_toasts()
+            if not _is_fragment_only_run():
+                last_tab["tab"] = db_profiler.current_tab()
+                return fn(*args, **kwargs)
+            # 프래그먼트만 다시 실행된 경우: 프로파일러 trace를 따로 열어 해당 탭으로 귀속
+            db_profiler.begin_rerun(f"fragment:{fn.__name__}", tab=last_tab["tab"])
+            db_identity_map.reset()
+            cache_generations.sync()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                flush_student_assets_dirty()
+                db_profiler.end_rerun()
+
+        return _frag(_run_with_toasts)
     return fn
 
+def rerun_fragment():
+    """프래그먼트 안이면 그 프래그먼트만 다시 실행, 아니면(또는 미지원 버전) 전체 rerun.
+    - 쓰기 결과가 해당 패널에만 보이는 경우에 사용(통장 잔액 등 상단 요약이 바뀌면 st.rerun())
+    """
+    try:
+        st.rerun(scope="fragment")
+    except Exception:
+        st.rerun()
+
 def refresh_account_data_light(name: str, pin: str, force: bool = False):
     now = datetime.now(KST)
     slot = st.session_state.data.get(name, {})
@@ -7564,7 +8348,7 @@ if "🏦 내 통장" in tabs:
                                         if cnt > 0:
                                             api_treasury_auto_bulk_adjust(
                                                 memo=f"전체 {memo_bulk}".strip(),
-                                                signed_amount=-(int(dep_bulk) * cnt),
+                                                signed_amount=-int(res.get("total", int(dep_bulk) * cnt) or 0),
                                                 actor="전체",
                                                 recorder_override=_get_recorder_label(True, str(globals().get("login_name", "") or "").strip()),
                                             )
@@ -7582,7 +8366,7 @@ if "🏦 내 통장" in tabs:
                                         if cnt > 0:
                                             api_treasury_auto_bulk_adjust(
                                                 memo=f"전체 {memo_bulk}".strip(),
-                                                signed_amount=(int(wd_bulk) * cnt),
+                                                signed_amount=-int(res.get("total", -int(wd_bulk) * cnt) or 0),
                                                 actor="전체",
                                                 recorder_override=_get_recorder_label(True, str(globals().get("login_name", "") or "").strip()),
                                             )
@@ -7657,7 +8441,6 @@ if "🏦 내 통장" in tabs:
                                     res2 = api_admin_rollback_selected(admin_pin_rb, sid_rb, selected_ids)
                                     if res2.get("ok"):
                                         toast(f"선택 {res2.get('undone')}건 되돌림 완료", icon="↩️")
-                                        api_list_accounts_cached.clear()
                                         st.rerun()
                                     else:
                                         st.error(res2.get("error", "되돌리기 실패"))
@@ -7795,7 +8578,6 @@ if "🏦 내 통장" in tabs:
                                         fail.append(res.get("error", "저장 실패"))
 
                                 if ok_cnt > 0:
-                                    api_list_accounts_cached.clear()
                                     st.session_state["admin_personal_pick_reset_request"] = True
                                     st.session_state["admin_personal_reward_reset_request"] = True
                                     toast_and_rerun(
@@ -7906,7 +8688,6 @@ if "🏦 내 통장" in tabs:
                         )
                         if res.get("ok"):
                             toast("템플릿 저장 완료!", icon="🧩")
-                            api_list_templates_cached.clear()
                             st.rerun()
                         else:
                             st.error(res.get("error", "템플릿 저장 실패"))
@@ -7934,7 +8715,6 @@ if "🏦 내 통장" in tabs:
                                 if res.get("ok"):
                                     toast("삭제 완료!", icon="🗑️")
                                     st.session_state["bank_tpl_del_confirm"] = False
-                                    api_list_templates_cached.clear()
                                     st.rerun()
                                 else:
                                     st.error(res.get("error", "삭제 실패"))
@@ -8117,7 +8897,6 @@ if "🏦 내 통장" in tabs:
                                 if res.get("ok"):
                                     saved += 1
 
-                            api_list_templates_cached.clear()
                             toast(f"엑셀 저장 완료! ({saved}개 반영)", icon="📥")
                             st.session_state["bank_tpl_bulk_df"] = None
                             st.rerun()
@@ -8357,7 +9136,7 @@ if "admin::🏦 내 통장" in tabs:
                                         if cnt > 0:
                                             api_treasury_auto_bulk_adjust(
                                                 memo=f"전체 {memo_bulk}".strip(),
-                                                signed_amount=-(int(dep_bulk) * cnt),
+                                                signed_amount=-int(res.get("total", int(dep_bulk) * cnt) or 0),
                                                 actor="전체",
                                                 recorder_override=_get_recorder_label(True, str(globals().get("login_name", "") or "").strip()),
                                             )
@@ -8375,7 +9154,7 @@ if "admin::🏦 내 통장" in tabs:
                                         if cnt > 0:
                                             api_treasury_auto_bulk_adjust(
                                                 memo=f"전체 {memo_bulk}".strip(),
-                                                signed_amount=(int(wd_bulk) * cnt),
+                                                signed_amount=-int(res.get("total", -int(wd_bulk) * cnt) or 0),
                                                 actor="전체",
                                                 recorder_override=_get_recorder_label(True, str(globals().get("login_name", "") or "").strip()),
                                             )
@@ -8450,7 +9229,6 @@ if "admin::🏦 내 통장" in tabs:
                                     res2 = api_admin_rollback_selected(admin_pin_rb, sid_rb, selected_ids)
                                     if res2.get("ok"):
                                         toast(f"선택 {res2.get('undone')}건 되돌림 완료", icon="↩️")
-                                        api_list_accounts_cached.clear()
                                         st.rerun()
                                     else:
                                         st.error(res2.get("error", "되돌리기 실패"))
@@ -8588,7 +9366,6 @@ if "admin::🏦 내 통장" in tabs:
                                         fail.append(res.get("error", "저장 실패"))
 
                                 if ok_cnt > 0:
-                                    api_list_accounts_cached.clear()
                                     st.session_state["admin_personal_pick_reset_request"] = True
                                     st.session_state["admin_personal_reward_reset_request"] = True
                                     toast_and_rerun(
@@ -8699,7 +9476,6 @@ if "admin::🏦 내 통장" in tabs:
                         )
                         if res.get("ok"):
                             toast("템플릿 저장 완료!", icon="🧩")
-                            api_list_templates_cached.clear()
                             st.rerun()
                         else:
                             st.error(res.get("error", "템플릿 저장 실패"))
@@ -8727,7 +9503,6 @@ if "admin::🏦 내 통장" in tabs:
                                 if res.get("ok"):
                                     toast("삭제 완료!", icon="🗑️")
                                     st.session_state["bank_tpl_del_confirm"] = False
-                                    api_list_templates_cached.clear()
                                     st.rerun()
                                 else:
                                     st.error(res.get("error", "삭제 실패"))
@@ -8910,7 +9685,6 @@ if "admin::🏦 내 통장" in tabs:
                                 if res.get("ok"):
                                     saved += 1
 
-                            api_list_templates_cached.clear()
                             toast(f"엑셀 저장 완료! ({saved}개 반영)", icon="📥")
                             st.session_state["bank_tpl_bulk_df"] = None
                             st.rerun()
@@ -9078,11 +9852,7 @@ def _render_invest_admin_like(*, inv_admin_ok_flag: bool, force_is_admin: bool,
             rid = str((snap.to_dict() or {}).get("role_id", "") or "")
             if not rid:
                 return False
-            roles = api_list_roles_cached()
-            for r in roles:
-                if str(r.get("role_id")) == rid:
-                    return str(r.get("role_name", "") or "") == "투자증권"
-            return False
+            return _role_name(rid) == "투자증권"
         except Exception:
             return False
     
@@ -9090,33 +9860,15 @@ def _render_invest_admin_like(*, inv_admin_ok_flag: bool, force_is_admin: bool,
     # 장부 로드
     # -------------------------
     def _load_ledger(for_student_id: str | None):
+        # invest_ledger(student_id, buy_at desc) / (buy_at desc) 인덱스 사용: 학생 필터는 서버에서 처리
         try:
-            q = (
-                db.collection(INV_LEDGER_COL)
-                .order_by("buy_at", direction=mongo.Query.DESCENDING)
-                .limit(400)
-                .stream()
-            )
-            rows = []
-            for d in q:
-                x = d.to_dict() or {}
-                if for_student_id and str(x.get("student_id")) != str(for_student_id):
-                    continue
-                rows.append({**x, "_doc_id": d.id})
-            return rows
+            q = db.collection(INV_LEDGER_COL)
+            if for_student_id:
+                q = q.where(filter=build_filter("student_id", "==", str(for_student_id)))
+            q = q.order_by("buy_at", direction=mongo.Query.DESCENDING).limit(400).stream()
+            return [{**(d.to_dict() or {}), "_doc_id": d.id} for d in q]
         except Exception:
-            # fallback(인덱스 등)
-            try:
-                q = db.collection(INV_LEDGER_COL).limit(400).stream()
-                rows = []
-                for d in q:
-                    x = d.to_dict() or {}
-                    if for_student_id and str(x.get("student_id")) != str(for_student_id):
-                        continue
-                    rows.append({**x, "_doc_id": d.id})
-                return rows
-            except Exception:
-                return []
+            return []
     
     # -------------------------
     # 주가 변동 내역 로드 (표용)
@@ -9125,7 +9877,7 @@ def _render_invest_admin_like(*, inv_admin_ok_flag: bool, force_is_admin: bool,
     def _get_history(product_id: str, limit=120):
         pid = str(product_id)
         out = []
-        # 1) 인덱스 OK일 때
+        # invest_price_history(product_id, created_at desc) 인덱스로 최신순 limit 조회
         try:
             q = (
                 db.collection(INV_HIST_COL)
@@ -9147,31 +9899,6 @@ def _render_invest_admin_like(*, inv_admin_ok_flag: bool, force_is_admin: bool,
                     }
                 )
             return out
-        except Exception:
-            pass
-    
-        # 2) fallback
-        try:
-            q = (
-                db.collection(INV_HIST_COL)
-                .where(filter=build_filter("product_id", "==", pid))
-                .limit(int(limit))
-                .stream()
-            )
-            for d in q:
-                x = d.to_dict() or {}
-                out.append(
-                    {
-                        "created_at": x.get("created_at"),
-                        "reason": str(x.get("reason", "") or "").strip(),
-                        "price_before": _as_price1(x.get("price_before", x.get("price", 0.0))),
-                        "price_after": _as_price1(x.get("price_after", x.get("price", 0.0))),
-                        "real_price_before": _as_price1(x.get("real_price_before", x.get("price_before", x.get("price", 0.0)))),
-                        "real_price_after": _as_price1(x.get("real_price_after", x.get("price_after", x.get("price", 0.0)))),
-                    }
-                )
-            out.sort(key=lambda r: str(r.get("created_at") or ""), reverse=True)
-            return out
         except Exception:
             return []
     
@@ -10475,47 +11202,9 @@ if "admin::🏦 은행(적금)" in tabs:
             except Exception:
                 return ""
 
-        def _parse_iso_to_dt(iso_utc: str):
-            try:
-                return datetime.fromisoformat(str(iso_utc).replace("Z", "+00:00"))
-            except Exception:
-                return None
-
-        def _dt_to_iso_z(dt: datetime) -> str:
-            try:
-                return dt.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
-            except Exception:
-                return ""
-
-        def _score_to_grade(score: int) -> int:
-            s = int(score)
-            if s >= 90:
-                return 1
-            if s >= 80:
-                return 2
-            if s >= 70:
-                return 3
-            if s >= 60:
-                return 4
-            if s >= 50:
-                return 5
-            if s >= 40:
-                return 6
-            if s >= 30:
-                return 7
-            if s >= 20:
-                return 8
-            if s >= 10:
-                return 9
-            return 10
-
-        def _norm_status(v) -> str:
-            v = str(v or "").strip().upper()
-            if v in ("O", "○"):
-                return "O"
-            if v in ("△", "▲", "Δ"):
-                return "△"
-            return "X"
+        def _parse_iso_to_dt(iso_utc):
+            # maturity_utc/start_utc: BSON date(정규화 후) 또는 ISO 문자열(레거시) 모두 처리
+            return _to_utc_datetime(iso_utc)
 
         # -------------------------------------------------
         # (1) 이자율 표(설정값 mongo에서 로드)
@@ -10597,57 +11286,8 @@ if "admin::🏦 은행(적금)" in tabs:
                 return 0.0
 
         # -------------------------------------------------
-        # (2) 신용점수/등급(현재 시점) 계산 (학생 1명용)
-        #  - credit_scoring 설정 + 통계청 제출물(statuses) 누적
+        # (2) 신용점수/등급(현재 시점): 공용 신용 엔진(_calc_credit_score_for_student) 사용
         # -------------------------------------------------
-        def _get_credit_cfg():
-            ref = db.collection("config").document("credit_scoring")
-            snap = ref.get()
-            if not snap.exists:
-                return {"base": 50, "o": 1, "x": -3, "tri": 0}
-            d = snap.to_dict() or {}
-            return {
-                "base": int(d.get("base", 50) if d.get("base", None) is not None else 50),
-                "o": int(d.get("o", 1) if d.get("o", None) is not None else 1),
-                "x": int(d.get("x", -3) if d.get("x", None) is not None else -3),
-                "tri": int(d.get("tri", 0) if d.get("tri", None) is not None else 0),
-            }
-
-        def _calc_credit_score_for_student(student_id: str) -> tuple[int, int]:
-            cfg = _get_credit_cfg()
-            base = int(cfg.get("base", 50) if cfg.get("base", None) is not None else 50)
-            o_pt = int(cfg.get("o", 1) if cfg.get("o", None) is not None else 1)
-            x_pt = int(cfg.get("x", -3) if cfg.get("x", None) is not None else -3)
-            tri_pt = int(cfg.get("tri", 0) if cfg.get("tri", None) is not None else 0)
-
-            def _delta(v):
-                vv = _norm_status(v)
-                if vv == "O":
-                    return o_pt
-                if vv == "△":
-                    return tri_pt
-                return x_pt
-
-            sub_res = api_list_stat_submissions_cached(limit_cols=200)
-            sub_rows_all = sub_res.get("rows", []) if sub_res.get("ok") else []
-
-            # ✅ 오래된→최신 누적 (api_list_stat_submissions_cached는 최신→과거로 오므로 reversed)
-            sub_rows_all = list(sub_rows_all or [])
-
-            score = int(base)
-            sid = str(student_id)
-
-            for sub in reversed(sub_rows_all):
-                statuses = dict(sub.get("statuses", {}) or {})
-                v = statuses.get(sid, "X")
-                score = int(score + _delta(v))
-                if score > 100:
-                    score = 100
-                if score < 0:
-                    score = 0
-
-            grade = _score_to_grade(score)
-            return score, grade
 
         # -------------------------------------------------
         # (3) 적금 저장/조회/처리 (mongo: savings)
@@ -10670,7 +11310,12 @@ if "admin::🏦 은행(적금)" in tabs:
             - 원금+이자를 학생 통장에 입금(+)
             """
             now = datetime.now(timezone.utc)
-            q = db.collection(SAV_COL).where(filter=build_filter("status", "==", "running")).stream()
+            q = (
+                db.collection(SAV_COL)
+                .where(filter=build_filter("status", "==", "running"))
+                .where(filter=build_filter("maturity_utc", "<=", now))
+                .stream()
+            )
 
             proc_cnt = 0
             for d in q:
@@ -10793,8 +11438,8 @@ if "admin::🏦 은행(적금)" in tabs:
                 "principal": int(principal),
                 "interest": int(interest),
                 "maturity_amount": int(maturity_amt),
-                "start_utc": _dt_to_iso_z(now_utc),
-                "maturity_utc": _dt_to_iso_z(maturity_utc),
+                "start_utc": now_utc,
+                "maturity_utc": maturity_utc,
                 "status": "running",          # running / matured / canceled
                 "payout_amount": None,
                 "created_at": datetime.utcnow(),
@@ -10806,7 +11451,7 @@ if "admin::🏦 은행(적금)" in tabs:
             q = db.collection(SAV_COL).order_by("start_utc", direction=mongo.Query.DESCENDING).limit(int(limit)).stream()
             rows = []
             for d in q:
-                x = d.to_dict() or {}
+                x = d.to_dict(copy=True) or {}
                 x["_id"] = d.id
                 rows.append(x)
             return rows
@@ -11025,6 +11670,9 @@ if "🔎 개별조회" in tabs:
 
             if not view_rows:
                 st.info("아래 조회 버튼을 눌러 학생 정보를 불러오세요.")
+            else:
+                # ✅ student_assets 일괄 조회($in 1회) → 적금/투자/직업/신용 계산 없이 한 줄 요약 구성
+                assets_by_id = _get_student_assets_many([str(r["student_id"]) for r in view_rows])
 
             for r in view_rows:
                 sid = str(r["student_id"])
@@ -11032,30 +11680,17 @@ if "🔎 개별조회" in tabs:
                 no = int(r.get("no", 0) or 0)
                 bal_now = int(r.get("balance", 0) or 0)
 
-                # -------------------------
-                # 적금
-                # -------------------------
-                sres = api_savings_list_by_student_id(sid)
-                savings = sres.get("savings", []) if sres.get("ok") else []
-
-                # ✅ 적금 탭과 동일한 기준: 만기/해지 제외 원금 합계
-                sv_total = sum(
-                    int(s.get("principal", 0) or 0)
-                    for s in savings
-                    if str(s.get("status", "")).lower().strip()
-                    not in ("matured", "canceled", "cancelled")
-                )
-
-                # -------------------------
-                # 투자 요약
-                # -------------------------
-                inv_text, inv_total = _get_invest_summary_by_student_id(sid)
+                assets = assets_by_id.get(sid) or {}
 
                 # -------------------------
-                # 직업 / 신용
+                # 적금(만기/해지 제외 원금) / 투자 요약 / 직업 / 신용
                 # -------------------------
-                role_name = _get_role_name_by_student_id(sid)
-                credit_score, credit_grade = _safe_credit(sid)
+                sv_total = int(assets.get("savings_principal", 0) or 0)
+                inv_text = str(assets.get("invest_eval_text", "없음") or "없음")
+                inv_total = int(assets.get("invest_eval", 0) or 0)
+                role_name = str(assets.get("role_name", "") or "")
+                credit_score = int(assets.get("credit_score", DEFAULT_CREDIT_SCORE) or 0)
+                credit_grade = int(assets.get("credit_grade", DEFAULT_CREDIT_GRADE) or 0)
 
                 # -------------------------
                 # 총자산
@@ -11147,7 +11782,7 @@ if "⭐ 권한부여" in tabs:
 
         # ✅ 학생 목록(활성 학생)
         stu_list = []
-        for x in _list_active_students_full_cached():
+        for x in _list_active_students_full_cached(STUDENT_LIST_FIELDS + ("extra_permissions",)):
             try:
                 no = int(x.get("no", 0) or 0)
             except Exception:
@@ -11225,7 +11860,7 @@ if "⭐ 권한부여" in tabs:
                 cur_set.add(str(k))
             for k in remove_keys:
                 cur_set.discard(str(k))
-            ref.update({"extra_permissions": sorted(list(cur_set))})
+            ref.update({"extra_permissions": sorted(list(cur_set)), "auth_version": _new_auth_version()})
 
         g1, g2, g3, g4 = st.columns([1, 1, 1, 2])
         with g1:
@@ -11253,7 +11888,6 @@ if "⭐ 권한부여" in tabs:
                     continue
                 _update_student_extra(r["doc_id"], add_keys=keys)
                 n += 1
-            _list_active_students_full_cached.clear()
             st.success(f"권한 부여 완료: {n}명")
             st.session_state["perm_reset_req_v2"] = True            
             st.rerun()
@@ -11266,7 +11900,6 @@ if "⭐ 권한부여" in tabs:
                     continue
                 _update_student_extra(r["doc_id"], remove_keys=keys)
                 n += 1
-            _list_active_students_full_cached.clear()
             st.success(f"권한 회수 완료: {n}명")
             st.session_state["perm_reset_req_v2"] = True           
             st.rerun()
@@ -11277,7 +11910,6 @@ if "⭐ 권한부여" in tabs:
             for x in _list_active_students_full_cached():
                 db.collection("students").document(str(x.get("student_id", "") or "")).update({"extra_permissions": []})
                 n += 1
-            _list_active_students_full_cached.clear()
             st.success(f"전체 학생 권한 전체 회수 완료: {n}명")
             st.session_state["perm_reset_req_v2"] = True            
             st.rerun()
@@ -11289,7 +11921,7 @@ if "⭐ 권한부여" in tabs:
         st.caption("학생이 기존에 사용하던 유형의 탭(괄호 안 관리자 표기)은 관리자 기능 탭으로 구분됩니다.")
 
         rows_status = []
-        for x in _list_active_students_full_cached():
+        for x in _list_active_students_full_cached(STUDENT_LIST_FIELDS + ("extra_permissions",)):
             extra = x.get("extra_permissions", []) or []
             if not isinstance(extra, list):
                 extra = []
@@ -11488,7 +12120,6 @@ if "⭐ 권한부여" in tabs:
                         _update_student_extra(sid, add_keys=add_keys)
                         applied += 1
 
-                    _list_active_students_full_cached.clear()
                     if applied:
                         st.success(f"엑셀 권한 부여 완료: {applied}행 적용")
                     if skipped:
@@ -11532,7 +12163,7 @@ if "👥 계정 정보" in tabs:
                     "이름": str(x.get("name", "") or "").strip(),
                     "비밀번호": str(x.get("pin", "") or "").strip(),
                 }
-                for x in _list_active_students_full_cached()
+                for x in _list_active_students_full_cached(STUDENT_LIST_FIELDS + ("pin",))
             ],
             columns=["번호", "이름", "비밀번호"],
         )
@@ -11586,7 +12217,9 @@ if "👥 계정 정보" in tabs:
                     # 현재 active 학생들 맵(번호->docid, 이름->docid)
                     by_no = {}
                     by_name = {}
-                    for x in _list_active_students_full_cached():
+                    pin_by_id = {}  # PIN이 실제로 바뀐 학생만 auth_version 갱신(재업로드로 전원 로그아웃 방지)
+                    for x in _list_active_students_full_cached(STUDENT_LIST_FIELDS + ("pin",)):
+                        pin_by_id[str(x.get("student_id", "") or "")] = str(x.get("pin", "") or "")
                         no0 = x.get("no")
                         nm0 = str(x.get("name", "") or "").strip()
                         if isinstance(no0, (int, float)) and str(no0) != "nan":
@@ -11623,11 +12256,12 @@ if "👥 계정 정보" in tabs:
                         }
 
                         # ✅ 번호 우선 업데이트, 없으면 이름으로 업데이트, 없으면 신규 생성
-                        if int(no) in by_no:
-                            db.collection("students").document(by_no[int(no)]).update(payload)
-                            updated += 1
-                        elif name in by_name:
-                            db.collection("students").document(by_name[name]).update(payload)
+                        target_id = by_no.get(int(no)) or by_name.get(name)
+                        if target_id:
+                            # 기존 학생은 모두 활성 상태(활성 목록에서 찾음) → 세션 무효화 조건은 PIN 변경뿐
+                            if pin_by_id.get(target_id) != pin:
+                                payload["auth_version"] = _new_auth_version()
+                            db.collection("students").document(target_id).update(payload)
                             updated += 1
                         else:
                             db.collection("students").document().set(
@@ -11642,8 +12276,6 @@ if "👥 계정 정보" in tabs:
                             )
                             created += 1
 
-                    api_list_accounts_cached.clear()
-                    _list_active_students_full_cached.clear()
                     toast_and_rerun(f"엑셀 등록 완료 (신규 {created} / 수정 {updated} / 제외 {skipped})", icon="📥")
 
                 except Exception as e:
@@ -11655,7 +12287,7 @@ if "👥 계정 정보" in tabs:
         #   - student_id 컬럼은 화면에서 제거(내부로만 유지)
         # -------------------------------------------------
         rows = []
-        for x in _list_active_students_full_cached():
+        for x in _list_active_students_full_cached(STUDENT_LIST_FIELDS + ("pin",)):
             # 엑셀 번호를 의미하는 "no"를 사용 (없으면 큰 값으로 뒤로)
             no = x.get("no", 999999)
             try:
@@ -11716,7 +12348,6 @@ if "👥 계정 정보" in tabs:
                     for sid in st.session_state._delete_targets:
                         db.collection("students").document(sid).update({"is_active": False})
                     st.session_state.pop("_delete_targets")
-                    api_list_accounts_cached.clear()
                     toast("삭제 완료", icon="🗑️")
                     # ✅ 삭제 후 리스트 즉시 반영
                     st.session_state.pop("account_df", None)
@@ -11848,17 +12479,6 @@ if "💼 직업/월급" in tabs:
                 merge=True,
             )
 
-        def _calc_net(gross: int, cfg: dict) -> int:
-            gross = int(gross or 0)
-            tax_percent = float(cfg.get("tax_percent", 10.0) or 10.0)
-            desk = int(cfg.get("desk_rent", 50) or 50)
-            elec = int(cfg.get("electric_fee", 10) or 10)
-            health = int(cfg.get("health_fee", 10) or 10)
-
-            tax = int(round(gross * (tax_percent / 100.0)))
-            net = gross - tax - desk - elec - health
-            return max(0, int(net))
-
         cfg = _get_salary_cfg()
 
         with st.expander("⚙️ 실수령액 계산식(공제 설정) 변경", expanded=False):
@@ -11999,7 +12619,11 @@ if "💼 직업/월급" in tabs:
             id_to_name = {a.get("student_id"): a.get("name") for a in accs if a.get("student_id")}
 
             # job_salary 기준으로 배정된 학생들에게 지급
-            q = db.collection("job_salary").order_by("order").stream()
+            q = list(db.collection("job_salary").order_by("order").stream())
+            _prefetch_paylogs(
+                mkey,
+                [(str(sid or "").strip(), d.id) for d in q for sid in ((d.to_dict() or {}).get("assigned_ids", []) or [])],
+            )
             paid_cnt, skip_cnt, err_cnt = 0, 0, 0
 
             for d in q:
@@ -12007,7 +12631,7 @@ if "💼 직업/월급" in tabs:
                 job_id = str(d.id)
                 job_name = str(x.get("job", "") or "")
                 gross = int(x.get("salary", 0) or 0)
-                net_amt = int(_calc_net(gross, cfg) or 0)
+                net_amt = int(_system_calc_net(gross, cfg) or 0)
                 assigned_ids = list(x.get("assigned_ids", []) or [])
 
                 if net_amt <= 0:
@@ -12046,7 +12670,6 @@ if "💼 직업/월급" in tabs:
             # 자동지급 결과는 너무 시끄럽지 않게 토스트 1번만
             if paid_cnt > 0:
                 toast(f"월급 자동지급 완료: {paid_cnt}명(패스 {skip_cnt})", icon="💸")
-                api_list_accounts_cached.clear()
             elif err_cnt > 0:
                 st.warning("월급 자동지급 중 일부 오류가 있었어요. (로그 확인)")
 
@@ -12180,7 +12803,7 @@ if "💼 직업/월급" in tabs:
             for j in job_rows:
                 jn = str(j.get("job", "") or "")
                 gross = int(j.get("gross", 0) or 0)
-                net = int(_calc_net(gross, salary_cfg) or 0)
+                net = int(_system_calc_net(gross, salary_cfg) or 0)
                 ded = int(max(0, gross - net))
                 if jn and (jn not in job_to_deduction):
                     job_to_deduction[jn] = ded
@@ -12231,10 +12854,6 @@ if "💼 직업/월급" in tabs:
                     else:
                         errs.append(f"[국고정정실패] sid={sid} job={job_name} err={tre_res.get('error')}")
 
-            if fixed_cnt > 0:
-                api_list_accounts_cached.clear()
-                api_list_treasury_ledger_cached.clear()
-
             return {"ok": len(errs) == 0, "fixed": fixed_cnt, "treasury_fixed": tre_cnt, "errors": errs}
 
         payroll_cfg = _get_payroll_cfg()
@@ -12270,6 +12889,20 @@ if "💼 직업/월급" in tabs:
 
             st.caption("• 수동지급: 이번 달(현재 월)에 즉시 지급합니다. 이미 지급한 기록이 있으면 확인 후 재지급합니다.")
 
+            # ✅ 시스템 자동처리(적금 만기/월급) 스케줄러 실행 상태
+            job_st = api_get_system_job_status()
+            if job_st.get("ok") and job_st.get("ran"):
+                jc = dict(job_st.get("counts", {}) or {})
+                st.caption(
+                    f"• 자동처리 마지막 실행: {format_kr_datetime(job_st.get('last_run_at'))}"
+                    f" | 소요 {int(job_st.get('duration_ms', 0))}ms"
+                    f" | 적금 만기 {int(jc.get('matured', 0) or 0)}건"
+                    f" | 월급 {int(jc.get('payroll_paid', 0) or 0)}건"
+                    + (f" | ⚠️ 오류: {job_st.get('error')}" if job_st.get("error") else "")
+                )
+            else:
+                st.caption("• 자동처리 스케줄러가 아직 실행되지 않았습니다.")
+
             # -------------------------
             # 수동지급 버튼 + 이미 지급 여부 확인(이번 달)
             # -------------------------
@@ -12284,7 +12917,7 @@ if "💼 직업/월급" in tabs:
                 x = d.to_dict() or {}
                 job_name = str(x.get("job", "") or "")
                 gross = int(x.get("salary", 0) or 0)
-                net_amt = int(_calc_net(gross, cfg) or 0)
+                net_amt = int(_system_calc_net(gross, cfg) or 0)
                 if net_amt <= 0:
                     continue
                 for sid in list(x.get("assigned_ids", []) or []):
@@ -12293,6 +12926,7 @@ if "💼 직업/월급" in tabs:
                         targets.append((sid, net_amt, job_name, gross, str(d.id)))
             # ✅ 여러 직업 배정 허용: (학생+직업) 단위로 각각 지급
 
+            _prefetch_paylogs(cur_mkey, [(sid, jid) for sid, _, _, _, jid in targets])
             already_any = any(_already_paid_this_month(cur_mkey, sid, job_id=jid, job_name=jb) for sid, _, jb, _, jid in targets)
 
             if st.button("💸 수동지급(이번 달 즉시 지급)", use_container_width=True, key="payroll_manual_btn"):
@@ -12356,7 +12990,6 @@ if "💼 직업/월급" in tabs:
                     else:
                         err_cnt += 1
 
-                api_list_accounts_cached.clear()
                 if paid_cnt > 0:
                     toast(f"월급 수동지급 완료: {paid_cnt}명", icon="💸")
                 if err_cnt > 0:
@@ -12634,7 +13267,7 @@ if "💼 직업/월급" in tabs:
             rid = r["_id"]
             job = r["job"]
             salary = int(r["salary"])
-            net = int(_calc_net(salary, cfg) or 0)
+            net = int(_system_calc_net(salary, cfg) or 0)
             cnt = max(0, int(r.get("student_count", 1) or 1))
             assigned_ids = list(r.get("assigned_ids", []) or [])
 
@@ -12850,7 +13483,7 @@ if "💼 직업/월급" in tabs:
                         if len(assigned_ids) > cnt:
                             assigned_ids = assigned_ids[:cnt]
 
-                    net = _calc_net(salary, cfg)
+                    net = _system_calc_net(salary, cfg)
 
                     rowc = st.columns([0.8, 1.0, 2.6, 1.3, 1.3, 1.6])
 
@@ -12957,7 +13590,7 @@ if "💼 직업/월급" in tabs:
             sal_in = st.number_input("월급", min_value=0, step=1, key="job_in_salary")
         with f3:
             # 실수령 미리보기
-            st.metric("실수령액(자동)", _calc_net(int(sal_in), cfg))
+            st.metric("실수령액(자동)", _system_calc_net(int(sal_in), cfg))
 
         # 학생 수(기본 1)
         sc_in = st.number_input(
@@ -13528,7 +14161,6 @@ if "🏛️ 국세청(국고)" in tabs:
                             if not save_res.get("ok"):
                                 raise RuntimeError(save_res.get("error", "저장 실패"))
 
-                        api_list_treasury_templates_cached.clear()
                         st.session_state["tre_tpl_bulk_df"] = None
                         st.session_state["tre_tpl_reset_req"] = True
                         toast_and_rerun("국고 템플릿 엑셀 저장(반영) 완료!", icon="📥")
@@ -13540,335 +14172,329 @@ if "🏛️ 국세청(국고)" in tabs:
 # - 클릭은 로컬만 변경(X→O→△→X)
 # - [저장] 버튼 눌렀을 때만 DB 반영
 # =========================
-if "📊 통계청" in tabs:
-    with tab_map["📊 통계청"]:
+@fragment_if_available
+def _render_stat_office_tab():
+    """📊 통계청 탭 본문(프래그먼트: O/X 셀 선택·페이지 이동은 이 탭만 다시 실행)."""
 
-        if not (is_admin or has_tab_access(my_perms, "📊 통계청", is_admin)):
-            st.error("접근 권한이 없습니다.")
-            st.stop()
+    if not (is_admin or has_tab_access(my_perms, "📊 통계청", is_admin)):
+        st.error("접근 권한이 없습니다.")
+        st.stop()
 
-        # -------------------------
-        # 계정(학생) 목록: 번호/이름 자동 반영
-        # -------------------------
-        # api_list_accounts_cached()는 name/balance/student_id만 주므로,
-        # 번호(no)까지 필요해서 students에서 직접 읽어옴.
-        docs_acc2 = db.collection("students").where(filter=build_filter("is_active", "==", True)).stream()
-        stu_rows = []
-        for d in docs_acc2:
-            x = d.to_dict() or {}
-            try:
-                no = int(x.get("no", 999999) or 999999)
-            except Exception:
-                no = 999999
-            nm = str(x.get("name", "") or "").strip()
-            if nm:
-                stu_rows.append({"student_id": d.id, "no": no, "name": nm})
-        stu_rows.sort(key=lambda r: (r["no"], r["name"]))
+    # -------------------------
+    # 계정(학생) 목록: 번호/이름 자동 반영
+    # -------------------------
+    # api_list_accounts_cached()는 name/balance/student_id만 주므로,
+    # 번호(no)까지 필요해서 students에서 직접 읽어옴.
+    docs_acc2 = db.collection("students").where(filter=build_filter("is_active", "==", True)).stream()
+    stu_rows = []
+    for d in docs_acc2:
+        x = d.to_dict() or {}
+        try:
+            no = int(x.get("no", 999999) or 999999)
+        except Exception:
+            no = 999999
+        nm = str(x.get("name", "") or "").strip()
+        if nm:
+            stu_rows.append({"student_id": d.id, "no": no, "name": nm})
+    stu_rows.sort(key=lambda r: (r["no"], r["name"]))
 
-        # -------------------------
-        # (상단) 제출물 내역 추가
-        # -------------------------
-        st.markdown("### ➕ 제출물 내역 추가")
-
-        stat_tpls = api_list_stat_templates_cached().get("templates", [])
-        stat_tpl_labels = ["(직접 입력)"] + [str(t.get("label", "") or "") for t in stat_tpls]
-        # (PATCH) 저장 후 템플릿/내역 입력값을 안전하게 초기화(위젯 생성 전에만 세팅 가능)
-
-        if st.session_state.get("stat_add_reset_req", False):
-            st.session_state["stat_add_tpl"] = "(직접 입력)"
-            st.session_state["stat_add_tpl_prev"] = "(직접 입력)"
-            st.session_state["stat_add_label"] = ""
-
-            # 표 로컬 편집 상태도 새로 로드되게
-            st.session_state["stat_loaded_sig"] = ""
-            st.session_state["stat_edit"] = {}
-
-            st.session_state["stat_add_reset_req"] = False
-
-        # 템플릿 선택
-        stat_pick = st.selectbox("제출물 템플릿", stat_tpl_labels, key="stat_add_tpl")
-
-        # 템플릿 고르면 내역 자동 입력
-        if "stat_add_tpl_prev" not in st.session_state:
-            st.session_state["stat_add_tpl_prev"] = stat_pick
-
-        if stat_pick != st.session_state.get("stat_add_tpl_prev"):
-            st.session_state["stat_add_tpl_prev"] = stat_pick
-            if stat_pick != "(직접 입력)":
-                st.session_state["stat_add_label"] = stat_pick
-
-        add_c1, add_c2 = st.columns([3.0, 1.0])
-        with add_c1:
-            add_label = st.text_input("내역", key="stat_add_label").strip()
-        with add_c2:
-            if st.button("저장", use_container_width=True, key="stat_add_save"):
-                if not add_label:
-                    st.error("내역을 입력해 주세요.")
+    # -------------------------
+    # (상단) 제출물 내역 추가
+    # -------------------------
+    st.markdown("### ➕ 제출물 내역 추가")
+
+    stat_tpls = api_list_stat_templates_cached().get("templates", [])
+    stat_tpl_labels = ["(직접 입력)"] + [str(t.get("label", "") or "") for t in stat_tpls]
+    # (PATCH) 저장 후 템플릿/내역 입력값을 안전하게 초기화(위젯 생성 전에만 세팅 가능)
+
+    if st.session_state.get("stat_add_reset_req", False):
+        st.session_state["stat_add_tpl"] = "(직접 입력)"
+        st.session_state["stat_add_tpl_prev"] = "(직접 입력)"
+        st.session_state["stat_add_label"] = ""
+
+        # 표 로컬 편집 상태도 새로 로드되게
+        st.session_state["stat_loaded_sig"] = ""
+        st.session_state["stat_edit"] = {}
+
+        st.session_state["stat_add_reset_req"] = False
+
+    # 템플릿 선택
+    stat_pick = st.selectbox("제출물 템플릿", stat_tpl_labels, key="stat_add_tpl")
+
+    # 템플릿 고르면 내역 자동 입력
+    if "stat_add_tpl_prev" not in st.session_state:
+        st.session_state["stat_add_tpl_prev"] = stat_pick
+
+    if stat_pick != st.session_state.get("stat_add_tpl_prev"):
+        st.session_state["stat_add_tpl_prev"] = stat_pick
+        if stat_pick != "(직접 입력)":
+            st.session_state["stat_add_label"] = stat_pick
+
+    add_c1, add_c2 = st.columns([3.0, 1.0])
+    with add_c1:
+        add_label = st.text_input("내역", key="stat_add_label").strip()
+    with add_c2:
+        if st.button("저장", use_container_width=True, key="stat_add_save"):
+            if not add_label:
+                st.error("내역을 입력해 주세요.")
+            else:
+                res = api_admin_add_stat_submission(ADMIN_PIN, add_label, active_accounts=stu_rows)
+                if res.get("ok"):
+                    st.session_state["stat_add_reset_req"] = True
+                    toast_and_rerun("제출물 내역 추가 완료!", icon="✅", scope="fragment")
                 else:
-                    res = api_admin_add_stat_submission(ADMIN_PIN, add_label, active_accounts=stu_rows)
-                    if res.get("ok"):
-                        st.session_state["stat_add_reset_req"] = True
-                        toast_and_rerun("제출물 내역 추가 완료!", icon="✅")
-                    else:
-                        st.error(res.get("error", "추가 실패"))
-
-
-        # -------------------------
-        # (중간) 통계청 통계표
-        # - 최신 제출물이 "왼쪽" (created_at DESC)
-        # - 클릭은 로컬 변경, [저장] 시 DB 반영
-        # -------------------------
-        st.markdown("### 📋 통계 관리 장부")
+                    st.error(res.get("error", "추가 실패"))
 
-        # 최신 제출물 N개(왼쪽부터 최신)
-        sub_res = api_list_stat_submissions_cached(limit_cols=50)
-        sub_rows_all = sub_res.get("rows", []) if sub_res.get("ok") else []
 
-        submission_ids = [r.get("submission_id") for r in sub_rows_all if r.get("submission_id")]
+    # -------------------------
+    # (중간) 통계청 통계표
+    # - 최신 제출물이 "왼쪽" (created_at DESC)
+    # - 클릭은 로컬 변경, [저장] 시 DB 반영
+    # -------------------------
+    st.markdown("### 📋 통계 관리 장부")
 
-        # -------------------------
-        # (PATCH) 가로 "좌우 이동" + 페이지 숫자(클릭 이동)
-        # ✅ 기준 통일: page_idx(0=최신 페이지)로 관리
-        # - 한 화면 7개(VISIBLE_COLS)
-        # - 숫자 버튼은 작게, "/전체페이지 N"은 텍스트(클릭 불가)
-        # -------------------------
-        import math
+    # 최신 제출물 N개(왼쪽부터 최신) - 페이지 단위로 불러오고 '더 불러오기'로 이전 제출물 추가
+    stat_cols_res = api_list_stat_columns(limit_cols=int(st.session_state["stat_cols_loaded"]))
+    sub_rows_all = _stat_columns_to_rows(stat_cols_res)
 
-        VISIBLE_COLS = 7
-        total_cols = len(sub_rows_all)
+    submission_ids = [r.get("submission_id") for r in sub_rows_all if r.get("submission_id")]
 
-        total_pages = max(1, int(math.ceil(total_cols / VISIBLE_COLS)))
-        if "stat_page_idx" not in st.session_state:
-            st.session_state["stat_page_idx"] = 0  # ✅ 0 = 최신 페이지
+    # -------------------------
+    # (PATCH) 가로 "좌우 이동" + 페이지 숫자(클릭 이동)
+    # ✅ 기준 통일: page_idx(0=최신 페이지)로 관리
+    # - 한 화면 7개(VISIBLE_COLS)
+    # - 숫자 버튼은 작게, "/전체페이지 N"은 텍스트(클릭 불가)
+    # -------------------------
+    import math
+
+    VISIBLE_COLS = 7
+    total_cols = len(sub_rows_all)
+
+    total_pages = max(1, int(math.ceil(total_cols / VISIBLE_COLS)))
+    if "stat_page_idx" not in st.session_state:
+        st.session_state["stat_page_idx"] = 0  # ✅ 0 = 최신 페이지
+
+    # page_idx 안전 클램프
+    st.session_state["stat_page_idx"] = max(0, min(int(st.session_state["stat_page_idx"]), total_pages - 1))
+    page_idx = int(st.session_state["stat_page_idx"])
+    cur_page = page_idx + 1  # 1-based
+
+    def _goto_page(p: int):
+        # p = 1..total_pages, 1이 최신 페이지
+        p = max(1, min(int(p), total_pages))
+        st.session_state["stat_page_idx"] = p - 1
+        rerun_fragment()
+
+    def _page_items(cur: int, last: int):
+        if last <= 9:
+            return list(range(1, last + 1))
+        items = [1]
+        left = max(2, cur - 1)
+        right = min(last - 1, cur + 1)
+        if left > 2:
+            items.append("…")
+        items.extend(range(left, right + 1))
+        if right < last - 1:
+            items.append("…")
+        items.append(last)
+        out = []
+        for x in items:
+            if not out or out[-1] != x:
+                out.append(x)
+        return out
 
-        # page_idx 안전 클램프
-        st.session_state["stat_page_idx"] = max(0, min(int(st.session_state["stat_page_idx"]), total_pages - 1))
-        page_idx = int(st.session_state["stat_page_idx"])
-        cur_page = page_idx + 1  # 1-based
+    # ✅ 한 줄: [◀] [페이지] [/전체페이지] [▶] | [저장/초기화/삭제]
+    row = st.columns([4, 3], gap="small")
 
-        def _goto_page(p: int):
-            # p = 1..total_pages, 1이 최신 페이지
-            p = max(1, min(int(p), total_pages))
-            st.session_state["stat_page_idx"] = p - 1
-            st.rerun()
+    with row[0]:
+        nav = st.columns([1, 1, 1, 1], gap="small")
 
-        def _page_items(cur: int, last: int):
-            if last <= 9:
-                return list(range(1, last + 1))
-            items = [1]
-            left = max(2, cur - 1)
-            right = min(last - 1, cur + 1)
-            if left > 2:
-                items.append("…")
-            items.extend(range(left, right + 1))
-            if right < last - 1:
-                items.append("…")
-            items.append(last)
-            out = []
-            for x in items:
-                if not out or out[-1] != x:
-                    out.append(x)
-            return out
+        with nav[0]:
+            if st.button("◀", key="stat_nav_left", use_container_width=True, disabled=(cur_page <= 1)):
+                _goto_page(cur_page - 1)
 
-        # ✅ 한 줄: [◀] [페이지] [/전체페이지] [▶] | [저장/초기화/삭제]
-        row = st.columns([4, 3], gap="small")
+        with nav[1]:
+            page_val = st.number_input(
+                "",
+                min_value=1,
+                max_value=total_pages,
+                value=cur_page,
+                step=1,
+                key="stat_page_num",
+                label_visibility="collapsed",
+            )
+            if int(page_val) != int(cur_page):
+                _goto_page(int(page_val))
 
-        with row[0]:
-            nav = st.columns([1, 1, 1, 1], gap="small")
+        with nav[2]:
+            st.markdown(
+                f"<div style='text-align:center; font-weight:700; padding-top:6px;'>/ 전체페이지 {total_pages}</div>",
+                unsafe_allow_html=True,
+            )
 
-            with nav[0]:
-                if st.button("◀", key="stat_nav_left", use_container_width=True, disabled=(cur_page <= 1)):
-                    _goto_page(cur_page - 1)
+        with nav[3]:
+            if st.button("▶", key="stat_nav_right", use_container_width=True, disabled=(cur_page >= total_pages)):
+                _goto_page(cur_page + 1)
+
+    with row[1]:
+        bsave, breset, bdel = st.columns([1, 1, 1], gap="small")
+        with bsave:
+            save_clicked = st.button("✅ 저장", use_container_width=True, key="stat_table_save")
+        with breset:
+            reset_clicked = st.button("🧹 초기화", use_container_width=True, key="stat_table_reset")
+        with bdel:
+            del_clicked = st.button("🗑️ 삭제", use_container_width=True, key="stat_table_del")
+
+    if stat_cols_res.get("has_more"):
+        if st.button(f"⏬ 이전 제출물 {STAT_PAGE_COLS}개 더 불러오기", key="stat_load_more", use_container_width=True):
+            st.session_state["stat_cols_loaded"] = int(st.session_state["stat_cols_loaded"]) + STAT_PAGE_COLS
+            st.session_state["stat_keep_edits"] = True
+            rerun_fragment()
+
+    # (PATCH) 초기화(전체 내역 삭제) 확인 플래그
+    if reset_clicked:
+        st.session_state["stat_reset_confirm"] = True
+
+    if not sub_rows_all:
+        st.info("제출물 내역이 없습니다. 위에서 ‘제출물 내역 추가’를 먼저 해주세요.")
+    else:
+        # ✅ page_idx(0=최신 페이지) 기준 슬라이스
+        page_idx = int(st.session_state.get("stat_page_idx", 0) or 0)
+        start = page_idx * VISIBLE_COLS
+        end = start + VISIBLE_COLS
+        sub_rows = sub_rows_all[start:end]
+
+        # 로드 시그니처: (제출물 목록 + 학생 목록) 바뀔 때만 로컬 편집 초기화
+        sig = "||".join(
+            [
+                ",".join([str(s.get("submission_id")) for s in sub_rows_all]),
+                ",".join([str(s.get("student_id")) for s in stu_rows]),
+            ]
+        )
 
-            with nav[1]:
-                page_val = st.number_input(
-                    "",
-                    min_value=1,
-                    max_value=total_pages,
-                    value=cur_page,
-                    step=1,
-                    key="stat_page_num",
-                    label_visibility="collapsed",
-                )
-                if int(page_val) != int(cur_page):
-                    _goto_page(int(page_val))
+        if st.session_state.get("stat_loaded_sig", "") != sig:
+            st.session_state["stat_loaded_sig"] = sig
+            # 더 불러오기로 열만 늘어난 경우: 이미 편집 중인 칸은 유지
+            prev_edit = st.session_state.get("stat_edit", {}) if st.session_state.pop("stat_keep_edits", False) else {}
+            st.session_state["stat_edit"] = {}
 
-            with nav[2]:
-                st.markdown(
-                    f"<div style='text-align:center; font-weight:700; padding-top:6px;'>/ 전체페이지 {total_pages}</div>",
-                    unsafe_allow_html=True,
-                )
+            # (PATCH) 표 구성이 바뀌면 셀 위젯 key 버전을 올려서 라디오 상태 꼬임 방지
+            st.session_state["stat_cell_ver"] = int(st.session_state.get("stat_cell_ver", 0) or 0) + 1
 
-            with nav[3]:
-                if st.button("▶", key="stat_nav_right", use_container_width=True, disabled=(cur_page >= total_pages)):
-                    _goto_page(cur_page + 1)
-
-        with row[1]:
-            bsave, breset, bdel = st.columns([1, 1, 1], gap="small")
-            with bsave:
-                save_clicked = st.button("✅ 저장", use_container_width=True, key="stat_table_save")
-            with breset:
-                reset_clicked = st.button("🧹 초기화", use_container_width=True, key="stat_table_reset")
-            with bdel:
-                del_clicked = st.button("🗑️ 삭제", use_container_width=True, key="stat_table_del")
-
-        # (PATCH) 초기화(전체 내역 삭제) 확인 플래그
-        if reset_clicked:
-            st.session_state["stat_reset_confirm"] = True
-
-        if not sub_rows_all:
-            st.info("제출물 내역이 없습니다. 위에서 ‘제출물 내역 추가’를 먼저 해주세요.")
-        else:
-            # ✅ page_idx(0=최신 페이지) 기준 슬라이스
-            page_idx = int(st.session_state.get("stat_page_idx", 0) or 0)
-            start = page_idx * VISIBLE_COLS
-            end = start + VISIBLE_COLS
-            sub_rows = sub_rows_all[start:end]
+            # 제출물별 기본 상태맵(학생 전원 X) + 기존 DB값 반영
+            for subx in sub_rows_all:
+                sid = str(subx.get("submission_id"))
+                cur_map = dict(subx.get("statuses", {}) or {})
 
-            # 로드 시그니처: (제출물 목록 + 학생 목록) 바뀔 때만 로컬 편집 초기화
-            sig = "||".join(
-                [
-                    ",".join([str(s.get("submission_id")) for s in sub_rows_all]),
-                    ",".join([str(s.get("student_id")) for s in stu_rows]),
-                ]
-            )
+                st.session_state["stat_edit"][sid] = {}
+                for stx in stu_rows:
+                    stid = str(stx.get("student_id"))
+                    v = str(cur_map.get(stid, "X") or "X")
+                    st.session_state["stat_edit"][sid][stid] = v if v in ("X", "O", "△") else "X"
+                st.session_state["stat_edit"][sid].update(prev_edit.get(sid, {}))
 
-            if st.session_state.get("stat_loaded_sig", "") != sig:
-                st.session_state["stat_loaded_sig"] = sig
-                st.session_state["stat_edit"] = {}
+        # -------------------------
+        # (PATCH) 초기화: 전체 제출물 내역 삭제(삭제 전 확인)
+        # -------------------------
+        if st.session_state.get("stat_reset_confirm", False):
+            st.error("⚠️ 초기화하면 모든 제출물 내역(열)이 전부 삭제됩니다. 진행할까요?")
+
+            if st.session_state.pop("stat_reset_clear_pin", False):
+                st.session_state.pop("stat_reset_admin_pin", None)                
+
+            admin_pin_for_reset = st.text_input(
+                "관리자 비밀번호 입력",
+                type="password",
+                key="stat_reset_admin_pin",
+                help="관리자 비밀번호를 정확히 입력해야 초기화가 실행됩니다.",
+            )                
+
+            yy2, nn2 = st.columns(2)
+            with yy2:
+                if st.button("예(전체 삭제)", use_container_width=True, key="stat_reset_yes"):
+                    if str(admin_pin_for_reset or "").strip() != str(ADMIN_PIN):
+                        st.error("관리자 비밀번호가 올바르지 않습니다.")
+                        st.stop()
+                    # 현재 존재하는 모든 제출물 삭제(불러오지 않은 이전 페이지 포함, bulk 1회)
+                    resd = api_admin_delete_stat_submissions(ADMIN_PIN, None)
+                    ok_cnt = int(resd.get("count", 0) or 0)
 
-                # (PATCH) 표 구성이 바뀌면 셀 위젯 key 버전을 올려서 라디오 상태 꼬임 방지
-                st.session_state["stat_cell_ver"] = int(st.session_state.get("stat_cell_ver", 0) or 0) + 1
+                    if ok_cnt > 0:
+                        toast(f"초기화 완료! ({ok_cnt}개 삭제)", icon="🧹")
 
-                # 제출물별 기본 상태맵(학생 전원 X) + 기존 DB값 반영
-                for subx in sub_rows_all:
-                    sid = str(subx.get("submission_id"))
-                    cur_map = dict(subx.get("statuses", {}) or {})
+                    if not resd.get("ok"):
+                        st.error(resd.get("error", "삭제 실패"))
 
-                    st.session_state["stat_edit"][sid] = {}
-                    for stx in stu_rows:
-                        stid = str(stx.get("student_id"))
-                        v = str(cur_map.get(stid, "X") or "X")
-                        st.session_state["stat_edit"][sid][stid] = v if v in ("X", "O", "△") else "X"
+                    # 로컬 상태 초기화
+                    st.session_state["stat_reset_confirm"] = False
+                    st.session_state["stat_delete_confirm"] = False
+                    st.session_state["stat_loaded_sig"] = ""
+                    st.session_state["stat_edit"] = {}
+                    st.session_state["stat_reset_clear_pin"] = True
+                    rerun_fragment()
 
-            # -------------------------
-            # (PATCH) 초기화: 전체 제출물 내역 삭제(삭제 전 확인)
-            # -------------------------
-            if st.session_state.get("stat_reset_confirm", False):
-                st.error("⚠️ 초기화하면 모든 제출물 내역(열)이 전부 삭제됩니다. 진행할까요?")
+            with nn2:
+                if st.button("아니오", use_container_width=True, key="stat_reset_no"):
+                    st.session_state["stat_reset_confirm"] = False
+                    st.session_state["stat_reset_clear_pin"] = True
+                    rerun_fragment()
 
-                if st.session_state.pop("stat_reset_clear_pin", False):
-                    st.session_state.pop("stat_reset_admin_pin", None)                
 
-                admin_pin_for_reset = st.text_input(
-                    "관리자 비밀번호 입력",
-                    type="password",
-                    key="stat_reset_admin_pin",
-                    help="관리자 비밀번호를 정확히 입력해야 초기화가 실행됩니다.",
-                )                
-                
-                yy2, nn2 = st.columns(2)
-                with yy2:
-                    if st.button("예(전체 삭제)", use_container_width=True, key="stat_reset_yes"):
-                        if str(admin_pin_for_reset or "").strip() != str(ADMIN_PIN):
-                            st.error("관리자 비밀번호가 올바르지 않습니다.")
-                            st.stop()
-                        ok_cnt = 0
-                        fail_msgs = []
 
-                        # 현재 존재하는 모든 제출물(sub_rows_all) 삭제
-                        for s in sub_rows_all:
-                            sid = str(s.get("submission_id") or "")
-                            if not sid:
-                                continue
-                            resd = api_admin_delete_stat_submission(ADMIN_PIN, sid)
-                            if resd.get("ok"):
-                                ok_cnt += 1
-                            else:
-                                fail_msgs.append(resd.get("error", "삭제 실패"))
+        # -------------------------
+        # (PATCH) 삭제: 체크박스로 여러 개 선택해서 삭제
+        # -------------------------
+        if del_clicked:
+            st.session_state["stat_delete_confirm"] = True
+
+        if st.session_state.get("stat_delete_confirm", False):
+            st.warning("삭제할 제출물을 체크하세요. (여러 개 선택 가능)")
+
+            del_targets = []
+            for s in sub_rows_all:
+                sid = str(s.get("submission_id"))
+                label = f"{s.get('date_display','')} | {s.get('label','')}"
+                ck = st.checkbox(label, key=f"stat_del_ck_{sid}")
+                if ck:
+                    del_targets.append(sid)
+
+            yy, nn = st.columns(2)
+            with yy:
+                if st.button("예", use_container_width=True, key="stat_del_yes"):
+                    if not del_targets:
+                        st.error("삭제할 항목을 하나 이상 체크해 주세요.")
+                    else:
+                        resd = api_admin_delete_stat_submissions(ADMIN_PIN, del_targets)
+                        ok_cnt = int(resd.get("count", 0) or 0)
 
                         if ok_cnt > 0:
-                            toast(f"초기화 완료! ({ok_cnt}개 삭제)", icon="🧹")
+                            toast(f"삭제 완료! ({ok_cnt}개)", icon="🗑️")
 
-                        if fail_msgs:
-                            st.error("일부 삭제 실패: " + " / ".join(fail_msgs[:3]))
+                        if not resd.get("ok"):
+                            st.error(resd.get("error", "삭제 실패"))
 
-                        # 로컬 상태 초기화
-                        st.session_state["stat_reset_confirm"] = False
+                        # 체크박스 상태/로컬 상태 초기화
                         st.session_state["stat_delete_confirm"] = False
                         st.session_state["stat_loaded_sig"] = ""
                         st.session_state["stat_edit"] = {}
-                        st.session_state["stat_reset_clear_pin"] = True
-                        st.rerun()
-
-                with nn2:
-                    if st.button("아니오", use_container_width=True, key="stat_reset_no"):
-                        st.session_state["stat_reset_confirm"] = False
-                        st.session_state["stat_reset_clear_pin"] = True
-                        st.rerun()
-
-
-            
-            # -------------------------
-            # (PATCH) 삭제: 체크박스로 여러 개 선택해서 삭제
-            # -------------------------
-            if del_clicked:
-                st.session_state["stat_delete_confirm"] = True
-
-            if st.session_state.get("stat_delete_confirm", False):
-                st.warning("삭제할 제출물을 체크하세요. (여러 개 선택 가능)")
-
-                del_targets = []
-                for s in sub_rows_all:
-                    sid = str(s.get("submission_id"))
-                    label = f"{s.get('date_display','')} | {s.get('label','')}"
-                    ck = st.checkbox(label, key=f"stat_del_ck_{sid}")
-                    if ck:
-                        del_targets.append(sid)
-
-                yy, nn = st.columns(2)
-                with yy:
-                    if st.button("예", use_container_width=True, key="stat_del_yes"):
-                        if not del_targets:
-                            st.error("삭제할 항목을 하나 이상 체크해 주세요.")
-                        else:
-                            ok_cnt = 0
-                            fail_msgs = []
-                            for tid in del_targets:
-                                resd = api_admin_delete_stat_submission(ADMIN_PIN, tid)
-                                if resd.get("ok"):
-                                    ok_cnt += 1
-                                else:
-                                    fail_msgs.append(resd.get("error", "삭제 실패"))
-
-                            if ok_cnt > 0:
-                                toast(f"삭제 완료! ({ok_cnt}개)", icon="🗑️")
-
-                            if fail_msgs:
-                                st.error("일부 삭제 실패: " + " / ".join(fail_msgs[:3]))
-
-                            # 체크박스 상태/로컬 상태 초기화
-                            st.session_state["stat_delete_confirm"] = False
-                            st.session_state["stat_loaded_sig"] = ""
-                            st.session_state["stat_edit"] = {}
-                            st.rerun()
-                with nn:
-                    if st.button("아니오", use_container_width=True, key="stat_del_no"):
-                        st.session_state["stat_delete_confirm"] = False
-                        st.rerun()
-
-            # ---- 표 헤더(현재 화면에 보일 제출물만) ----
-            col_titles = []
-            for s in sub_rows:
-                date_disp = str(s.get("date_display", "") or "")
-                label = str(s.get("label", "") or "")
-                col_titles.append(f"{date_disp}\n{label}")
-
-            # (PATCH) 통계표 전용: 한 칸에 O/X/△ 3개 원형 선택 UI (즉시 표시)
-            # - div 래퍼 방식은 Streamlit 위젯을 실제로 감싸지 못해서 적용이 불안정함
-            # - 대신 input id에 'stat_cellpick_' 들어간 라디오만 CSS 적용
-            st.markdown(
-                """
+                        rerun_fragment()
+            with nn:
+                if st.button("아니오", use_container_width=True, key="stat_del_no"):
+                    st.session_state["stat_delete_confirm"] = False
+                    rerun_fragment()
+
+        # ---- 표 헤더(현재 화면에 보일 제출물만) ----
+        col_titles = []
+        for s in sub_rows:
+            date_disp = str(s.get("date_display", "") or "")
+            label = str(s.get("label", "") or "")
+            col_titles.append(f"{date_disp}\n{label}")
+
+        # (PATCH) 통계표 전용: 한 칸에 O/X/△ 3개 원형 선택 UI (즉시 표시)
+        # - div 래퍼 방식은 Streamlit 위젯을 실제로 감싸지 못해서 적용이 불안정함
+        # - 대신 input id에 'stat_cellpick_' 들어간 라디오만 CSS 적용
+        st.markdown(
+            """
 <style>
 /* ===== 통계표 셀 라디오( id에 stat_cellpick_ 포함 )만 원형 버튼처럼 + 높이/여백 압축 ===== */
 
@@ -14082,201 +14708,207 @@ div[data-testid="stElementContainer"]:has(.stat_bulk_text){
 
 </style>
 """,
-                unsafe_allow_html=True,
-            )
+            unsafe_allow_html=True,
+        )
 
-            hdr_cols = st.columns([0.37, 0.7] + [1.2] * len(col_titles))
-            with hdr_cols[0]:
-                st.markdown("**번호**")
-            with hdr_cols[1]:
-                st.markdown("**이름**")
-            for j, s in enumerate(sub_rows):
-                with hdr_cols[j + 2]:
-                    date_disp = str(s.get("date_display", "") or "")
-                    label = str(s.get("label", "") or "")
-                    st.markdown(
-                        f"<div class='stat_hdr_cell'><div class='stat_hdr_inner'>{date_disp}<br>{label}</div></div>",
-                        unsafe_allow_html=True,
-                    )
+        hdr_cols = st.columns([0.37, 0.7] + [1.2] * len(col_titles))
+        with hdr_cols[0]:
+            st.markdown("**번호**")
+        with hdr_cols[1]:
+            st.markdown("**이름**")
+        for j, s in enumerate(sub_rows):
+            with hdr_cols[j + 2]:
+                date_disp = str(s.get("date_display", "") or "")
+                label = str(s.get("label", "") or "")
+                st.markdown(
+                    f"<div class='stat_hdr_cell'><div class='stat_hdr_inner'>{date_disp}<br>{label}</div></div>",
+                    unsafe_allow_html=True,
+                )
+
+        # 열별 일괄 적용(O/X/△): 각 제출물(열)의 모든 학생 상태를 동일 값으로 변경
+        def _apply_all_for_submission(submission_id: str, value: str):
+            submission_id = str(submission_id)
+            if value not in ("O", "X", "△"):
+                return
+            st.session_state["stat_edit"].setdefault(submission_id, {})
+            ver_local = int(st.session_state.get("stat_cell_ver", 0) or 0)
+            for stx in (stu_rows or []):
+                stid_local = str(stx.get("student_id", "") or "")
+                if not stid_local:
+                    continue
+                st.session_state["stat_edit"][submission_id][stid_local] = value
+                st.session_state[f"stat_cellpick_{ver_local}_{submission_id}_{stid_local}"] = value
+
+        bulk_cols = st.columns([0.37, 0.7] + [1.2] * len(col_titles))
+        with bulk_cols[0]:
+            st.markdown("<div class='stat_bulk_text'><b>일괄</b></div>", unsafe_allow_html=True)
+        with bulk_cols[1]:
+            st.markdown("<div class='stat_bulk_text'>&nbsp;</div>", unsafe_allow_html=True)
+            st.markdown("<div class='stat_bulk_text'><b>버튼⚡</b></div>", unsafe_allow_html=True)
+        for j, sub in enumerate(sub_rows):
+            with bulk_cols[j + 2]:
+                sub_id = str(sub.get("submission_id", "") or "")
+                if not sub_id:
+                    continue
+                st.markdown(f"<div class='stat_bulk_marker' data-column='{sub_id}'></div>", unsafe_allow_html=True)
+                bulk_key = f"stat_colpick_{sub_id}"
+                prev_key = f"stat_colpick_prev_{sub_id}"
+                if bulk_key not in st.session_state:
+                    st.session_state[bulk_key] = "X"
+                if prev_key not in st.session_state:
+                    st.session_state[prev_key] = st.session_state[bulk_key]
+
+                picked_bulk = st.radio(
+                    label="",
+                    options=("O", "X", "△"),
+                    horizontal=True,
+                    key=bulk_key,
+                    label_visibility="collapsed",
+                )
+                if st.session_state.get(prev_key) != picked_bulk:
+                    _apply_all_for_submission(sub_id, picked_bulk)
+                    st.session_state[prev_key] = picked_bulk
+                    rerun_fragment()
+
+        st.markdown("<div class='stat_top_sep'></div>", unsafe_allow_html=True)
+
+        for i, stx in enumerate(stu_rows):
+            stid = str(stx.get("student_id"))
+            no = stx.get("no", 999999)
+            nm = stx.get("name", "")
+
+            row_cols = st.columns([0.37, 0.7] + [1.2] * len(col_titles))
+            with row_cols[0]:
+                st.markdown(f"<div class='stat_row_text'>{int(no)}</div>", unsafe_allow_html=True)
+            with row_cols[1]:
+                st.markdown(f"<div class='stat_row_text'>{nm}</div>", unsafe_allow_html=True)
 
-            # 열별 일괄 적용(O/X/△): 각 제출물(열)의 모든 학생 상태를 동일 값으로 변경
-            def _apply_all_for_submission(submission_id: str, value: str):
-                submission_id = str(submission_id)
-                if value not in ("O", "X", "△"):
-                    return
-                st.session_state["stat_edit"].setdefault(submission_id, {})
-                ver_local = int(st.session_state.get("stat_cell_ver", 0) or 0)
-                for stx in (stu_rows or []):
-                    stid_local = str(stx.get("student_id", "") or "")
-                    if not stid_local:
-                        continue
-                    st.session_state["stat_edit"][submission_id][stid_local] = value
-                    st.session_state[f"stat_cellpick_{ver_local}_{submission_id}_{stid_local}"] = value
-
-            bulk_cols = st.columns([0.37, 0.7] + [1.2] * len(col_titles))
-            with bulk_cols[0]:
-                st.markdown("<div class='stat_bulk_text'><b>일괄</b></div>", unsafe_allow_html=True)
-            with bulk_cols[1]:
-                st.markdown("<div class='stat_bulk_text'>&nbsp;</div>", unsafe_allow_html=True)
-                st.markdown("<div class='stat_bulk_text'><b>버튼⚡</b></div>", unsafe_allow_html=True)
             for j, sub in enumerate(sub_rows):
-                with bulk_cols[j + 2]:
-                    sub_id = str(sub.get("submission_id", "") or "")
-                    if not sub_id:
-                        continue
-                    st.markdown(f"<div class='stat_bulk_marker' data-column='{sub_id}'></div>", unsafe_allow_html=True)
-                    bulk_key = f"stat_colpick_{sub_id}"
-                    prev_key = f"stat_colpick_prev_{sub_id}"
-                    if bulk_key not in st.session_state:
-                        st.session_state[bulk_key] = "X"
-                    if prev_key not in st.session_state:
-                        st.session_state[prev_key] = st.session_state[bulk_key]
-
-                    picked_bulk = st.radio(
+                sub_id = str(sub.get("submission_id"))
+                cur_v = str(st.session_state["stat_edit"].get(sub_id, {}).get(stid, "X") or "X")
+
+                with row_cols[j + 2]:
+                    ver = int(st.session_state.get("stat_cell_ver", 0) or 0)
+                    cell_key = f"stat_cellpick_{ver}_{sub_id}_{stid}"
+
+                    # 처음 생성 때만 기본값 세팅(사용자 클릭값은 덮어쓰지 않음)
+                    if cell_key not in st.session_state:
+                        st.session_state[cell_key] = cur_v if cur_v in ("O", "X", "△") else "X"
+
+                    picked = st.radio(
                         label="",
                         options=("O", "X", "△"),
                         horizontal=True,
-                        key=bulk_key,
+                        key=cell_key,
                         label_visibility="collapsed",
                     )
-                    if st.session_state.get(prev_key) != picked_bulk:
-                        _apply_all_for_submission(sub_id, picked_bulk)
-                        st.session_state[prev_key] = picked_bulk
-                        st.rerun()
 
-            st.markdown("<div class='stat_top_sep'></div>", unsafe_allow_html=True)
-            
-            for i, stx in enumerate(stu_rows):
-                stid = str(stx.get("student_id"))
-                no = stx.get("no", 999999)
-                nm = stx.get("name", "")
+                    # 선택은 즉시 로컬에 반영(저장은 상단 '✅ 저장'에서만 DB 반영)
+                    st.session_state["stat_edit"].setdefault(sub_id, {})
+                    st.session_state["stat_edit"][sub_id][stid] = picked
 
-                row_cols = st.columns([0.37, 0.7] + [1.2] * len(col_titles))
-                with row_cols[0]:
-                    st.markdown(f"<div class='stat_row_text'>{int(no)}</div>", unsafe_allow_html=True)
-                with row_cols[1]:
-                    st.markdown(f"<div class='stat_row_text'>{nm}</div>", unsafe_allow_html=True)
-                    
-                for j, sub in enumerate(sub_rows):
-                    sub_id = str(sub.get("submission_id"))
-                    cur_v = str(st.session_state["stat_edit"].get(sub_id, {}).get(stid, "X") or "X")
+            if i < len(stu_rows) - 1:
+                st.markdown("<div class='stat_row_sep'></div>", unsafe_allow_html=True)
 
-                    with row_cols[j + 2]:
-                        ver = int(st.session_state.get("stat_cell_ver", 0) or 0)
-                        cell_key = f"stat_cellpick_{ver}_{sub_id}_{stid}"
-
-                        # 처음 생성 때만 기본값 세팅(사용자 클릭값은 덮어쓰지 않음)
-                        if cell_key not in st.session_state:
-                            st.session_state[cell_key] = cur_v if cur_v in ("O", "X", "△") else "X"
-
-                        picked = st.radio(
-                            label="",
-                            options=("O", "X", "△"),
-                            horizontal=True,
-                            key=cell_key,
-                            label_visibility="collapsed",
-                        )
+        st.markdown("</div>", unsafe_allow_html=True)
 
-                        # 선택은 즉시 로컬에 반영(저장은 상단 '✅ 저장'에서만 DB 반영)
-                        st.session_state["stat_edit"].setdefault(sub_id, {})
-                        st.session_state["stat_edit"][sub_id][stid] = picked
 
-                if i < len(stu_rows) - 1:
-                    st.markdown("<div class='stat_row_sep'></div>", unsafe_allow_html=True)
+        # ---- 저장 버튼 처리(표 오른쪽 상단) ----
+        if save_clicked:
+            res_sv = api_admin_save_stat_table(
+                admin_pin=ADMIN_PIN,
+                submission_ids=submission_ids,
+                edited=st.session_state.get("stat_edit", {}) or {},
+                accounts=stu_rows,
+                loaded_rows=sub_rows_all,
+            )
+            if res_sv.get("ok"):
+                toast(f"저장 완료! ({res_sv.get('count', 0)}개 제출물 반영)", icon="✅")
+                st.session_state["stat_loaded_sig"] = ""
+                rerun_fragment()
+            else:
+                st.error(res_sv.get("error", "저장 실패"))
 
-            st.markdown("</div>", unsafe_allow_html=True)
 
-            
-            # ---- 저장 버튼 처리(표 오른쪽 상단) ----
-            if save_clicked:
-                res_sv = api_admin_save_stat_table(
-                    admin_pin=ADMIN_PIN,
-                    submission_ids=submission_ids,
-                    edited=st.session_state.get("stat_edit", {}) or {},
-                    accounts=stu_rows,
-                )
-                if res_sv.get("ok"):
-                    toast(f"저장 완료! ({res_sv.get('count', 0)}개 제출물 반영)", icon="✅")
-                    st.session_state["stat_loaded_sig"] = ""
-                    st.rerun()
-                else:
-                    st.error(res_sv.get("error", "저장 실패"))
+    # -------------------------
+    # (하단) 통계표 템플릿 추가/수정/삭제
+    # -------------------------
+    render_template_section_divider()
+    st.markdown("### 🧩 통계표 템플릿 추가/수정/삭제")
 
+    tpl_items = api_list_stat_templates_cached().get("templates", [])
+    tpl_pick_labels = ["(새로 추가)"] + [f"{t.get('order', 999999)} | {t.get('label','')}" for t in tpl_items]
+    tpl_by_pick = {f"{t.get('order', 999999)} | {t.get('label','')}": t for t in tpl_items}
 
-        # -------------------------
-        # (하단) 통계표 템플릿 추가/수정/삭제
-        # -------------------------
-        render_template_section_divider()
-        st.markdown("### 🧩 통계표 템플릿 추가/수정/삭제")
+    if st.session_state.get("stat_tpl_reset_req", False):
+        st.session_state["stat_tpl_pick"] = "(새로 추가)"
+        st.session_state["stat_tpl_pick_prev"] = "(새로 추가)"
+        st.session_state["stat_tpl_label"] = ""
+        st.session_state["stat_tpl_order"] = 1
+        st.session_state["stat_tpl_reset_req"] = False
 
-        tpl_items = api_list_stat_templates_cached().get("templates", [])
-        tpl_pick_labels = ["(새로 추가)"] + [f"{t.get('order', 999999)} | {t.get('label','')}" for t in tpl_items]
-        tpl_by_pick = {f"{t.get('order', 999999)} | {t.get('label','')}": t for t in tpl_items}
+    tpl_picked = st.selectbox("편집 대상", tpl_pick_labels, key="stat_tpl_pick")
 
-        if st.session_state.get("stat_tpl_reset_req", False):
-            st.session_state["stat_tpl_pick"] = "(새로 추가)"
-            st.session_state["stat_tpl_pick_prev"] = "(새로 추가)"
+    edit_tpl = tpl_by_pick.get(tpl_picked) if tpl_picked != "(새로 추가)" else None
+
+    prev_pick_key = "stat_tpl_pick_prev"
+    if st.session_state.get(prev_pick_key) != tpl_picked:
+        if edit_tpl:
+            st.session_state["stat_tpl_label"] = str(edit_tpl.get("label", ""))
+            st.session_state["stat_tpl_order"] = int(edit_tpl.get("order", 1) or 1)
+        else:
             st.session_state["stat_tpl_label"] = ""
             st.session_state["stat_tpl_order"] = 1
-            st.session_state["stat_tpl_reset_req"] = False
-            
-        tpl_picked = st.selectbox("편집 대상", tpl_pick_labels, key="stat_tpl_pick")
+        st.session_state[prev_pick_key] = tpl_picked
 
-        edit_tpl = tpl_by_pick.get(tpl_picked) if tpl_picked != "(새로 추가)" else None
+    t1, t2 = st.columns([3.0, 1.0])
+    with t1:
+        tpl_label_in = st.text_input("템플릿 내역", key="stat_tpl_label").strip()
+    with t2:
+        tpl_order_in = st.number_input("순서", min_value=1, step=1, key="stat_tpl_order")
 
-        prev_pick_key = "stat_tpl_pick_prev"
-        if st.session_state.get(prev_pick_key) != tpl_picked:
-            if edit_tpl:
-                st.session_state["stat_tpl_label"] = str(edit_tpl.get("label", ""))
-                st.session_state["stat_tpl_order"] = int(edit_tpl.get("order", 1) or 1)
+    bb1, bb2, bb3 = st.columns(3)
+    with bb1:
+        if st.button("✅ 저장", use_container_width=True, key="stat_tpl_save_btn"):
+            resu = api_admin_upsert_stat_template(
+                admin_pin=ADMIN_PIN,
+                template_id=(edit_tpl.get("template_id") if edit_tpl else ""),
+                label=tpl_label_in,
+                order=int(tpl_order_in),
+            )
+            if resu.get("ok"):
+                toast("템플릿 저장 완료!", icon="✅")
+                st.session_state["stat_loaded_sig"] = ""
+                st.session_state["stat_tpl_reset_req"] = True
+                rerun_fragment()
             else:
-                st.session_state["stat_tpl_label"] = ""
-                st.session_state["stat_tpl_order"] = 1
-            st.session_state[prev_pick_key] = tpl_picked
-
-        t1, t2 = st.columns([3.0, 1.0])
-        with t1:
-            tpl_label_in = st.text_input("템플릿 내역", key="stat_tpl_label").strip()
-        with t2:
-            tpl_order_in = st.number_input("순서", min_value=1, step=1, key="stat_tpl_order")
-
-        bb1, bb2, bb3 = st.columns(3)
-        with bb1:
-            if st.button("✅ 저장", use_container_width=True, key="stat_tpl_save_btn"):
-                resu = api_admin_upsert_stat_template(
-                    admin_pin=ADMIN_PIN,
-                    template_id=(edit_tpl.get("template_id") if edit_tpl else ""),
-                    label=tpl_label_in,
-                    order=int(tpl_order_in),
-                )
-                if resu.get("ok"):
-                    toast("템플릿 저장 완료!", icon="✅")
-                    st.session_state["stat_loaded_sig"] = ""
-                    st.session_state["stat_tpl_reset_req"] = True
-                    st.rerun()
-                else:
-                    st.error(resu.get("error", "저장 실패"))
-
-        with bb2:
-            if st.button("🧹 입력 초기화", use_container_width=True, key="stat_tpl_clear_btn"):
-                st.session_state.pop("stat_tpl_label", None)
-                st.session_state.pop("stat_tpl_order", None)
-                st.session_state.pop("stat_tpl_pick_prev", None)
-                st.session_state["stat_tpl_pick"] = "(새로 추가)"
-                st.rerun()
+                st.error(resu.get("error", "저장 실패"))
+
+    with bb2:
+        if st.button("🧹 입력 초기화", use_container_width=True, key="stat_tpl_clear_btn"):
+            st.session_state.pop("stat_tpl_label", None)
+            st.session_state.pop("stat_tpl_order", None)
+            st.session_state.pop("stat_tpl_pick_prev", None)
+            st.session_state["stat_tpl_pick"] = "(새로 추가)"
+            rerun_fragment()
+
+    with bb3:
+        if st.button("🗑️ 삭제", use_container_width=True, key="stat_tpl_del_btn", disabled=(edit_tpl is None)):
+            if not edit_tpl:
+                st.stop()
+            resd2 = api_admin_delete_stat_template(ADMIN_PIN, str(edit_tpl.get("template_id")))
+            if resd2.get("ok"):
+                toast("템플릿 삭제 완료!", icon="🗑️")
+                st.session_state["stat_loaded_sig"] = ""
+                st.session_state["stat_tpl_reset_req"] = True
+                rerun_fragment()
+            else:
+                st.error(resd2.get("error", "삭제 실패"))
 
-        with bb3:
-            if st.button("🗑️ 삭제", use_container_width=True, key="stat_tpl_del_btn", disabled=(edit_tpl is None)):
-                if not edit_tpl:
-                    st.stop()
-                resd2 = api_admin_delete_stat_template(ADMIN_PIN, str(edit_tpl.get("template_id")))
-                if resd2.get("ok"):
-                    toast("템플릿 삭제 완료!", icon="🗑️")
-                    st.session_state["stat_loaded_sig"] = ""
-                    st.session_state["stat_tpl_reset_req"] = True
-                    st.rerun()
-                else:
-                    st.error(resd2.get("error", "삭제 실패"))
+
+if "📊 통계청" in tabs:
+    with tab_map["📊 통계청"]:
+        _render_stat_office_tab()
 
 # =========================
 # 💳 신용등급 탭
@@ -14312,19 +14944,6 @@ if "💳 신용등급" in tabs:
         # -------------------------
         # 2) 점수 계산 설정(기본값)
         # -------------------------
-        def _get_credit_cfg():
-            ref = db.collection("config").document("credit_scoring")
-            snap = ref.get()
-            if not snap.exists:
-                return {"base": 50, "o": 1, "x": -3, "tri": 0}
-            d = snap.to_dict() or {}
-            return {
-                "base": int(d.get("base", 50) if d.get("base", None) is not None else 50),
-                "o": int(d.get("o", 1) if d.get("o", None) is not None else 1),
-                "x": int(d.get("x", -3) if d.get("x", None) is not None else -3),
-                "tri": int(d.get("tri", 0) if d.get("tri", None) is not None else 0),
-            }
-
         def _save_credit_cfg(cfg: dict):
             db.collection("config").document("credit_scoring").set(
                 {
@@ -14401,26 +15020,9 @@ if "💳 신용등급" in tabs:
             sub_rows_asc  = list(reversed(sub_rows_desc)) # ✅ 누적 계산은 과거→최신
     
             base = int(credit_cfg.get("base", 50) if credit_cfg.get("base", None) is not None else 50)
-            o_pt = int(credit_cfg.get("o", 1) if credit_cfg.get("o", None) is not None else 1)
-            x_pt = int(credit_cfg.get("x", -3) if credit_cfg.get("x", None) is not None else -3)
-            tri_pt = int(credit_cfg.get("tri", 0) if credit_cfg.get("tri", None) is not None else 0)
-    
-            def _norm_status(v) -> str:
-                """상태값을 무조건 'O' / 'X' / '△' 중 하나로 강제"""
-                v = str(v or "").strip().upper()
-                if v in ("O", "○"):
-                    return "O"
-                if v in ("△", "▲", "Δ"):
-                    return "△"
-                return "X"
     
             def _delta(v) -> int:
-                v = _norm_status(v)
-                if v == "O":
-                    return o_pt
-                if v == "△":
-                    return tri_pt
-                return x_pt
+                return _credit_status_delta(v, credit_cfg)
     
             # 학생별 누적 점수 스냅샷: scores_by_sub[sub_id][student_id] = score_after
             scores_by_sub = {}  # submission_id -> {student_id: score}
@@ -14447,10 +15049,8 @@ if "💳 신용등급" in tabs:
     
                 scores_by_sub[sub_id] = snap_map
 
-            manual_delta_map = {}
-            for stx in stu_rows:
-                stid = str(stx["student_id"])
-                manual_delta_map[stid] = _sum_manual_credit_delta(stid)            
+            # 수동 조정 합계: aggregate 1회
+            manual_delta_map = _manual_credit_deltas([str(stx["student_id"]) for stx in stu_rows])
     
             # -------------------------
             # (PATCH) 가로 페이징 (통계청과 동일 로직)
@@ -14695,39 +15295,6 @@ if "💳 신용등급" in tabs:
                 unsafe_allow_html=True,
             )
     
-            def _score_to_grade(score: int) -> int:
-                s = int(score)
-                if s >= 90:
-                    return 1
-                if s >= 80:
-                    return 2
-                if s >= 70:
-                    return 3
-                if s >= 60:
-                    return 4
-                if s >= 50:
-                    return 5
-                if s >= 40:
-                    return 6
-                if s >= 30:
-                    return 7
-                if s >= 20:
-                    return 8
-                if s >= 10:
-                    return 9
-                return 10
-    
-            def _fmt_kor_date_short(iso_utc: str) -> str:
-                # "0월 0일(요일한글자)" 형태
-                try:
-                    # 예: 2026-02-07T00:00:00Z
-                    dt = datetime.fromisoformat(str(iso_utc).replace("Z", "+00:00")).astimezone(KST)
-                    wd = ["월", "화", "수", "목", "금", "토", "일"][dt.weekday()]
-                    return f"{dt.month}월 {dt.day}일({wd})"
-                except Exception:
-                    return ""
-                    
-
         # -------------------------
         # (관리자) 신용점수 수동 조정/조정 장부 - 탭 최하단 배치
         # -------------------------
@@ -14781,6 +15348,7 @@ if "💳 신용등급" in tabs:
                             "created_at": datetime.utcnow(),
                         }
                     )
+                    credit_engine_add_manual(stid, signed_delta)
                     db.collection("students").document(stid).set(
                         {
                             "credit_score": int(after_score),
@@ -14838,47 +15406,9 @@ if "🏦 은행(적금)" in tabs:
             except Exception:
                 return ""
 
-        def _parse_iso_to_dt(iso_utc: str):
-            try:
-                return datetime.fromisoformat(str(iso_utc).replace("Z", "+00:00"))
-            except Exception:
-                return None
-
-        def _dt_to_iso_z(dt: datetime) -> str:
-            try:
-                return dt.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
-            except Exception:
-                return ""
-
-        def _score_to_grade(score: int) -> int:
-            s = int(score)
-            if s >= 90:
-                return 1
-            if s >= 80:
-                return 2
-            if s >= 70:
-                return 3
-            if s >= 60:
-                return 4
-            if s >= 50:
-                return 5
-            if s >= 40:
-                return 6
-            if s >= 30:
-                return 7
-            if s >= 20:
-                return 8
-            if s >= 10:
-                return 9
-            return 10
-
-        def _norm_status(v) -> str:
-            v = str(v or "").strip().upper()
-            if v in ("O", "○"):
-                return "O"
-            if v in ("△", "▲", "Δ"):
-                return "△"
-            return "X"
+        def _parse_iso_to_dt(iso_utc):
+            # maturity_utc/start_utc: BSON date(정규화 후) 또는 ISO 문자열(레거시) 모두 처리
+            return _to_utc_datetime(iso_utc)
 
         # -------------------------------------------------
         # (1) 이자율 표(설정값 mongo에서 로드)
@@ -14960,57 +15490,8 @@ if "🏦 은행(적금)" in tabs:
                 return 0.0
 
         # -------------------------------------------------
-        # (2) 신용점수/등급(현재 시점) 계산 (학생 1명용)
-        #  - credit_scoring 설정 + 통계청 제출물(statuses) 누적
+        # (2) 신용점수/등급(현재 시점): 공용 신용 엔진(_calc_credit_score_for_student) 사용
         # -------------------------------------------------
-        def _get_credit_cfg():
-            ref = db.collection("config").document("credit_scoring")
-            snap = ref.get()
-            if not snap.exists:
-                return {"base": 50, "o": 1, "x": -3, "tri": 0}
-            d = snap.to_dict() or {}
-            return {
-                "base": int(d.get("base", 50) if d.get("base", None) is not None else 50),
-                "o": int(d.get("o", 1) if d.get("o", None) is not None else 1),
-                "x": int(d.get("x", -3) if d.get("x", None) is not None else -3),
-                "tri": int(d.get("tri", 0) if d.get("tri", None) is not None else 0),
-            }
-
-        def _calc_credit_score_for_student(student_id: str) -> tuple[int, int]:
-            cfg = _get_credit_cfg()
-            base = int(cfg.get("base", 50) if cfg.get("base", None) is not None else 50)
-            o_pt = int(cfg.get("o", 1) if cfg.get("o", None) is not None else 1)
-            x_pt = int(cfg.get("x", -3) if cfg.get("x", None) is not None else -3)
-            tri_pt = int(cfg.get("tri", 0) if cfg.get("tri", None) is not None else 0)
-
-            def _delta(v):
-                vv = _norm_status(v)
-                if vv == "O":
-                    return o_pt
-                if vv == "△":
-                    return tri_pt
-                return x_pt
-
-            sub_res = api_list_stat_submissions_cached(limit_cols=200)
-            sub_rows_all = sub_res.get("rows", []) if sub_res.get("ok") else []
-
-            # ✅ 오래된→최신 누적 (api_list_stat_submissions_cached는 최신→과거로 오므로 reversed)
-            sub_rows_all = list(sub_rows_all or [])
-
-            score = int(base)
-            sid = str(student_id)
-
-            for sub in reversed(sub_rows_all):
-                statuses = dict(sub.get("statuses", {}) or {})
-                v = statuses.get(sid, "X")
-                score = int(score + _delta(v))
-                if score > 100:
-                    score = 100
-                if score < 0:
-                    score = 0
-
-            grade = _score_to_grade(score)
-            return score, grade
 
         # -------------------------------------------------
         # (3) 적금 저장/조회/처리 (mongo: savings)
@@ -15033,7 +15514,12 @@ if "🏦 은행(적금)" in tabs:
             - 원금+이자를 학생 통장에 입금(+)
             """
             now = datetime.now(timezone.utc)
-            q = db.collection(SAV_COL).where(filter=build_filter("status", "==", "running")).stream()
+            q = (
+                db.collection(SAV_COL)
+                .where(filter=build_filter("status", "==", "running"))
+                .where(filter=build_filter("maturity_utc", "<=", now))
+                .stream()
+            )
 
             proc_cnt = 0
             for d in q:
@@ -15156,8 +15642,8 @@ if "🏦 은행(적금)" in tabs:
                 "principal": int(principal),
                 "interest": int(interest),
                 "maturity_amount": int(maturity_amt),
-                "start_utc": _dt_to_iso_z(now_utc),
-                "maturity_utc": _dt_to_iso_z(maturity_utc),
+                "start_utc": now_utc,
+                "maturity_utc": maturity_utc,
                 "status": "running",          # running / matured / canceled
                 "payout_amount": None,
                 "created_at": datetime.utcnow(),
@@ -15169,7 +15655,7 @@ if "🏦 은행(적금)" in tabs:
             q = db.collection(SAV_COL).order_by("start_utc", direction=mongo.Query.DESCENDING).limit(int(limit)).stream()
             rows = []
             for d in q:
-                x = d.to_dict() or {}
+                x = d.to_dict(copy=True) or {}
                 x["_id"] = d.id
                 rows.append(x)
             return rows
@@ -15372,7 +15858,7 @@ div[data-testid="stDataFrame"] * { font-size: 0.80rem !important; }
             if my_student_id:
                 q = db.collection(SAV_COL).where(filter=build_filter("student_id", "==", str(my_student_id))).stream()
                 for d in q:
-                    x = d.to_dict() or {}
+                    x = d.to_dict(copy=True) or {}
                     x["_id"] = d.id
                     my_rows.append(x)
 
@@ -15742,691 +16228,711 @@ if "admin::🛒마트" in tabs:
 # =========================
 # 🏷️ 경매 탭
 # =========================
-if "🏷️ 경매" in tabs:
-    with tab_map["🏷️ 경매"]:
+@fragment_if_available
+def _render_auction_tab():
+    """🏷️ 경매 탭 본문(프래그먼트: 개시/마감/입찰 처리 시 이 탭만 다시 실행)."""
 
-        open_res = api_get_open_auction_round()
-        open_round = (open_res.get("round", {}) or {}) if open_res.get("ok") else {}
+    open_res = api_get_open_auction_round()
+    open_round = (open_res.get("round", {}) or {}) if open_res.get("ok") else {}
+    _render_live_probe(
+        "auction",
+        (("auction_rounds", ""), ("auction_bids", str(open_round.get("round_id", "") or ""))),
+    )
 
-        if is_admin:
-            st.markdown("### 📢 경매 개시")
-            c1, c2 = st.columns(2)
-            with c1:
-                a_bid_name = st.text_input("입찰 내역", key="auc_admin_bid_name").strip()
-            with c2:
-                a_aff = st.text_input("소속", key="auc_admin_affiliation").strip()
+    if is_admin:
+        st.markdown("### 📢 경매 개시")
+        c1, c2 = st.columns(2)
+        with c1:
+            a_bid_name = st.text_input("입찰 내역", key="auc_admin_bid_name").strip()
+        with c2:
+            a_aff = st.text_input("소속", key="auc_admin_affiliation").strip()
 
-            btn_c1, btn_c2 = st.columns(2)
-            with btn_c1:
-                if st.button("개시", key="auc_admin_open_btn", use_container_width=True):
-                    res = api_open_auction(ADMIN_PIN, a_bid_name, a_aff)
-                    if res.get("ok"):
-                        toast_and_rerun(f"경매 {int(res.get('round_no', 0) or 0):02d}회 개시", icon="✅")
-                    else:
-                        st.error(res.get("error", "경매 개시 실패"))
+        btn_c1, btn_c2 = st.columns(2)
+        with btn_c1:
+            if st.button("개시", key="auc_admin_open_btn", use_container_width=True):
+                res = api_open_auction(ADMIN_PIN, a_bid_name, a_aff)
+                if res.get("ok"):
+                    toast_and_rerun(f"경매 {int(res.get('round_no', 0) or 0):02d}회 개시", icon="✅", scope="fragment")
+                else:
+                    st.error(res.get("error", "경매 개시 실패"))
 
-            with btn_c2:
-                if st.button("마감", key="auc_admin_close_btn", use_container_width=True):
-                    res = api_close_auction(ADMIN_PIN)
-                    if res.get("ok"):
-                        toast_and_rerun("경매 마감 완료", icon="✅")
-                    else:
-                        st.error(res.get("error", "경매 마감 실패"))
+        with btn_c2:
+            if st.button("마감", key="auc_admin_close_btn", use_container_width=True):
+                res = api_close_auction(ADMIN_PIN)
+                if res.get("ok"):
+                    toast_and_rerun("경매 마감 완료", icon="✅", scope="fragment")
+                else:
+                    st.error(res.get("error", "경매 마감 실패"))
 
-            if open_round:
-                st.success(
-                    f"진행 중: 입찰번호 {int(open_round.get('round_no', 0) or 0):02d} | "
-                    f"입찰이름 {str(open_round.get('bid_name', '') or '')} | "
-                    f"소속 {str(open_round.get('affiliation', '') or '')}"
-                )
-            else:
-                st.info("개시된 경매가 없습니다.")
+        if open_round:
+            st.success(
+                f"진행 중: 입찰번호 {int(open_round.get('round_no', 0) or 0):02d} | "
+                f"입찰이름 {str(open_round.get('bid_name', '') or '')} | "
+                f"소속 {str(open_round.get('affiliation', '') or '')}"
+            )
+        else:
+            st.info("개시된 경매가 없습니다.")
 
-            st.markdown("### 📊 경매 결과")
+        st.markdown("### 📊 경매 결과")
 
-            # ✅ 경매 결과는 '진행 중 경매가 없을 때(=마감 후)'에만 노출
-            if open_round:
-                st.info("경매 마감 버튼을 눌러야 경매 결과가 표시됩니다.")
+        # ✅ 경매 결과는 '진행 중 경매가 없을 때(=마감 후)'에만 노출
+        if open_round:
+            st.info("경매 마감 버튼을 눌러야 경매 결과가 표시됩니다.")
+        else:
+            closed_res = api_get_latest_closed_auction_round()
+            if not closed_res.get("ok"):
+                st.info("마감된 경매가 없습니다.")
             else:
-                closed_res = api_get_latest_closed_auction_round()
-                if not closed_res.get("ok"):
-                    st.info("마감된 경매가 없습니다.")
-                else:
-                    cl_round = closed_res.get("round", {}) or {}
-                    cl_round_id = str(cl_round.get("round_id", "") or "")
-
-                    # 장부 반영이 완료된 경매는 결과 표를 숨기고 기본 안내 문구를 유지
-                    if bool(cl_round.get("ledger_applied", False)):
-                        st.info("경매 마감 버튼을 눌러야 경매 결과가 표시됩니다.")
-                    else:
-                        bid_res = api_list_auction_bids(cl_round_id)
-                        bid_rows = list(bid_res.get("rows", []) or [])
-                        view_rows = []
-                        for r in bid_rows:
-                            view_rows.append(
-                                {
-                                    "입찰 가격": int(r.get("amount", 0) or 0),
-                                    "입찰일시": str(r.get("submitted_at_text", "") or ""),
-                                    "번호": int(r.get("student_no", 0) or 0),
-                                    "이름": str(r.get("student_name", "") or ""),
-                                }
-                            )
-
-                        st.caption(
-                            f"최근 마감 경매: {int(cl_round.get('round_no', 0) or 0):02d}회 | "
-                            f"입찰이름: {str(cl_round.get('bid_name', '') or '')}"
-                        )
-                        
-                        def _auc_toggle_no_refund():
-                            if st.session_state.get("auc_refund_non_winners_no", False):
-                                st.session_state["auc_refund_non_winners_yes"] = False
-
-                        def _auc_toggle_yes_refund():
-                            if st.session_state.get("auc_refund_non_winners_yes", False):
-                                st.session_state["auc_refund_non_winners_no"] = False
-                        already = bool(cl_round.get("ledger_applied", False))
-                        apply_clicked = False
-                             
-                        if view_rows:
-                            df_auc = pd.DataFrame(view_rows)
-                            st.dataframe(df_auc, use_container_width=True, hide_index=True)
-
-                            xbuf = BytesIO()
-                            with pd.ExcelWriter(xbuf, engine="openpyxl") as writer:
-                                df_auc.to_excel(writer, index=False, sheet_name="경매결과")
-                            xbuf.seek(0)
-
-                            ctrl1, ctrl2, ctrl3, ctrl4 = st.columns([1.2, 0.9, 1.2, 1.2])
-                            with ctrl1:
-                                st.download_button(
-                                    "엑셀저장",
-                                    data=xbuf.getvalue(),
-                                    file_name=f"auction_result_{int(cl_round.get('round_no', 0) or 0):02d}.xlsx",
-                                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                    use_container_width=True,
-                                    key="auc_excel_download",
-                                )
-                            with ctrl2:
-                                no_refund_checked = st.checkbox(
-                                    "낙찰금 미반환",
-                                    value=bool(st.session_state.get("auc_refund_non_winners_no", False)),
-                                    key="auc_refund_non_winners_no",
-                                    on_change=_auc_toggle_no_refund,
-                                )
-                            with ctrl3:
-                                yes_refund_checked = st.checkbox(
-                                    "낙찰금 반환(반환액 90%)",
-                                    value=bool(st.session_state.get("auc_refund_non_winners_yes", False)),
-                                    key="auc_refund_non_winners_yes",
-                                    on_change=_auc_toggle_yes_refund,
-                                )
-                            with ctrl4:
-                                apply_clicked = st.button("장부반영", key="auc_apply_ledger_btn", use_container_width=True, disabled=already)
-                        else:
-                            st.info("제출된 입찰표가 없습니다.")
+                cl_round = closed_res.get("round", {}) or {}
+                cl_round_id = str(cl_round.get("round_id", "") or "")
 
-                        if already:
-                            st.caption("이미 장부 반영된 경매입니다.")
-                            
-                        if apply_clicked:
-                            if (not no_refund_checked) and (not yes_refund_checked):
-                                st.warning("낙찰금 반환 여부를 선택 후 장부 반영 버튼을 눌러 주세요")
-                            else:
-                                refund_non_winners = bool(yes_refund_checked)
-                                res = api_apply_auction_ledger(ADMIN_PIN, cl_round_id, refund_non_winners=refund_non_winners)
-                                if res.get("ok"):
-                                    toast_and_rerun("경매 관리장부 + 국고 세입 반영 완료", icon="✅")
-                                else:
-                                    st.error(res.get("error", "장부 반영 실패"))
-
-            closed_list_res = api_list_closed_auction_rounds(limit=50)
-            closed_round_rows = list(closed_list_res.get("rows", []) or [])
-            if closed_round_rows:
-                auc_empty_label = "(선택없음)"
-                auc_options = {
-                    f"{int(r.get('round_no', 0) or 0):02d}회 | {str(r.get('bid_name', '') or '')}": r
-                    for r in closed_round_rows
-                }
-                auc_label = st.selectbox(
-                    "🔎 마감된 경매 결과 조회",
-                    options=[auc_empty_label] + list(auc_options.keys()),
-                    key="auc_closed_round_pick",
-                )
-                if auc_label != auc_empty_label:
-                    sel_round = auc_options.get(auc_label, {})
-                    sel_round_id = str(sel_round.get("round_id", "") or "")
-                    if sel_round_id:
-                        past_bid_res = api_list_auction_bids(sel_round_id)
-                        past_bid_rows = list(past_bid_res.get("rows", []) or [])
-                        past_view_rows = [
+                # 장부 반영이 완료된 경매는 결과 표를 숨기고 기본 안내 문구를 유지
+                if bool(cl_round.get("ledger_applied", False)):
+                    st.info("경매 마감 버튼을 눌러야 경매 결과가 표시됩니다.")
+                else:
+                    bid_res = api_list_auction_bids(cl_round_id)
+                    bid_rows = list(bid_res.get("rows", []) or [])
+                    view_rows = []
+                    for r in bid_rows:
+                        view_rows.append(
                             {
                                 "입찰 가격": int(r.get("amount", 0) or 0),
                                 "입찰일시": str(r.get("submitted_at_text", "") or ""),
                                 "번호": int(r.get("student_no", 0) or 0),
                                 "이름": str(r.get("student_name", "") or ""),
                             }
-                            for r in past_bid_rows
-                        ]
-                        if past_view_rows:
-                            st.dataframe(pd.DataFrame(past_view_rows), use_container_width=True, hide_index=True)
-                        else:
-                            st.info("선택한 회차에 제출된 입찰표가 없습니다.")
-            else:
-                st.info("조회 가능한 마감 경매가 없습니다.")            
-                                    
-            st.markdown("### 📚 경매 관리 장부")
-            led = api_list_auction_admin_ledger(limit=100)
-            led_rows = list(led.get("rows", []) or [])
-            if led_rows:
-                st.dataframe(pd.DataFrame(led_rows), use_container_width=True, hide_index=True)
-            else:
-                st.info("아직 반영된 경매 관리 장부가 없습니다.")
+                        )
 
-        else:
-            st.markdown("### 📝 입찰표")
-            if not open_round:
-                st.info("개시된 경매가 없습니다.")
-            else:
-                sid = str(my_student_id or "")
-                me_snap = db.collection("students").document(sid).get() if sid else None
-                me = me_snap.to_dict() if (me_snap and me_snap.exists) else {}
-                my_no_v = int((me or {}).get("no", 0) or 0)
-                my_name_v = str((me or {}).get("name", login_name) or login_name)
-
-                st.write(f"- 입찰기일: {_fmt_auction_dt(open_round.get('opened_at'))}")
-                st.write(f"- 입찰번호: {int(open_round.get('round_no', 0) or 0):02d}")
-                st.write(f"- 입찰이름: {str(open_round.get('bid_name', '') or '')}")
-                st.write(f"- 입찰자 정보: 번호 {my_no_v} / 이름 {my_name_v} / 소속 {str(open_round.get('affiliation', '') or '')}")
-
-            st.markdown("### ✋경매 참여하기")
-            if not open_round:
-                st.info("개시된 경매가 없습니다.")
-            else:
-                bid_doc_id = f"{str(open_round.get('round_id', '') or '')}_{sid}"
-                prev_bid = db.collection("auction_bids").document(bid_doc_id).get() if sid else None
-                if prev_bid and prev_bid.exists:
-                    pb = prev_bid.to_dict() or {}
-                    st.success(
-                        f"입찰표 제출 완료: {int(pb.get('amount', 0) or 0):,} 드림 | "
-                        f"제출시각 {_fmt_auction_dt(pb.get('submitted_at'))}"
+                    st.caption(
+                        f"최근 마감 경매: {int(cl_round.get('round_no', 0) or 0):02d}회 | "
+                        f"입찰이름: {str(cl_round.get('bid_name', '') or '')}"
                     )
-                else:
-                    amt = st.number_input("입찰 가격(드림)", min_value=0, step=1, key="auc_user_amount")
-                    confirm = st.radio("입찰표를 제출하시겠습니까?", ["아니오", "예"], horizontal=True, key="auc_user_confirm")
-                    if st.button("입찰표 제출", use_container_width=True, key="auc_user_submit_btn"):
-                        if confirm != "예":
-                            st.warning("제출 전 확인에서 '예'를 선택해 주세요.")
+
+                    def _auc_toggle_no_refund():
+                        if st.session_state.get("auc_refund_non_winners_no", False):
+                            st.session_state["auc_refund_non_winners_yes"] = False
+
+                    def _auc_toggle_yes_refund():
+                        if st.session_state.get("auc_refund_non_winners_yes", False):
+                            st.session_state["auc_refund_non_winners_no"] = False
+                    already = bool(cl_round.get("ledger_applied", False))
+                    apply_clicked = False
+
+                    if view_rows:
+                        df_auc = pd.DataFrame(view_rows)
+                        st.dataframe(df_auc, use_container_width=True, hide_index=True)
+
+                        xbuf = BytesIO()
+                        with pd.ExcelWriter(xbuf, engine="openpyxl") as writer:
+                            df_auc.to_excel(writer, index=False, sheet_name="경매결과")
+                        xbuf.seek(0)
+
+                        ctrl1, ctrl2, ctrl3, ctrl4 = st.columns([1.2, 0.9, 1.2, 1.2])
+                        with ctrl1:
+                            st.download_button(
+                                "엑셀저장",
+                                data=xbuf.getvalue(),
+                                file_name=f"auction_result_{int(cl_round.get('round_no', 0) or 0):02d}.xlsx",
+                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                use_container_width=True,
+                                key="auc_excel_download",
+                            )
+                        with ctrl2:
+                            no_refund_checked = st.checkbox(
+                                "낙찰금 미반환",
+                                value=bool(st.session_state.get("auc_refund_non_winners_no", False)),
+                                key="auc_refund_non_winners_no",
+                                on_change=_auc_toggle_no_refund,
+                            )
+                        with ctrl3:
+                            yes_refund_checked = st.checkbox(
+                                "낙찰금 반환(반환액 90%)",
+                                value=bool(st.session_state.get("auc_refund_non_winners_yes", False)),
+                                key="auc_refund_non_winners_yes",
+                                on_change=_auc_toggle_yes_refund,
+                            )
+                        with ctrl4:
+                            apply_clicked = st.button("장부반영", key="auc_apply_ledger_btn", use_container_width=True, disabled=already)
+                    else:
+                        st.info("제출된 입찰표가 없습니다.")
+
+                    if already:
+                        st.caption("이미 장부 반영된 경매입니다.")
+
+                    if apply_clicked:
+                        if (not no_refund_checked) and (not yes_refund_checked):
+                            st.warning("낙찰금 반환 여부를 선택 후 장부 반영 버튼을 눌러 주세요")
                         else:
-                            res = api_submit_auction_bid(login_name, login_pin, int(amt))
+                            refund_non_winners = bool(yes_refund_checked)
+                            res = api_apply_auction_ledger(ADMIN_PIN, cl_round_id, refund_non_winners=refund_non_winners)
                             if res.get("ok"):
-                                toast_and_rerun("입찰표 제출 완료! 제출 즉시 통장에서 차감되었습니다.", icon="✅")
+                                toast_and_rerun("경매 관리장부 + 국고 세입 반영 완료", icon="✅", scope="fragment")
                             else:
-                                st.error(res.get("error", "입찰표 제출 실패"))
+                                st.error(res.get("error", "장부 반영 실패"))
+
+        closed_list_res = api_list_closed_auction_rounds(limit=50)
+        closed_round_rows = list(closed_list_res.get("rows", []) or [])
+        if closed_round_rows:
+            auc_empty_label = "(선택없음)"
+            auc_options = {
+                f"{int(r.get('round_no', 0) or 0):02d}회 | {str(r.get('bid_name', '') or '')}": r
+                for r in closed_round_rows
+            }
+            auc_label = st.selectbox(
+                "🔎 마감된 경매 결과 조회",
+                options=[auc_empty_label] + list(auc_options.keys()),
+                key="auc_closed_round_pick",
+            )
+            if auc_label != auc_empty_label:
+                sel_round = auc_options.get(auc_label, {})
+                sel_round_id = str(sel_round.get("round_id", "") or "")
+                if sel_round_id:
+                    past_bid_res = api_list_auction_bids(sel_round_id)
+                    past_bid_rows = list(past_bid_res.get("rows", []) or [])
+                    past_view_rows = [
+                        {
+                            "입찰 가격": int(r.get("amount", 0) or 0),
+                            "입찰일시": str(r.get("submitted_at_text", "") or ""),
+                            "번호": int(r.get("student_no", 0) or 0),
+                            "이름": str(r.get("student_name", "") or ""),
+                        }
+                        for r in past_bid_rows
+                    ]
+                    if past_view_rows:
+                        st.dataframe(pd.DataFrame(past_view_rows), use_container_width=True, hide_index=True)
+                    else:
+                        st.info("선택한 회차에 제출된 입찰표가 없습니다.")
+        else:
+            st.info("조회 가능한 마감 경매가 없습니다.")            
+
+        st.markdown("### 📚 경매 관리 장부")
+        led = api_list_auction_admin_ledger(limit=100)
+        led_rows = list(led.get("rows", []) or [])
+        if led_rows:
+            st.dataframe(pd.DataFrame(led_rows), use_container_width=True, hide_index=True)
+        else:
+            st.info("아직 반영된 경매 관리 장부가 없습니다.")
+
+    else:
+        st.markdown("### 📝 입찰표")
+        if not open_round:
+            st.info("개시된 경매가 없습니다.")
+        else:
+            sid = str(my_student_id or "")
+            me_snap = db.collection("students").document(sid).get() if sid else None
+            me = me_snap.to_dict() if (me_snap and me_snap.exists) else {}
+            my_no_v = int((me or {}).get("no", 0) or 0)
+            my_name_v = str((me or {}).get("name", login_name) or login_name)
+
+            st.write(f"- 입찰기일: {_fmt_auction_dt(open_round.get('opened_at'))}")
+            st.write(f"- 입찰번호: {int(open_round.get('round_no', 0) or 0):02d}")
+            st.write(f"- 입찰이름: {str(open_round.get('bid_name', '') or '')}")
+            st.write(f"- 입찰자 정보: 번호 {my_no_v} / 이름 {my_name_v} / 소속 {str(open_round.get('affiliation', '') or '')}")
+
+        st.markdown("### ✋경매 참여하기")
+        if not open_round:
+            st.info("개시된 경매가 없습니다.")
+        else:
+            bid_doc_id = f"{str(open_round.get('round_id', '') or '')}_{sid}"
+            prev_bid = db.collection("auction_bids").document(bid_doc_id).get() if sid else None
+            if prev_bid and prev_bid.exists:
+                pb = prev_bid.to_dict() or {}
+                st.success(
+                    f"입찰표 제출 완료: {int(pb.get('amount', 0) or 0):,} 드림 | "
+                    f"제출시각 {_fmt_auction_dt(pb.get('submitted_at'))}"
+                )
+            else:
+                amt = st.number_input("입찰 가격(드림)", min_value=0, step=1, key="auc_user_amount")
+                confirm = st.radio("입찰표를 제출하시겠습니까?", ["아니오", "예"], horizontal=True, key="auc_user_confirm")
+                if st.button("입찰표 제출", use_container_width=True, key="auc_user_submit_btn"):
+                    if confirm != "예":
+                        st.warning("제출 전 확인에서 '예'를 선택해 주세요.")
+                    else:
+                        res = api_submit_auction_bid(login_name, login_pin, int(amt))
+                        if res.get("ok"):
+                            toast_and_rerun("입찰표 제출 완료! 제출 즉시 통장에서 차감되었습니다.", icon="✅")
+                        else:
+                            st.error(res.get("error", "입찰표 제출 실패"))
+
+
+if "🏷️ 경매" in tabs:
+    with tab_map["🏷️ 경매"]:
+        _render_auction_tab()
 
 # =========================
 # 🍀 복권 탭
 # =========================
-if "🍀 복권" in tabs:
-    with tab_map["🍀 복권"]:
+@fragment_if_available
+def _render_lottery_tab():
+    """🍀 복권 탭 본문(프래그먼트: 번호 입력/추첨/지급 처리 시 이 탭만 다시 실행)."""
+
+    open_lot_res = api_get_open_lottery_round()
+    open_round = (open_lot_res.get("round", {}) or {}) if open_lot_res.get("ok") else {}
+    _render_live_probe(
+        "lottery",
+        (("lottery_rounds", ""), ("lottery_entries", str(open_round.get("round_id", "") or ""))),
+    )
 
-        open_lot_res = api_get_open_lottery_round()
-        open_round = (open_lot_res.get("round", {}) or {}) if open_lot_res.get("ok") else {}
+    if is_admin:
+        st.markdown("### 🛠️ 복권 설정 및 개시")
+        l1, l2, l3 = st.columns(3)
+        with l1:
+            lot_price = st.number_input("복권 가격 설정", min_value=2, step=1, value=20, key="lot_admin_price")
+            lot_first = st.number_input("1등 당첨 백분율(%)", min_value=0, max_value=100, step=1, value=80, key="lot_admin_first_pct")
+        with l2:
+            lot_tax = st.number_input("세금(%)", min_value=1, max_value=100, step=1, value=40, key="lot_admin_tax")
+            lot_second = st.number_input("2등 당첨 백분율(%)", min_value=0, max_value=100, step=1, value=20, key="lot_admin_second_pct")
+        with l3:
+            lot_third = st.number_input("3등 당첨금", min_value=0, step=1, value=20, key="lot_admin_third")
+
+        if int(lot_first) + int(lot_second) != 100:
+            st.warning("1등 + 2등 당첨 백분율의 합은 반드시 100이어야 합니다.")
 
-        if is_admin:
-            st.markdown("### 🛠️ 복권 설정 및 개시")
-            l1, l2, l3 = st.columns(3)
-            with l1:
-                lot_price = st.number_input("복권 가격 설정", min_value=2, step=1, value=20, key="lot_admin_price")
-                lot_first = st.number_input("1등 당첨 백분율(%)", min_value=0, max_value=100, step=1, value=80, key="lot_admin_first_pct")
-            with l2:
-                lot_tax = st.number_input("세금(%)", min_value=1, max_value=100, step=1, value=40, key="lot_admin_tax")
-                lot_second = st.number_input("2등 당첨 백분율(%)", min_value=0, max_value=100, step=1, value=20, key="lot_admin_second_pct")
-            with l3:
-                lot_third = st.number_input("3등 당첨금", min_value=0, step=1, value=20, key="lot_admin_third")
-
-            if int(lot_first) + int(lot_second) != 100:
-                st.warning("1등 + 2등 당첨 백분율의 합은 반드시 100이어야 합니다.")
-
-            b1, b2 = st.columns(2)
-            with b1:
-                if st.button("개시", key="lot_admin_open_btn", use_container_width=True):
-                    res = api_open_lottery(
+        b1, b2 = st.columns(2)
+        with b1:
+            if st.button("개시", key="lot_admin_open_btn", use_container_width=True):
+                res = api_open_lottery(
+                    ADMIN_PIN,
+                    {
+                        "ticket_price": int(lot_price),
+                        "tax_rate": int(lot_tax),
+                        "first_pct": int(lot_first),
+                        "second_pct": int(lot_second),
+                        "third_prize": int(lot_third),
+                    },
+                )
+                if res.get("ok"):
+                    toast_and_rerun(f"복권 {int(res.get('round_no', 0) or 0)}회 개시", icon="✅", scope="fragment")
+                else:
+                    st.error(res.get("error", "복권 개시 실패"))
+        with b2:
+            if st.button("마감", key="lot_admin_close_btn", use_container_width=True):
+                res = api_close_lottery(ADMIN_PIN)
+                if res.get("ok"):
+                    toast_and_rerun("복권 마감 완료", icon="✅", scope="fragment")
+                else:
+                    st.error(res.get("error", "복권 마감 실패"))
+
+        if open_round:
+            st.success(
+                f"진행 중 복권: {int(open_round.get('round_no', 0) or 0)}회 | 가격 {int(open_round.get('ticket_price', 0) or 0)}"
+            )
+        else:
+            st.info("개시된 복권이 없습니다.")
+
+        st.markdown("### 👑 관리자 복권 참여")
+        if open_round:
+            ap1, ap2, ap3 = st.columns([2, 1, 1])
+            with ap1:
+                admin_lot_count = st.number_input("복권 참여 수", min_value=1, step=1, value=1, key="lot_admin_join_count")
+            with ap2:
+                st.write("")
+                lot_apply_treasury = st.checkbox("국고반영", value=True, key="lot_admin_join_apply_treasury")
+            with ap3:
+                st.write("")
+                if st.button("복권 참여", key="lot_admin_join_btn", use_container_width=True):
+                    ares = api_submit_admin_lottery_entries(
                         ADMIN_PIN,
-                        {
-                            "ticket_price": int(lot_price),
-                            "tax_rate": int(lot_tax),
-                            "first_pct": int(lot_first),
-                            "second_pct": int(lot_second),
-                            "third_prize": int(lot_third),
-                        },
+                        int(admin_lot_count),
+                        apply_treasury=bool(lot_apply_treasury),
                     )
-                    if res.get("ok"):
-                        toast_and_rerun(f"복권 {int(res.get('round_no', 0) or 0)}회 개시", icon="✅")
+                    if ares.get("ok"):
+                        toast_and_rerun(f"관리자 복권 {int(ares.get('count', 0) or 0)}게임 참여 완료", icon="✅", scope="fragment")
                     else:
-                        st.error(res.get("error", "복권 개시 실패"))
-            with b2:
-                if st.button("마감", key="lot_admin_close_btn", use_container_width=True):
-                    res = api_close_lottery(ADMIN_PIN)
-                    if res.get("ok"):
-                        toast_and_rerun("복권 마감 완료", icon="✅")
+                        st.error(ares.get("error", "관리자 복권 참여 실패"))
+
+            current_round_entries = api_list_lottery_entries(str(open_round.get("round_id", "") or "")).get("rows", [])
+            ticket_price = int(open_round.get("ticket_price", 0) or 0)
+            admin_with_treasury_count = 0
+            admin_without_treasury_count = 0
+            student_count = 0
+            for row in current_round_entries:
+                is_admin_entry = bool(row.get("is_admin", False))
+                if is_admin_entry:
+                    if bool(row.get("treasury_applied", False)):
+                        admin_with_treasury_count += 1
                     else:
-                        st.error(res.get("error", "복권 마감 실패"))
+                        admin_without_treasury_count += 1
+                else:
+                    student_count += 1
 
-            if open_round:
-                st.success(
-                    f"진행 중 복권: {int(open_round.get('round_no', 0) or 0)}회 | 가격 {int(open_round.get('ticket_price', 0) or 0)}"
+            if admin_with_treasury_count > 0:
+                st.caption(
+                    "관리자 참여 현황 : "
+                    f"복권 참여수 {int(admin_with_treasury_count):02d}  |  "
+                    f"총액 {int(admin_with_treasury_count * ticket_price)}  |  "
+                    "국고반영여부 O"
                 )
-            else:
-                st.info("개시된 복권이 없습니다.")
-
-            st.markdown("### 👑 관리자 복권 참여")
-            if open_round:
-                ap1, ap2, ap3 = st.columns([2, 1, 1])
-                with ap1:
-                    admin_lot_count = st.number_input("복권 참여 수", min_value=1, step=1, value=1, key="lot_admin_join_count")
-                with ap2:
-                    st.write("")
-                    lot_apply_treasury = st.checkbox("국고반영", value=True, key="lot_admin_join_apply_treasury")
-                with ap3:
-                    st.write("")
-                    if st.button("복권 참여", key="lot_admin_join_btn", use_container_width=True):
-                        ares = api_submit_admin_lottery_entries(
-                            ADMIN_PIN,
-                            int(admin_lot_count),
-                            apply_treasury=bool(lot_apply_treasury),
-                        )
-                        if ares.get("ok"):
-                            toast_and_rerun(f"관리자 복권 {int(ares.get('count', 0) or 0)}게임 참여 완료", icon="✅")
-                        else:
-                            st.error(ares.get("error", "관리자 복권 참여 실패"))
-
-                current_round_entries = api_list_lottery_entries(str(open_round.get("round_id", "") or "")).get("rows", [])
-                ticket_price = int(open_round.get("ticket_price", 0) or 0)
-                admin_with_treasury_count = 0
-                admin_without_treasury_count = 0
-                student_count = 0
-                for row in current_round_entries:
-                    is_admin_entry = bool(row.get("is_admin", False))
-                    if is_admin_entry:
-                        if bool(row.get("treasury_applied", False)):
-                            admin_with_treasury_count += 1
-                        else:
-                            admin_without_treasury_count += 1
-                    else:
-                        student_count += 1
-
-                if admin_with_treasury_count > 0:
-                    st.caption(
-                        "관리자 참여 현황 : "
-                        f"복권 참여수 {int(admin_with_treasury_count):02d}  |  "
-                        f"총액 {int(admin_with_treasury_count * ticket_price)}  |  "
-                        "국고반영여부 O"
-                    )
-                if admin_without_treasury_count > 0:
-                    st.caption(
-                        "관리자 참여 현황 : "
-                        f"복권 참여수 {int(admin_without_treasury_count):02d}  |  "
-                        f"총액 {int(admin_without_treasury_count * ticket_price)}  |  "
-                        "국고반영여부 X"
-                    )
-
+            if admin_without_treasury_count > 0:
                 st.caption(
-                    "학생 참여 현황 : "
-                    f"복권 참여수 {int(student_count):02d}  |  "
-                    f"총액 {int(student_count * ticket_price):03d}"
+                    "관리자 참여 현황 : "
+                    f"복권 참여수 {int(admin_without_treasury_count):02d}  |  "
+                    f"총액 {int(admin_without_treasury_count * ticket_price)}  |  "
+                    "국고반영여부 X"
                 )
+
+            st.caption(
+                "학생 참여 현황 : "
+                f"복권 참여수 {int(student_count):02d}  |  "
+                f"총액 {int(student_count * ticket_price):03d}"
+            )
+        else:
+            st.info("개시된 복권이 없습니다.")
+
+        current_round_id = str(open_round.get("round_id", "") or "")
+        current_round = dict(open_round)
+        if not current_round_id:
+            try:
+                cq = db.collection("lottery_rounds").order_by("round_no", direction=mongo.Query.DESCENDING).limit(1).stream()
+                for d in cq:
+                    current_round = d.to_dict(copy=True) or {}
+                    current_round["round_id"] = d.id
+                    current_round_id = d.id
+                    break
+            except Exception:
+                current_round_id = ""
+
+        st.markdown("### 📝 복권 참여 결과")
+        lot_result_gate_msg = "복권 마감 버튼을 눌러야 결과가 표시됩니다."
+        if current_round_id:
+            ent_res = api_list_lottery_entries(current_round_id)
+            ent_rows = list(ent_res.get("rows", []) or [])
+            is_lottery_closed = str(current_round.get("status", "")) in ("closed", "drawn")
+            payout_done = bool(current_round.get("payout_done", False))
+
+            # 복권 참여 결과는 "복권 마감" 이후에만 보이고,
+            # 당첨금 지급/장부 반영 완료 후에는 다시 안내 문구로 전환.
+            show_entry_result = bool(ent_rows) and is_lottery_closed and (not payout_done)
+
+            if show_entry_result:
+                ticket_price = int(current_round.get("ticket_price", 0) or 0)
+                participant_keys = set()
+                for r in ent_rows:
+                    sid = str(r.get("student_id", "") or "").strip()
+                    if sid:
+                        participant_keys.add(f"sid:{sid}")
+                        continue
+                    sno = int(r.get("student_no", 0) or 0)
+                    sname = str(r.get("student_name", "") or "").strip()
+                    if sno > 0:
+                        participant_keys.add(f"sno:{sno}")
+                    elif sname:
+                        participant_keys.add(f"name:{sname}")
+
+                summary_rows = [{
+                    "참여자수": int(len(participant_keys)),
+                    "참여 복권수": int(len(ent_rows)),
+                    "총 액수": int(len(ent_rows) * ticket_price),
+                }]
+                st.dataframe(pd.DataFrame(summary_rows), use_container_width=True, hide_index=True)
+
+                view_rows = [
+                    {
+                        "참여 일시": str(r.get("submitted_at_text", "") or ""),
+                        "번호": int(r.get("student_no", 0) or 0),
+                        "이름": str(r.get("student_name", "") or ""),
+                        "복권 참여 번호": str(r.get("numbers_text", "") or ""),
+                    }
+                    for r in ent_rows
+                ]
+                st.dataframe(pd.DataFrame(view_rows), use_container_width=True, hide_index=True)
             else:
-                st.info("개시된 복권이 없습니다.")
-            
-            current_round_id = str(open_round.get("round_id", "") or "")
-            current_round = dict(open_round)
+                st.info(lot_result_gate_msg)
+        else:
+            st.info(lot_result_gate_msg)
+
+        closed_lot_res = api_list_closed_lottery_rounds(limit=80)
+        closed_lot_rows = list(closed_lot_res.get("rows", []) or [])
+        if closed_lot_rows:
+            lot_empty_label = "(선택없음)"
+            lot_options = {f"{int(r.get('round_no', 0) or 0)}회": r for r in closed_lot_rows}
+            lot_label = st.selectbox(
+                "🔎 마감된 복권 결과 조회",
+                options=[lot_empty_label] + list(lot_options.keys()),
+                key="lot_closed_round_pick",
+            )
+            if lot_label != lot_empty_label:
+                lot_round = lot_options.get(lot_label, {})
+                lot_round_id = str(lot_round.get("round_id", "") or "")
+                if lot_round_id:
+                    lot_ent_res = api_list_lottery_entries(lot_round_id)
+                    lot_ent_rows = list(lot_ent_res.get("rows", []) or [])
+                    if lot_ent_rows:
+                        lot_ticket_price = int(lot_round.get("ticket_price", 0) or 0)
+                        participant_keys = set()
+                        for r in lot_ent_rows:
+                            sid = str(r.get("student_id", "") or "").strip()
+                            if sid:
+                                participant_keys.add(f"sid:{sid}")
+                                continue
+                            sno = int(r.get("student_no", 0) or 0)
+                            sname = str(r.get("student_name", "") or "").strip()
+                            if sno > 0:
+                                participant_keys.add(f"sno:{sno}")
+                            elif sname:
+                                participant_keys.add(f"name:{sname}")
+
+                        past_summary_rows = [{
+                            "참여자수": int(len(participant_keys)),
+                            "참여 복권수": int(len(lot_ent_rows)),
+                            "총 액수": int(len(lot_ent_rows) * lot_ticket_price),
+                        }]
+                        st.dataframe(pd.DataFrame(past_summary_rows), use_container_width=True, hide_index=True)
+
+                        past_lot_rows = [
+                            {
+                                "참여 일시": str(r.get("submitted_at_text", "") or ""),
+                                "번호": int(r.get("student_no", 0) or 0),
+                                "이름": str(r.get("student_name", "") or ""),
+                                "복권 참여 번호": str(r.get("numbers_text", "") or ""),
+                            }
+                            for r in lot_ent_rows
+                        ]
+                        st.dataframe(pd.DataFrame(past_lot_rows), use_container_width=True, hide_index=True)
+                    else:
+                        st.info("선택한 회차의 참여 결과가 없습니다.")
+        else:
+            st.info("조회 가능한 마감 복권 회차가 없습니다.")
+
+        st.markdown("### 🎰 복권 추첨하기")
+        d1, d2, d3, d4 = st.columns(4)
+        with d1:
+            wn1 = st.number_input("첫 번째 당첨번호", min_value=1, max_value=20, step=1, value=1, key="lot_wn1")
+        with d2:
+            wn2 = st.number_input("두 번째 당첨번호", min_value=1, max_value=20, step=1, value=2, key="lot_wn2")
+        with d3:
+            wn3 = st.number_input("세 번째 당첨번호", min_value=1, max_value=20, step=1, value=3, key="lot_wn3")
+        with d4:
+            wn4 = st.number_input("네 번째 당첨번호", min_value=1, max_value=20, step=1, value=4, key="lot_wn4")
+
+        draw_nums = [int(wn1), int(wn2), int(wn3), int(wn4)]
+        if len(set(draw_nums)) != 4:
+            st.warning("당첨번호 4개는 서로 중복될 수 없습니다.")
+
+        if st.button("당첨번호 제출", key="lot_draw_btn", use_container_width=True):
             if not current_round_id:
-                try:
-                    cq = db.collection("lottery_rounds").order_by("round_no", direction=mongo.Query.DESCENDING).limit(1).stream()
-                    for d in cq:
-                        current_round = d.to_dict() or {}
-                        current_round["round_id"] = d.id
-                        current_round_id = d.id
-                        break
-                except Exception:
-                    current_round_id = ""
-
-            st.markdown("### 📝 복권 참여 결과")
-            lot_result_gate_msg = "복권 마감 버튼을 눌러야 결과가 표시됩니다."
-            if current_round_id:
-                ent_res = api_list_lottery_entries(current_round_id)
-                ent_rows = list(ent_res.get("rows", []) or [])
-                is_lottery_closed = str(current_round.get("status", "")) in ("closed", "drawn")
-                payout_done = bool(current_round.get("payout_done", False))
-
-                # 복권 참여 결과는 "복권 마감" 이후에만 보이고,
-                # 당첨금 지급/장부 반영 완료 후에는 다시 안내 문구로 전환.
-                show_entry_result = bool(ent_rows) and is_lottery_closed and (not payout_done)
-
-                if show_entry_result:
-                    ticket_price = int(current_round.get("ticket_price", 0) or 0)
-                    participant_keys = set()
-                    for r in ent_rows:
-                        sid = str(r.get("student_id", "") or "").strip()
-                        if sid:
-                            participant_keys.add(f"sid:{sid}")
-                            continue
-                        sno = int(r.get("student_no", 0) or 0)
-                        sname = str(r.get("student_name", "") or "").strip()
-                        if sno > 0:
-                            participant_keys.add(f"sno:{sno}")
-                        elif sname:
-                            participant_keys.add(f"name:{sname}")
-
-                    summary_rows = [{
-                        "참여자수": int(len(participant_keys)),
-                        "참여 복권수": int(len(ent_rows)),
-                        "총 액수": int(len(ent_rows) * ticket_price),
-                    }]
-                    st.dataframe(pd.DataFrame(summary_rows), use_container_width=True, hide_index=True)
-
-                    view_rows = [
-                        {
-                            "참여 일시": str(r.get("submitted_at_text", "") or ""),
-                            "번호": int(r.get("student_no", 0) or 0),
-                            "이름": str(r.get("student_name", "") or ""),
-                            "복권 참여 번호": str(r.get("numbers_text", "") or ""),
-                        }
-                        for r in ent_rows
-                    ]
-                    st.dataframe(pd.DataFrame(view_rows), use_container_width=True, hide_index=True)
+                st.error("대상 복권 회차가 없습니다.")
+            elif len(set(draw_nums)) != 4:
+                st.error("당첨번호 4개는 중복 없이 입력해 주세요.")
+            else:
+                res = api_draw_lottery(ADMIN_PIN, current_round_id, draw_nums)
+                if res.get("ok"):
+                    st.session_state["lottery_winners_visible_round_id"] = str(current_round_id)
+                    toast_and_rerun("복권 추첨 완료", icon="✅", scope="fragment")
                 else:
-                    st.info(lot_result_gate_msg)
+                    st.error(res.get("error", "복권 추첨 실패"))
+
+        st.markdown("### 🎉 당첨자 확인")
+        if current_round_id:
+            current_round_id_str = str(current_round_id)
+            submitted_round_id = str(st.session_state.get("lottery_winners_visible_round_id", "") or "")
+            show_winner_result = submitted_round_id == current_round_id_str
+
+            r_snap = db.collection("lottery_rounds").document(current_round_id).get()
+            r_dat = r_snap.to_dict() if r_snap.exists else {}
+            winners = list((r_dat or {}).get("winners", []) or [])
+            win_nums = _normalize_lottery_numbers((r_dat or {}).get("winning_numbers", []))
+            draw_submitted = str((r_dat or {}).get("status", "") or "") == "drawn"
+
+            if show_winner_result and draw_submitted:
+                st.caption(f"회차 {int((r_dat or {}).get('round_no', 0) or 0)} | 당첨번호: {', '.join([f'{n:02d}' for n in win_nums])}")
             else:
-                st.info(lot_result_gate_msg)
-
-            closed_lot_res = api_list_closed_lottery_rounds(limit=80)
-            closed_lot_rows = list(closed_lot_res.get("rows", []) or [])
-            if closed_lot_rows:
-                lot_empty_label = "(선택없음)"
-                lot_options = {f"{int(r.get('round_no', 0) or 0)}회": r for r in closed_lot_rows}
-                lot_label = st.selectbox(
-                    "🔎 마감된 복권 결과 조회",
-                    options=[lot_empty_label] + list(lot_options.keys()),
-                    key="lot_closed_round_pick",
-                )
-                if lot_label != lot_empty_label:
-                    lot_round = lot_options.get(lot_label, {})
-                    lot_round_id = str(lot_round.get("round_id", "") or "")
-                    if lot_round_id:
-                        lot_ent_res = api_list_lottery_entries(lot_round_id)
-                        lot_ent_rows = list(lot_ent_res.get("rows", []) or [])
-                        if lot_ent_rows:
-                            lot_ticket_price = int(lot_round.get("ticket_price", 0) or 0)
-                            participant_keys = set()
-                            for r in lot_ent_rows:
-                                sid = str(r.get("student_id", "") or "").strip()
-                                if sid:
-                                    participant_keys.add(f"sid:{sid}")
-                                    continue
-                                sno = int(r.get("student_no", 0) or 0)
-                                sname = str(r.get("student_name", "") or "").strip()
-                                if sno > 0:
-                                    participant_keys.add(f"sno:{sno}")
-                                elif sname:
-                                    participant_keys.add(f"name:{sname}")
-
-                            past_summary_rows = [{
-                                "참여자수": int(len(participant_keys)),
-                                "참여 복권수": int(len(lot_ent_rows)),
-                                "총 액수": int(len(lot_ent_rows) * lot_ticket_price),
-                            }]
-                            st.dataframe(pd.DataFrame(past_summary_rows), use_container_width=True, hide_index=True)
-
-                            past_lot_rows = [
-                                {
-                                    "참여 일시": str(r.get("submitted_at_text", "") or ""),
-                                    "번호": int(r.get("student_no", 0) or 0),
-                                    "이름": str(r.get("student_name", "") or ""),
-                                    "복권 참여 번호": str(r.get("numbers_text", "") or ""),
-                                }
-                                for r in lot_ent_rows
-                            ]
-                            st.dataframe(pd.DataFrame(past_lot_rows), use_container_width=True, hide_index=True)
+                st.info("당첨 번호 제출 버튼을 눌러야 당첨 결과가 표시됩니다.")
+
+            if show_winner_result and winners:
+                def _render_nums(nums, wset):
+                    out = []
+                    for n in nums:
+                        if int(n) in wset:
+                            out.append(f"<span style='color:#d90429;font-weight:700'>{int(n):02d}</span>")
                         else:
-                            st.info("선택한 회차의 참여 결과가 없습니다.")
-            else:
-                st.info("조회 가능한 마감 복권 회차가 없습니다.")
-            
-            st.markdown("### 🎰 복권 추첨하기")
-            d1, d2, d3, d4 = st.columns(4)
-            with d1:
-                wn1 = st.number_input("첫 번째 당첨번호", min_value=1, max_value=20, step=1, value=1, key="lot_wn1")
-            with d2:
-                wn2 = st.number_input("두 번째 당첨번호", min_value=1, max_value=20, step=1, value=2, key="lot_wn2")
-            with d3:
-                wn3 = st.number_input("세 번째 당첨번호", min_value=1, max_value=20, step=1, value=3, key="lot_wn3")
-            with d4:
-                wn4 = st.number_input("네 번째 당첨번호", min_value=1, max_value=20, step=1, value=4, key="lot_wn4")
-
-            draw_nums = [int(wn1), int(wn2), int(wn3), int(wn4)]
-            if len(set(draw_nums)) != 4:
-                st.warning("당첨번호 4개는 서로 중복될 수 없습니다.")
-
-            if st.button("당첨번호 제출", key="lot_draw_btn", use_container_width=True):
-                if not current_round_id:
-                    st.error("대상 복권 회차가 없습니다.")
-                elif len(set(draw_nums)) != 4:
-                    st.error("당첨번호 4개는 중복 없이 입력해 주세요.")
-                else:
-                    res = api_draw_lottery(ADMIN_PIN, current_round_id, draw_nums)
-                    if res.get("ok"):
-                        st.session_state["lottery_winners_visible_round_id"] = str(current_round_id)
-                        toast_and_rerun("복권 추첨 완료", icon="✅")
-                    else:
-                        st.error(res.get("error", "복권 추첨 실패"))
+                            out.append(f"{int(n):02d}")
+                    return ", ".join(out)
 
-            st.markdown("### 🎉 당첨자 확인")
-            if current_round_id:
-                current_round_id_str = str(current_round_id)
-                submitted_round_id = str(st.session_state.get("lottery_winners_visible_round_id", "") or "")
-                show_winner_result = submitted_round_id == current_round_id_str
-                
-                r_snap = db.collection("lottery_rounds").document(current_round_id).get()
-                r_dat = r_snap.to_dict() if r_snap.exists else {}
-                winners = list((r_dat or {}).get("winners", []) or [])
-                win_nums = _normalize_lottery_numbers((r_dat or {}).get("winning_numbers", []))
-                draw_submitted = str((r_dat or {}).get("status", "") or "") == "drawn"
-
-                if show_winner_result and draw_submitted:
-                    st.caption(f"회차 {int((r_dat or {}).get('round_no', 0) or 0)} | 당첨번호: {', '.join([f'{n:02d}' for n in win_nums])}")
-                else:
-                    st.info("당첨 번호 제출 버튼을 눌러야 당첨 결과가 표시됩니다.")
-                    
-                if show_winner_result and winners:
-                    def _render_nums(nums, wset):
-                        out = []
-                        for n in nums:
-                            if int(n) in wset:
-                                out.append(f"<span style='color:#d90429;font-weight:700'>{int(n):02d}</span>")
-                            else:
-                                out.append(f"{int(n):02d}")
-                        return ", ".join(out)
-
-                    html = [
-                        "<table style='width:100%;border-collapse:collapse'>",
-                        "<thead><tr><th style='text-align:left;border-bottom:1px solid #ddd'>등수</th><th style='text-align:left;border-bottom:1px solid #ddd'>번호</th><th style='text-align:left;border-bottom:1px solid #ddd'>이름</th><th style='text-align:left;border-bottom:1px solid #ddd'>복권 참여 번호</th><th style='text-align:left;border-bottom:1px solid #ddd'>당첨금</th></tr></thead><tbody>",
-                    ]
-                    for w in winners:
-                        html.append(
-                            "<tr>"
-                            f"<td>{int(w.get('rank', 0) or 0)}등</td>"
-                            f"<td>{int(w.get('student_no', 0) or 0)}</td>"
-                            f"<td>{str(w.get('student_name', '') or '')}</td>"
-                            f"<td>{_render_nums(_normalize_lottery_numbers(w.get('numbers', [])), set(win_nums))}</td>"
-                            f"<td>{int(w.get('prize', 0) or 0)}</td>"
-                            "</tr>"
-                        )
-                    html.append("</tbody></table>")
-                    st.markdown("".join(html), unsafe_allow_html=True)
-
-                else:
-                    if show_winner_result and draw_submitted:
-                        st.info("당첨자가 없습니다.")
+                html = [
+                    "<table style='width:100%;border-collapse:collapse'>",
+                    "<thead><tr><th style='text-align:left;border-bottom:1px solid #ddd'>등수</th><th style='text-align:left;border-bottom:1px solid #ddd'>번호</th><th style='text-align:left;border-bottom:1px solid #ddd'>이름</th><th style='text-align:left;border-bottom:1px solid #ddd'>복권 참여 번호</th><th style='text-align:left;border-bottom:1px solid #ddd'>당첨금</th></tr></thead><tbody>",
+                ]
+                for w in winners:
+                    html.append(
+                        "<tr>"
+                        f"<td>{int(w.get('rank', 0) or 0)}등</td>"
+                        f"<td>{int(w.get('student_no', 0) or 0)}</td>"
+                        f"<td>{str(w.get('student_name', '') or '')}</td>"
+                        f"<td>{_render_nums(_normalize_lottery_numbers(w.get('numbers', [])), set(win_nums))}</td>"
+                        f"<td>{int(w.get('prize', 0) or 0)}</td>"
+                        "</tr>"
+                    )
+                html.append("</tbody></table>")
+                st.markdown("".join(html), unsafe_allow_html=True)
 
+            else:
                 if show_winner_result and draw_submitted:
-                    payout_done = bool((r_dat or {}).get("payout_done", False))
-                    led_done = bool((r_dat or {}).get("ledger_applied", False))
-                    action_done = payout_done and led_done
+                    st.info("당첨자가 없습니다.")
 
-                    if st.button(
-                        "당첨금 지급 및 장부 반영",
-                        key="lot_finalize_btn",
-                        use_container_width=True,
-                        disabled=action_done,
-                    ):
-                        finalize_ok = True
-                        if not payout_done:
-                            pay_res = api_pay_lottery_prizes(ADMIN_PIN, current_round_id)
-                            if not pay_res.get("ok"):
-                                st.error(pay_res.get("error", "당첨금 지급 실패"))
-                                finalize_ok = False
-
-                        if finalize_ok and (not led_done):
-                            led_res = api_apply_lottery_ledger(ADMIN_PIN, current_round_id)
-                            if not led_res.get("ok"):
-                                st.error(led_res.get("error", "장부 반영 실패"))
-                                finalize_ok = False
-
-                        if finalize_ok:
-                            st.session_state["lottery_winners_visible_round_id"] = ""
-                            toast_and_rerun("당첨금 지급 및 장부 반영 완료", icon="✅")
-
-                    if payout_done:
-                        st.caption("당첨금 지급: 완료")
-                    if led_done:
-                        st.caption("장부 반영: 완료")
-
-            st.markdown("### 📒 복권 관리 장부")
-            led_res = api_list_lottery_admin_ledger(limit=200)
-            led_rows = list(led_res.get("rows", []) or [])
-            if led_rows:
-                st.dataframe(pd.DataFrame(led_rows), use_container_width=True, hide_index=True)
-            else:
-                st.info("아직 반영된 복권 관리 장부가 없습니다.")
+            if show_winner_result and draw_submitted:
+                payout_done = bool((r_dat or {}).get("payout_done", False))
+                led_done = bool((r_dat or {}).get("ledger_applied", False))
+                action_done = payout_done and led_done
 
+                if st.button(
+                    "당첨금 지급 및 장부 반영",
+                    key="lot_finalize_btn",
+                    use_container_width=True,
+                    disabled=action_done,
+                ):
+                    finalize_ok = True
+                    if not payout_done:
+                        pay_res = api_pay_lottery_prizes(ADMIN_PIN, current_round_id)
+                        if not pay_res.get("ok"):
+                            st.error(pay_res.get("error", "당첨금 지급 실패"))
+                            finalize_ok = False
+
+                    if finalize_ok and (not led_done):
+                        led_res = api_apply_lottery_ledger(ADMIN_PIN, current_round_id)
+                        if not led_res.get("ok"):
+                            st.error(led_res.get("error", "장부 반영 실패"))
+                            finalize_ok = False
+
+                    if finalize_ok:
+                        st.session_state["lottery_winners_visible_round_id"] = ""
+                        toast_and_rerun("당첨금 지급 및 장부 반영 완료", icon="✅", scope="fragment")
+
+                if payout_done:
+                    st.caption("당첨금 지급: 완료")
+                if led_done:
+                    st.caption("장부 반영: 완료")
+
+        st.markdown("### 📒 복권 관리 장부")
+        led_res = api_list_lottery_admin_ledger(limit=200)
+        led_rows = list(led_res.get("rows", []) or [])
+        if led_rows:
+            st.dataframe(pd.DataFrame(led_rows), use_container_width=True, hide_index=True)
         else:
-            st.markdown("### 🎟️ 복권 구매하기")
-            if not open_round:
-                st.info("개시된 복권이 없습니다.")
-            else:
-                st.markdown(
-                    f"🔔 {int(open_round.get('round_no', 0) or 0)}회차 | 복권 가격 {int(open_round.get('ticket_price', 0) or 0):02d}"
-                )
-                st.caption("※ 한 게임(한 줄)에는 4개의 숫자를 입력해야 합니다.")
-                st.caption("※ 각 칸에는 1~20 사이의 숫자만 입력할 수 있으며, 한 줄 안에서는 숫자가 중복될 수 없습니다.")
-                st.caption("※ 구매할 게임 수만큼 숫자를 입력한 후, 구매 버튼을 눌러주세요.")
-                
-                game_count = 5
-                nums_per_game = 4
-                games_raw = []
-
-                def _clear_lottery_input_fields():
-                    for gi in range(game_count):
-                        for ni in range(nums_per_game):
-                            key = f"lot_in_{gi}_{ni}"
-                            st.session_state[key] = ""
-                            st.session_state.pop(f"{key}__backup", None)
-
-                # 구매 성공 후 다음 렌더에서 입력칸 자동 초기화
-                if st.session_state.pop("lottery_clear_after_buy", False):
-                    _clear_lottery_input_fields()
-                    
-                with st.form("lottery_user_form", clear_on_submit=False):
-                    for gi in range(game_count):
-                        row_cols = st.columns([0.8, 1, 1, 1, 1])
-                        with row_cols[0]:
-                            st.markdown(f"**{gi + 1}게임:**")
-                        row_vals = []
-                        for ni in range(nums_per_game):
-                            k = f"lot_in_{gi}_{ni}"
-                            raw = row_cols[ni + 1].text_input(
-                                label=f"{gi + 1}게임 {ni + 1}칸",
-                                key=k,
-                                placeholder="(숫자 입력칸)",
-                                label_visibility="collapsed",
-                            )
-                            row_vals.append(str(raw).strip())
-                        games_raw.append(row_vals)
-
-                    c1, c2 = st.columns(2)
-                    with c1:
-                        clear_clicked = st.form_submit_button("숫자 초기화", use_container_width=True)
-                    with c2:
-                        buy_clicked = st.form_submit_button("복권 구입", use_container_width=True)
+            st.info("아직 반영된 복권 관리 장부가 없습니다.")
 
-                if clear_clicked:
-                    st.session_state["lottery_clear_after_buy"] = True
-                    st.rerun()
-
-                if buy_clicked:
-                    valid_games = []
-                    has_error = False
+    else:
+        st.markdown("### 🎟️ 복권 구매하기")
+        if not open_round:
+            st.info("개시된 복권이 없습니다.")
+        else:
+            st.markdown(
+                f"🔔 {int(open_round.get('round_no', 0) or 0)}회차 | 복권 가격 {int(open_round.get('ticket_price', 0) or 0):02d}"
+            )
+            st.caption("※ 한 게임(한 줄)에는 4개의 숫자를 입력해야 합니다.")
+            st.caption("※ 각 칸에는 1~20 사이의 숫자만 입력할 수 있으며, 한 줄 안에서는 숫자가 중복될 수 없습니다.")
+            st.caption("※ 구매할 게임 수만큼 숫자를 입력한 후, 구매 버튼을 눌러주세요.")
+
+            game_count = 5
+            nums_per_game = 4
+            games_raw = []
+
+            def _clear_lottery_input_fields():
+                for gi in range(game_count):
+                    for ni in range(nums_per_game):
+                        key = f"lot_in_{gi}_{ni}"
+                        st.session_state[key] = ""
+                        st.session_state.pop(f"{key}__backup", None)
+
+            # 구매 성공 후 다음 렌더에서 입력칸 자동 초기화
+            if st.session_state.pop("lottery_clear_after_buy", False):
+                _clear_lottery_input_fields()
+
+            with st.form("lottery_user_form", clear_on_submit=False):
+                for gi in range(game_count):
+                    row_cols = st.columns([0.8, 1, 1, 1, 1])
+                    with row_cols[0]:
+                        st.markdown(f"**{gi + 1}게임:**")
+                    row_vals = []
+                    for ni in range(nums_per_game):
+                        k = f"lot_in_{gi}_{ni}"
+                        raw = row_cols[ni + 1].text_input(
+                            label=f"{gi + 1}게임 {ni + 1}칸",
+                            key=k,
+                            placeholder="(숫자 입력칸)",
+                            label_visibility="collapsed",
+                        )
+                        row_vals.append(str(raw).strip())
+                    games_raw.append(row_vals)
+
+                c1, c2 = st.columns(2)
+                with c1:
+                    clear_clicked = st.form_submit_button("숫자 초기화", use_container_width=True)
+                with c2:
+                    buy_clicked = st.form_submit_button("복권 구입", use_container_width=True)
+
+            if clear_clicked:
+                st.session_state["lottery_clear_after_buy"] = True
+                rerun_fragment()
+
+            if buy_clicked:
+                valid_games = []
+                has_error = False
+
+                for idx, game in enumerate(games_raw):
+                    vals = [str(x).strip() for x in (game or [])]
+                    filled = [v for v in vals if v != ""]
+                    if not filled:
+                        continue
+                    if len(filled) != nums_per_game:
+                        st.error(f"{idx + 1}게임: 숫자 4개를 모두 입력해 주세요.")
+                        has_error = True
+                        continue
 
-                    for idx, game in enumerate(games_raw):
-                        vals = [str(x).strip() for x in (game or [])]
-                        filled = [v for v in vals if v != ""]
-                        if not filled:
-                            continue
-                        if len(filled) != nums_per_game:
-                            st.error(f"{idx + 1}게임: 숫자 4개를 모두 입력해 주세요.")
+                    parsed = []
+                    for v in vals:
+                        if not v.isdigit():
+                            st.error(f"{idx + 1}게임: 숫자만 입력해 주세요.")
                             has_error = True
-                            continue
-
-                        parsed = []
-                        for v in vals:
-                            if not v.isdigit():
-                                st.error(f"{idx + 1}게임: 숫자만 입력해 주세요.")
-                                has_error = True
-                                parsed = []
-                                break
-                            n = int(v)
-                            if n < 1 or n > 20:
-                                st.error(f"{idx + 1}게임: 숫자는 1~20 사이여야 합니다.")
-                                has_error = True
-                                parsed = []
-                                break
-                            parsed.append(n)
-
-                        if not parsed:
-                            continue
-                        if len(set(parsed)) != nums_per_game:
-                            st.error(f"{idx + 1}게임: 같은 숫자를 중복 입력할 수 없습니다.")
+                            parsed = []
+                            break
+                        n = int(v)
+                        if n < 1 or n > 20:
+                            st.error(f"{idx + 1}게임: 숫자는 1~20 사이여야 합니다.")
                             has_error = True
-                            continue
-                            
-                        valid_games.append(parsed)
+                            parsed = []
+                            break
+                        parsed.append(n)
 
-                    if not has_error:
-                        if not valid_games:
-                            st.error("입력된 게임이 없습니다. 최소 1게임 이상 입력해 주세요.")
+                    if not parsed:
+                        continue
+                    if len(set(parsed)) != nums_per_game:
+                        st.error(f"{idx + 1}게임: 같은 숫자를 중복 입력할 수 없습니다.")
+                        has_error = True
+                        continue
+
+                    valid_games.append(parsed)
+
+                if not has_error:
+                    if not valid_games:
+                        st.error("입력된 게임이 없습니다. 최소 1게임 이상 입력해 주세요.")
+                    else:
+                        res = api_submit_lottery_entries(login_name, login_pin, valid_games)
+                        if res.get("ok"):
+                            toast(f"복권 {int(res.get('count', 0) or 0)}게임 구매 완료! 통장에서 금액이 차감되었습니다.", icon="✅")
+                            st.session_state["lottery_clear_after_buy"] = True
+                            st.rerun()
                         else:
-                            res = api_submit_lottery_entries(login_name, login_pin, valid_games)
-                            if res.get("ok"):
-                                toast(f"복권 {int(res.get('count', 0) or 0)}게임 구매 완료! 통장에서 금액이 차감되었습니다.", icon="✅")
-                                st.session_state["lottery_clear_after_buy"] = True
-                                st.rerun()
-                            else:
-                                st.error(res.get("error", "복권 구매 실패"))
-                                    
-            st.markdown("### 📜 복권 구매 내역")
-            my_sid = str(my_student_id or "")
-            hist_rows = []
-            open_round_id = str(open_round.get("round_id", "") or "").strip()
-            if (not open_round_id) or (not my_sid):
-                st.info("개시된 복권이 없습니다.")
+                            st.error(res.get("error", "복권 구매 실패"))
+
+        st.markdown("### 📜 복권 구매 내역")
+        my_sid = str(my_student_id or "")
+        hist_rows = []
+        open_round_id = str(open_round.get("round_id", "") or "").strip()
+        if (not open_round_id) or (not my_sid):
+            st.info("개시된 복권이 없습니다.")
+        else:
+            hres = api_list_lottery_entries_by_student(my_sid, round_id=open_round_id)
+            hist_rows = list(hres.get("rows", []) or []) if hres.get("ok") else []
+            if hist_rows:
+                st.dataframe(pd.DataFrame(hist_rows), use_container_width=True, hide_index=True)
             else:
-                hres = api_list_lottery_entries_by_student(my_sid, round_id=open_round_id)
-                hist_rows = list(hres.get("rows", []) or []) if hres.get("ok") else []
-                if hist_rows:
-                    st.dataframe(pd.DataFrame(hist_rows), use_container_width=True, hide_index=True)
-                else:
-                    st.info("복권 구매 내역이 없습니다.")
+                st.info("복권 구매 내역이 없습니다.")
+
+
+if "🍀 복권" in tabs:
+    with tab_map["🍀 복권"]:
+        _render_lottery_tab()
                     
 # =========================
 # 🧾 로그기록 (관리자 활동/거래 통합 로그)
@@ -16490,6 +16996,89 @@ if "🧾 로그기록" in tabs:
                         hide_index=True,
                     )
                     
+# =========================
+# ⚙️ 성능 (관리자 전용)
+# - 최근 N회 rerun의 Mongo 명령 수/지연/반환 문서 수를 탭·api 함수별로 집계
+# - 기록은 서버 프로세스 전체 기준(모든 접속자의 rerun 포함)
+# =========================
+def _render_perf_panel():
+    st.markdown("### ⚙️ DB 성능 프로파일")
+
+    enabled = st.checkbox("프로파일링 켜기", value=bool(db_profiler.enabled), key="perf_profile_enabled")
+    if enabled != db_profiler.enabled:
+        db_profiler.enabled = enabled
+        st.caption("다음 rerun부터 반영됩니다.")
+
+    traces = db_profiler.recent()
+    if not traces:
+        st.info("기록된 rerun이 없습니다. 프로파일링을 켠 뒤 다른 탭을 눌러 보세요.")
+        return
+
+    last_n = int(
+        st.number_input(
+            "최근 N회 rerun",
+            min_value=1,
+            max_value=len(traces),
+            value=min(10, len(traces)),
+            step=1,
+            key="perf_last_n",
+        )
+    )
+    recent = db_profiler.recent(last_n)
+
+    run_rows = []
+    for t in reversed(recent):
+        cmds = t.get("commands", []) or []
+        tabs_hit = sorted({str(c.get("tab", "") or "") for c in cmds if c.get("tab")})
+        run_rows.append(
+            {
+                "시작(UTC)": str(t.get("started_at", ""))[:19],
+                "구분": t.get("label", ""),
+                "탭": t.get("tab", "") or ", ".join(tabs_hit),
+                "명령 수": len(cmds),
+                "DB 시간(ms)": round(sum(float(c.get("ms", 0) or 0) for c in cmds), 1),
+                "반환 문서": sum(int(c.get("docs", 0) or 0) for c in cmds),
+                "전체(ms)": t.get("elapsed_ms"),
+            }
+        )
+    st.markdown("#### 🧾 rerun별 요약")
+    st.dataframe(pd.DataFrame(run_rows), hide_index=True, use_container_width=True)
+
+    st.markdown("#### 🔥 상위 원인 (탭 · 호출 함수 · 명령 · 컬렉션)")
+    top_rows = db_profiler.summarize(last_n)[:30]
+    if top_rows:
+        st.dataframe(pd.DataFrame(top_rows), hide_index=True, use_container_width=True)
+    else:
+        st.caption("기록된 명령이 없습니다.")
+
+    with st.expander("호환 계층 호출(get/set/update/stream)", expanded=False):
+        op_rows = db_profiler.summarize(last_n, kind="ops")[:30]
+        if op_rows:
+            st.dataframe(pd.DataFrame(op_rows), hide_index=True, use_container_width=True)
+        else:
+            st.caption("기록된 호출이 없습니다.")
+
+    c1, c2 = st.columns(2)
+    with c1:
+        st.download_button(
+            "📥 JSON 트레이스 내보내기",
+            data=db_profiler.dump_json(last_n),
+            file_name=f"db_trace_{datetime.now(KST).strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json",
+            use_container_width=True,
+            key="perf_dump_json",
+        )
+    with c2:
+        if st.button("🧹 기록 초기화", use_container_width=True, key="perf_clear"):
+            db_profiler.clear()
+            st.rerun()
+
+
+if PERF_TAB in tabs and is_admin:
+    with tab_map[PERF_TAB]:
+        _render_perf_panel()
+
+
 # =========================
 # 📊 통계/신용 (학생 전용 · 읽기 전용)
 # - 통계청 통계표(본인) + 신용등급 변동표(본인)
@@ -16638,12 +17227,7 @@ if "📊 통계/신용" in tabs and (not is_admin):
             base = int(cfg.get("base", 50) or 50)
 
             def _delta(v: str) -> int:
-                v = _norm_status(v)
-                if v == "O":
-                    return int(cfg.get("o", 1) or 1)
-                if v == "△":
-                    return int(cfg.get("tri", 0) or 0)
-                return int(cfg.get("x", -3) or -3)
+                return _credit_status_delta(v, cfg)
 
             # 누적 점수(오래된→최신 순으로 계산)
             sub_rows_desc = list(sub_rows_all_c)
@@ -16655,7 +17239,7 @@ if "📊 통계/신용" in tabs and (not is_admin):
                 sid = str(s.get("submission_id") or "")
                 statuses = dict(s.get("statuses", {}) or {})
                 v = statuses.get(str(my_student_id), "X")
-                cur = int(cur) + int(_delta(v))
+                cur = _clamp_credit(int(cur) + int(_delta(v)))
                 score_at_sub[sid] = int(cur)
 
             VISIBLE_COLS2 = 7
@@ -16764,7 +17348,7 @@ def list_schedule(limit=200):
     q = db.collection("schedule_items").order_by("date", direction=mongo.Query.DESCENDING).limit(int(limit)).stream()
     rows = []
     for d in q:
-        x = d.to_dict() or {}
+        x = d.to_dict(copy=True) or {}
         rows.append(x)
     return rows
 
@@ -16906,3 +17490,8 @@ if "🎯 목표" in tabs and (not is_admin):
 
         if principal_all_running == 0 and interest_before_goal == 0:
             st.caption("진행 중 적금이 없어 예상 금액은 통장 잔액과 같아요.")
+
+# ✅ 이번 rerun에 모인 student_assets dirty 표시 저장(st.stop()/st.rerun()으로 끊긴 실행은 다음 rerun 시작 시 저장)
+flush_student_assets_dirty()
+# ✅ 이번 rerun 프로파일 마감(중간에 st.stop()된 실행은 다음 begin_rerun에서 교체)
+db_profiler.end_rerun()
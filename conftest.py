@@ -0,0 +1 @@
+# repo root on sys.path so tests can import app modules (db, migrations)
@@ -1,16 +1,552 @@
+import json
 import os
+import sys
+import threading
+import time
+from collections import deque
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Mapping, Optional
 
+from bson import ObjectId
 from google.api_core.exceptions import AlreadyExists
-from pymongo import ASCENDING, DESCENDING, MongoClient
+from pymongo import ASCENDING, DESCENDING, DeleteOne, MongoClient, ReplaceOne, ReturnDocument, UpdateOne, monitoring
 from pymongo.collection import Collection
 from pymongo.database import Database
-from pymongo.errors import DuplicateKeyError
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
 
 _client: Optional[MongoClient] = None
 _db: Optional[Database] = None
 
+# Default cursor batch size for QueryReference.stream(); None keeps the driver default.
+DEFAULT_BATCH_SIZE: Optional[int] = int(os.environ.get("MONGO_STREAM_BATCH_SIZE", "0") or 0) or None
+
+
+_LIBRARY_DIRS = tuple(
+    os.path.dirname(m.__file__) + os.sep for m in (sys.modules["pymongo"], sys.modules["bson"])
+)
+
+
+def _caller_label() -> str:
+    """Nearest ``api_*`` function on the stack, else the first frame outside db.py and the driver."""
+    frame = sys._getframe(1)
+    fallback = ""
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename != __file__ and not code.co_filename.startswith(_LIBRARY_DIRS):
+            if code.co_name.startswith("api_"):
+                return code.co_name
+            if not fallback:
+                fallback = code.co_name
+        frame = frame.f_back
+    return fallback
+
+
+class DBProfiler:
+    """Per-rerun trace of Mongo commands and compat-layer operations.
+
+    The app opens a trace at the top of every script run (``begin_rerun``) and tags it with
+    the active tab; everything issued from that thread until the next ``begin_rerun`` is
+    attributed to it. Only the last ``max_reruns`` traces are kept. Disabled unless
+    ``DB_PROFILE=1`` or ``enabled`` is switched on at runtime.
+    """
+
+    def __init__(self, max_reruns: int = 20):
+        self.enabled = os.environ.get("DB_PROFILE", "0").strip() == "1"
+        self.traces: deque = deque(maxlen=max_reruns)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def begin_rerun(self, label: str = "app", tab: str = "") -> None:
+        self._local.pending = {}
+        if not self.enabled:
+            self._local.trace = None
+            return
+        trace = {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "label": label,
+            "tab": tab,
+            "elapsed_ms": None,
+            "commands": [],
+            "ops": [],
+        }
+        self._local.trace = trace
+        self._local.t0 = time.perf_counter()
+        self._local.tab = tab
+        with self._lock:
+            self.traces.append(trace)
+
+    def end_rerun(self) -> None:
+        trace = getattr(self._local, "trace", None)
+        if trace is not None:
+            trace["elapsed_ms"] = round((time.perf_counter() - self._local.t0) * 1000, 2)
+        self._local.trace = None
+
+    def active(self) -> bool:
+        return getattr(self._local, "trace", None) is not None
+
+    def set_tab(self, tab: str) -> None:
+        self._local.tab = tab
+
+    def current_tab(self) -> str:
+        return getattr(self._local, "tab", "")
+
+    def record_op(self, op: str, collection: str, seconds: float, docs: int) -> None:
+        trace = getattr(self._local, "trace", None)
+        if trace is None:
+            return
+        trace["ops"].append(
+            {
+                "op": op,
+                "collection": collection,
+                "ms": round(seconds * 1000, 3),
+                "docs": int(docs),
+                "caller": _caller_label(),
+                "tab": self.current_tab(),
+            }
+        )
+
+    def _command_started(self, event) -> None:
+        if getattr(self._local, "trace", None) is None:
+            return
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else str(event.command.get("collection", ""))
+        self._local.pending[event.request_id] = (event.command_name, collection, _caller_label(), self.current_tab())
+
+    def _command_finished(self, event, ok: bool, reply: Optional[Dict[str, Any]] = None) -> None:
+        trace = getattr(self._local, "trace", None)
+        started = getattr(self._local, "pending", {}).pop(event.request_id, None)
+        if trace is None or started is None:
+            return
+        command, collection, caller, tab = started
+        docs = 0
+        if reply:
+            cursor = reply.get("cursor") or {}
+            docs = len(cursor.get("firstBatch", cursor.get("nextBatch", [])) or []) if cursor else int(reply.get("n", 0) or 0)
+        trace["commands"].append(
+            {
+                "command": command,
+                "collection": collection,
+                "ms": round(event.duration_micros / 1000, 3),
+                "docs": docs,
+                "ok": ok,
+                "caller": caller,
+                "tab": tab,
+            }
+        )
+
+    def summarize(self, last_n: Optional[int] = None, kind: str = "commands") -> List[Dict[str, Any]]:
+        """Aggregate ``commands`` (or ``ops``) of the last ``last_n`` traces by (tab, caller, name, collection)."""
+        name_key = "command" if kind == "commands" else "op"
+        groups: Dict[tuple, Dict[str, Any]] = {}
+        for trace in self.recent(last_n):
+            for c in trace[kind]:
+                key = (c["tab"], c["caller"], c[name_key], c["collection"])
+                row = groups.setdefault(
+                    key,
+                    {"tab": key[0], "caller": key[1], name_key: key[2], "collection": key[3], "count": 0, "total_ms": 0.0, "docs": 0},
+                )
+                row["count"] += 1
+                row["total_ms"] += c["ms"]
+                row["docs"] += c["docs"]
+        rows = list(groups.values())
+        for row in rows:
+            row["total_ms"] = round(row["total_ms"], 3)
+            row["avg_ms"] = round(row["total_ms"] / row["count"], 3)
+        rows.sort(key=lambda r: r["total_ms"], reverse=True)
+        return rows
+
+    def recent(self, last_n: Optional[int] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            traces = list(self.traces)
+        return traces[-int(last_n):] if last_n else traces
+
+    def dump_json(self, last_n: Optional[int] = None) -> str:
+        return json.dumps(self.recent(last_n), ensure_ascii=False, indent=2, default=str)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.traces.clear()
+
+
+class _ProfilerCommandListener(monitoring.CommandListener):
+    def __init__(self, profiler: DBProfiler):
+        self._profiler = profiler
+
+    def started(self, event):
+        self._profiler._command_started(event)
+
+    def succeeded(self, event):
+        self._profiler._command_finished(event, True, event.reply)
+
+    def failed(self, event):
+        self._profiler._command_finished(event, False)
+
+
+profiler = DBProfiler(max_reruns=int(os.environ.get("DB_PROFILE_RERUNS", "20") or 20))
+
+
+class IdentityMap:
+    """Per-run cache of documents loaded by ``DocumentReference.get``, keyed by (collection, id).
+
+    Only threads that called ``reset()`` (the app does so at the start of every script
+    run) use it; other threads, such as background jobs, always read through. Writes
+    made through the compat layer drop the affected entries.
+    """
+
+    def __init__(self):
+        self.enabled = os.environ.get("MONGO_IDENTITY_MAP", "1").strip() != "0"
+        self._local = threading.local()
+
+    def reset(self) -> None:
+        self._local.docs = {} if self.enabled else None
+
+    def _docs(self) -> Optional[Dict[tuple, Optional[Dict[str, Any]]]]:
+        return getattr(self._local, "docs", None)
+
+    def lookup(self, collection: str, doc_id: str) -> tuple:
+        """Return ``(hit, data)``; ``data`` is None for a cached miss (document absent)."""
+        docs = self._docs()
+        if docs is None or (collection, doc_id) not in docs:
+            return False, None
+        return True, docs[(collection, doc_id)]
+
+    def store(self, collection: str, doc_id: str, data: Optional[Dict[str, Any]]) -> None:
+        docs = self._docs()
+        if docs is not None:
+            docs[(collection, doc_id)] = data
+
+    def invalidate(self, collection: str, doc_id: Optional[str] = None) -> None:
+        """Drop one entry, or every entry of ``collection`` when ``doc_id`` is None."""
+        docs = self._docs()
+        if not docs:
+            return
+        if doc_id is not None:
+            docs.pop((collection, str(doc_id)), None)
+            return
+        for key in [k for k in docs if k[0] == collection]:
+            del docs[key]
+
+
+identity_map = IdentityMap()
+
+
+CACHE_VERSIONS_COLLECTION = "cache_versions"
+_COHERENCE_SLACK = timedelta(seconds=5)
+
+
+class CacheGenerations:
+    """Process-wide generation counters that scope cache invalidation to what was written.
+
+    Keys are ``<collection>:<doc_id>`` for single documents of ``doc_scoped`` collections,
+    ``<collection>`` for any other write to a collection, or app keys such as
+    ``lottery:<round_id>``. Every bump takes the next value of one global sequence, so a
+    cache entry built when ``seq`` was S is stale for a key once ``get(key) > S``.
+    Writes made through the compat layer bump their keys after the write lands.
+
+    Once ``start_coherence`` is called, bumps are also published to the
+    ``cache_versions`` collection (``{_id: key, v, at}``) so other replicas invalidate the
+    same keys: a change-stream watcher applies them as they arrive, and ``sync()`` polls
+    instead when change streams are unavailable (standalone server) or
+    ``CACHE_COHERENCE=poll``. ``CACHE_COHERENCE=off`` keeps generations process-local.
+    """
+
+    def __init__(self, doc_scoped=("students",)):
+        self.doc_scoped = frozenset(doc_scoped)
+        self.mode = os.environ.get("CACHE_COHERENCE", "auto").strip().lower()
+        self.poll_interval = float(os.environ.get("CACHE_COHERENCE_POLL_SEC", "1") or 1)
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._gens: Dict[str, int] = {}
+        self._latest: Dict[str, int] = {}
+        self._channel: Optional[Collection] = None
+        self._applied: Dict[str, int] = {}
+        self._own_pending: Dict[str, int] = {}
+        self._since: Optional[datetime] = None
+        self._last_poll = 0.0
+        self._watching = False
+        self._hooks: Dict[str, List[Any]] = {}
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    def bump(self, *keys: str) -> int:
+        seq = self._bump_local(keys)
+        self._publish(keys)
+        return seq
+
+    def _bump_local(self, keys) -> int:
+        with self._lock:
+            self._seq += 1
+            for key in keys:
+                self._gens[key] = self._seq
+                self._latest[key.split(":", 1)[0]] = self._seq
+            return self._seq
+
+    def _publish(self, keys) -> None:
+        channel = self._channel
+        if channel is None or not keys:
+            return
+        requests = [
+            UpdateOne({"_id": key}, {"$inc": {"v": 1}, "$currentDate": {"at": True}}, upsert=True)
+            for key in dict.fromkeys(keys)
+        ]
+        try:
+            channel.bulk_write(requests, ordered=False)
+        except PyMongoError:
+            # the write itself succeeded; peers fall back to their TTLs for this key
+            return
+        # our own increments come back through the stream/poll: remember them so they are not re-applied
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                self._own_pending[key] = self._own_pending.get(key, 0) + 1
+
+    def start_coherence(self, database: Database) -> None:
+        """Attach the cross-replica channel; idempotent and a no-op when ``mode`` is off."""
+        if self.mode == "off" or self._channel is not None:
+            return
+        channel = database[CACHE_VERSIONS_COLLECTION]
+        channel.create_index([("at", ASCENDING)], name=_index_name([("at", ASCENDING)]))
+        latest = channel.find_one({}, projection={"at": 1}, sort=[("at", DESCENDING)])
+        self._since = latest.get("at") if latest else None
+        self._channel = channel
+        if self.mode != "poll":
+            threading.Thread(target=self._watch, name="cache-coherence", daemon=True).start()
+
+    def _watch(self) -> None:
+        try:
+            with self._channel.watch(full_document="updateLookup") as stream:
+                self._watching = True
+                for change in stream:
+                    doc = change.get("fullDocument")
+                    if doc:
+                        self._apply_remote([doc])
+        except PyMongoError:
+            # standalone server (no change streams) or lost connection: sync() polls from now on
+            pass
+        finally:
+            self._watching = False
+
+    def sync(self) -> None:
+        """Apply other replicas' bumps; a no-op while the change-stream watcher runs."""
+        channel = self._channel
+        if channel is None or self._watching:
+            return
+        now = time.monotonic()
+        if now - self._last_poll < self.poll_interval:
+            return
+        self._last_poll = now
+        query = {} if self._since is None else {"at": {"$gte": self._since - _COHERENCE_SLACK}}
+        try:
+            docs = list(channel.find(query, projection={"v": 1, "at": 1}))
+        except PyMongoError:
+            return
+        self._apply_remote(docs)
+
+    def _apply_remote(self, docs) -> None:
+        keys = []
+        with self._lock:
+            for doc in docs:
+                key, version = str(doc.get("_id")), int(doc.get("v", 0) or 0)
+                applied = self._applied.get(key, 0)
+                if version > applied:
+                    self._applied[key] = version
+                    # bump only if some of the new increments came from another replica
+                    own = min(self._own_pending.get(key, 0), version - applied)
+                    if own:
+                        self._own_pending[key] -= own
+                    if version - applied > own:
+                        keys.append(key)
+                at = doc.get("at")
+                if at is not None and (self._since is None or at > self._since):
+                    self._since = at
+        if keys:
+            self._bump_local(keys)
+
+    def on_write(self, collection: str, hook) -> None:
+        """Call ``hook(doc_ids)`` after every local write to ``collection`` (``doc_ids`` None: unknown documents).
+
+        Hooks run synchronously in the writing thread; their exceptions are swallowed so a
+        derived-data hook can never fail the write that triggered it.
+        """
+        with self._lock:
+            self._hooks.setdefault(collection, []).append(hook)
+
+    def written(self, collection: str, doc_ids=None) -> None:
+        """Record a write to ``doc_ids`` of ``collection`` (None: unknown documents)."""
+        if doc_ids is not None:
+            doc_ids = [str(doc_id) for doc_id in doc_ids]
+        if doc_ids is not None and collection in self.doc_scoped:
+            keys = [f"{collection}:{doc_id}" for doc_id in doc_ids]
+            if keys:
+                self.bump(*keys)
+        else:
+            self.bump(collection)
+        for hook in self._hooks.get(collection, ()):
+            try:
+                hook(doc_ids)
+            except Exception:
+                pass
+
+    def get(self, key: str) -> int:
+        return self._gens.get(key, 0)
+
+    def collection_gen(self, collection: str) -> int:
+        """Generation of the newest write of any kind to ``collection``."""
+        return max(self._gens.get(collection, 0), self._latest.get(collection, 0))
+
+    def changed_since(self, collection: str, seq: int) -> List[str]:
+        """Ids of ``collection`` documents bumped individually after ``seq``."""
+        prefix = f"{collection}:"
+        with self._lock:
+            return [key[len(prefix):] for key, gen in self._gens.items() if gen > seq and key.startswith(prefix)]
+
+
+cache_generations = CacheGenerations()
+
+
+class LiveCollections:
+    """In-memory mirror of small, hot collections kept current by one change stream.
+
+    ``groups`` maps each watched collection to the field that partitions it (e.g.
+    ``round_id`` for entries/bids) or None to mirror the whole collection as group ``""``.
+    A group is loaded with one query the first time it is read; from then on a single
+    database-level change stream keeps every loaded group current, so readers on this
+    server stop polling. ``version(collection, group)`` increases on every change to a
+    group (loaded or not), which lets the UI re-render only when something changed. A
+    delete carries no field values, so one that no loaded group can claim bumps every
+    group of that collection.
+
+    Change streams need a replica set; for local testing a single-node one is enough
+    (``mongod --replSet rs0`` then ``rs.initiate()``). On a standalone server, or with
+    ``LIVE_WATCH=0``, ``live`` stays False and ``snapshot`` returns None so callers read
+    the database as before.
+    """
+
+    def __init__(self, groups: Dict[str, Optional[str]]):
+        self.groups = dict(groups)
+        self.enabled = os.environ.get("LIVE_WATCH", "1").strip() != "0"
+        self.retry_sec = 30.0
+        self._lock = threading.Lock()
+        self._docs: Dict[tuple, Dict[str, Dict[str, Any]]] = {}
+        self._pending: Dict[tuple, List[tuple]] = {}
+        self._versions: Dict[tuple, int] = {}
+        self._collection_versions: Dict[str, int] = {}
+        self._database: Optional[Database] = None
+        self._live = False
+
+    @property
+    def live(self) -> bool:
+        return self._live
+
+    def start(self, database: Database) -> None:
+        """Start the watcher thread once; a no-op when disabled."""
+        if not self.enabled or self._database is not None:
+            return
+        self._database = database
+        threading.Thread(target=self._run, name="live-collections", daemon=True).start()
+
+    def _run(self) -> None:
+        pipeline = [{"$match": {"ns.coll": {"$in": list(self.groups)}}}]
+        while True:
+            try:
+                with self._database.watch(pipeline, full_document="updateLookup") as stream:
+                    self._live = True
+                    for change in stream:
+                        self._apply(change)
+            except OperationFailure:
+                # change streams are not supported here (standalone server)
+                self._reset()
+                return
+            except PyMongoError:
+                pass
+            self._reset()
+            time.sleep(self.retry_sec)
+
+    def _reset(self) -> None:
+        # events may have been missed: drop every mirrored group so readers go back to the database
+        with self._lock:
+            self._live = False
+            self._docs.clear()
+            self._pending.clear()
+
+    def _apply(self, change: Dict[str, Any]) -> None:
+        collection = (change.get("ns") or {}).get("coll")
+        if collection not in self.groups:
+            return
+        doc_id = str((change.get("documentKey") or {}).get("_id"))
+        doc = change.get("fullDocument")
+        field = self.groups[collection]
+        with self._lock:
+            if doc is None:
+                # delete (or a document already gone by lookup time): its group is unknown
+                keys = [key for key, docs in self._docs.items() if key[0] == collection and doc_id in docs]
+                for key in keys:
+                    del self._docs[key][doc_id]
+                for key, buffered in self._pending.items():
+                    if key[0] == collection:
+                        buffered.append((doc_id, None))
+                if not keys:
+                    # the deleted doc's group cannot be known: count it against every group
+                    self._collection_versions[collection] = self._collection_versions.get(collection, 0) + 1
+            else:
+                key = (collection, "" if field is None else str(doc.get(field, "") or ""))
+                keys = [key]
+                if key in self._pending:
+                    self._pending[key].append((doc_id, doc))
+                elif key in self._docs:
+                    self._docs[key][doc_id] = doc
+            for key in keys:
+                self._versions[key] = self._versions.get(key, 0) + 1
+
+    def version(self, collection: str, group: str = "") -> int:
+        return self._versions.get((collection, str(group)), 0) + self._collection_versions.get(collection, 0)
+
+    def snapshot(self, collection: str, group: str = "") -> Optional[List[Dict[str, Any]]]:
+        """Copies of the documents in one group, or None when the mirror cannot serve it."""
+        if not self._live:
+            return None
+        key = (collection, str(group))
+        with self._lock:
+            docs = self._docs.get(key)
+            if docs is not None:
+                return [dict(doc) for doc in docs.values()]
+            if key in self._pending:
+                return None  # another reader is loading this group right now
+            self._pending[key] = []
+
+        field = self.groups[collection]
+        query = {} if field is None else {field: str(group)}
+        started = time.perf_counter()
+        try:
+            loaded = {str(doc["_id"]): doc for doc in self._database[collection].find(query)}
+        except PyMongoError:
+            with self._lock:
+                self._pending.pop(key, None)
+            return None
+        profiler.record_op("live_load", collection, time.perf_counter() - started, len(loaded))
+
+        with self._lock:
+            # events that arrived while the group was loading are newer than the query result
+            for doc_id, doc in self._pending.pop(key, []):
+                if doc is None:
+                    loaded.pop(doc_id, None)
+                else:
+                    loaded[doc_id] = doc
+            if self._live:
+                self._docs[key] = loaded
+        return [dict(doc) for doc in loaded.values()]
+
+
+class InsufficientBalance(ValueError):
+    """Raised when a ledger posting would push a balance below its min_balance guard."""
+
+
+class AccountNotFound(ValueError):
+    """Raised when a ledger posting targets a document that does not exist."""
+
 
 class Query:
     ASCENDING = "ASCENDING"
@@ -29,6 +565,8 @@ def build_filter(field_path: str, op_string: str, value: Any) -> QueryFilter:
 
 
 class DocumentSnapshot:
+    __slots__ = ("id", "_data", "reference")
+
     def __init__(self, doc_id: str, data: Optional[Dict[str, Any]], reference: "DocumentReference"):
         self.id = str(doc_id)
         self._data = data
@@ -38,8 +576,11 @@ class DocumentSnapshot:
     def exists(self) -> bool:
         return self._data is not None
 
-    def to_dict(self) -> Optional[Dict[str, Any]]:
-        return self._data.copy() if self._data is not None else None
+    def to_dict(self, copy: bool = False) -> Optional[Mapping[str, Any]]:
+        """Read-only view of the document; pass ``copy=True`` for a mutable dict."""
+        if self._data is None:
+            return None
+        return dict(self._data) if copy else MappingProxyType(self._data)
 
 
 class DocumentReference:
@@ -48,31 +589,80 @@ class DocumentReference:
         self.id = str(doc_id)
 
     def get(self, transaction: "Transaction" = None) -> DocumentSnapshot:
+        """Fetch the document; repeated reads in the same run are served from ``identity_map``.
+
+        Reads inside a transaction always go to the server.
+        """
+        name = self._collection._col.name
+        if transaction is None:
+            hit, data = identity_map.lookup(name, self.id)
+            if hit:
+                profiler.record_op("get_cached", name, 0.0, data is not None)
+                return DocumentSnapshot(self.id, data, self)
+        started = time.perf_counter()
         data = self._collection._col.find_one({"_id": self.id})
+        profiler.record_op("get", name, time.perf_counter() - started, data is not None)
+        identity_map.store(name, self.id, data)
         return DocumentSnapshot(self.id, data, self)
 
     def set(self, data: Dict[str, Any], merge: bool = False):
+        started = time.perf_counter()
         payload = _normalize_payload(data)
+        identity_map.invalidate(self._collection._col.name, self.id)
         if merge:
             self._collection._col.update_one({"_id": self.id}, {"$set": payload}, upsert=True)
         else:
             payload["_id"] = self.id
             self._collection._col.replace_one({"_id": self.id}, payload, upsert=True)
+        cache_generations.written(self._collection._col.name, [self.id])
+        profiler.record_op("set", self._collection._col.name, time.perf_counter() - started, 1)
 
     def create(self, data: Dict[str, Any]):
         payload = _normalize_payload(data)
         payload["_id"] = self.id
+        identity_map.invalidate(self._collection._col.name, self.id)
         try:
             self._collection._col.insert_one(payload)
         except DuplicateKeyError as exc:
             raise AlreadyExists(f"Document already exists: {self.id}") from exc
+        cache_generations.written(self._collection._col.name, [self.id])
 
     def update(self, data: Dict[str, Any]):
+        started = time.perf_counter()
         payload = _normalize_payload(data)
-        self._collection._col.update_one({"_id": self.id}, {"$set": payload}, upsert=False)
+        identity_map.invalidate(self._collection._col.name, self.id)
+        result = self._collection._col.update_one({"_id": self.id}, {"$set": payload}, upsert=False)
+        cache_generations.written(self._collection._col.name, [self.id])
+        profiler.record_op("update", self._collection._col.name, time.perf_counter() - started, result.matched_count)
+
+    def increment(self, field: str, amount: int = 1) -> int:
+        """Atomically add ``amount`` to a numeric field (creating the document if needed); returns the new value."""
+        started = time.perf_counter()
+        identity_map.invalidate(self._collection._col.name, self.id)
+        doc = self._collection._col.find_one_and_update(
+            {"_id": self.id},
+            {"$inc": {field: amount}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        cache_generations.written(self._collection._col.name, [self.id])
+        profiler.record_op("increment", self._collection._col.name, time.perf_counter() - started, 1)
+        return int((doc or {}).get(field, 0) or 0)
+
+    def update_if(self, data: Dict[str, Any], filters: List[QueryFilter]) -> bool:
+        """Conditional update: applies ``data`` only if the document still matches ``filters``."""
+        query = _filters_to_mongo(filters)
+        query["_id"] = self.id
+        identity_map.invalidate(self._collection._col.name, self.id)
+        result = self._collection._col.update_one(query, {"$set": _normalize_payload(data)}, upsert=False)
+        if result.modified_count:
+            cache_generations.written(self._collection._col.name, [self.id])
+        return result.modified_count > 0
 
     def delete(self):
+        identity_map.invalidate(self._collection._col.name, self.id)
         self._collection._col.delete_one({"_id": self.id})
+        cache_generations.written(self._collection._col.name, [self.id])
 
 
 class QueryReference:
@@ -81,6 +671,8 @@ class QueryReference:
         self._filters: List[QueryFilter] = []
         self._sort: List[tuple] = []
         self._limit: Optional[int] = None
+        self._offset: Optional[int] = None
+        self._projection: Optional[Dict[str, int]] = None
 
     def where(self, *args, filter: QueryFilter = None):
         if filter is not None:
@@ -100,19 +692,53 @@ class QueryReference:
         self._limit = int(n)
         return self
 
-    def stream(self):
-        cur = self._col.find(_filters_to_mongo(self._filters))
+    def offset(self, n: int):
+        """Skip the first ``n`` results (applied after ordering, before ``limit``)."""
+        self._offset = int(n)
+        return self
+
+    def select(self, field_paths: List[str]):
+        """Return only ``field_paths`` (plus the id) from stream(); an empty list returns ids only."""
+        self._projection = {str(f): 1 for f in field_paths} or {"_id": 1}
+        return self
+
+    def stream(self, batch_size: Optional[int] = None) -> Iterator[DocumentSnapshot]:
+        """Lazily yield snapshots; documents are fetched from the server ``batch_size`` at a time.
+
+        Breaking out of the loop early closes the cursor, so callers that only need
+        the first match never pay for the rest of the result set.
+        """
+        cur = self._col.find(_filters_to_mongo(self._filters), projection=self._projection)
         if self._sort:
             cur = cur.sort(self._sort)
+        if self._offset:
+            cur = cur.skip(self._offset)
         if self._limit is not None:
             cur = cur.limit(self._limit)
-
-        out = []
-        for doc in cur:
+        batch_size = batch_size if batch_size is not None else DEFAULT_BATCH_SIZE
+        if batch_size:
+            cur = cur.batch_size(int(batch_size))
+
+        collection = self if isinstance(self, CollectionReference) else CollectionReference(self._col.database, self._col.name)
+        return _iter_snapshots(cur, collection)
+
+
+def _iter_snapshots(cursor, collection: "CollectionReference") -> Iterator[DocumentSnapshot]:
+    # Profiled time covers only cursor fetches, not the caller's work between yields.
+    fetch_s, docs = 0.0, 0
+    try:
+        while True:
+            started = time.perf_counter()
+            doc = next(cursor, None)
+            fetch_s += time.perf_counter() - started
+            if doc is None:
+                break
+            docs += 1
             doc_id = str(doc.get("_id"))
-            ref = DocumentReference(CollectionReference(self._col.database, self._col.name), doc_id)
-            out.append(DocumentSnapshot(doc_id, doc, ref))
-        return out
+            yield DocumentSnapshot(doc_id, doc, DocumentReference(collection, doc_id))
+    finally:
+        cursor.close()
+        profiler.record_op("stream", collection._name, fetch_s, docs)
 
 
 class CollectionReference(QueryReference):
@@ -123,8 +749,6 @@ class CollectionReference(QueryReference):
 
     def document(self, doc_id: str = None) -> DocumentReference:
         if doc_id is None:
-            from bson import ObjectId
-
             doc_id = str(ObjectId())
         return DocumentReference(self, str(doc_id))
 
@@ -133,6 +757,57 @@ class CollectionReference(QueryReference):
         ref.set(data)
         return None, ref
 
+    def aggregate(self, pipeline: List[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        return self._col.aggregate(pipeline)
+
+    def get_many(self, ids: List[str], chunk_size: int = 500) -> List[DocumentSnapshot]:
+        """Batch point reads: one ``find({_id: {$in: ids}})`` per ``chunk_size`` ids.
+
+        Returns one snapshot per distinct id, in input order (missing documents have
+        ``exists == False``). Ids already in ``identity_map`` are not re-fetched, and every
+        result is stored there, so later ``document(id).get()`` calls in the same run are free.
+        """
+        name = self._col.name
+        order = list(dict.fromkeys(str(i) for i in ids))
+        found: Dict[str, Optional[Dict[str, Any]]] = {}
+        missing = []
+        for doc_id in order:
+            hit, data = identity_map.lookup(name, doc_id)
+            if hit:
+                found[doc_id] = data
+            else:
+                missing.append(doc_id)
+
+        if missing:
+            started, fetched = time.perf_counter(), 0
+            for i in range(0, len(missing), int(chunk_size)):
+                for doc in self._col.find({"_id": {"$in": missing[i : i + int(chunk_size)]}}):
+                    found[str(doc.get("_id"))] = doc
+                    fetched += 1
+            profiler.record_op("get_many", name, time.perf_counter() - started, fetched)
+            for doc_id in missing:
+                identity_map.store(name, doc_id, found.get(doc_id))
+
+        return [DocumentSnapshot(doc_id, found.get(doc_id), self.document(doc_id)) for doc_id in order]
+
+    def increment_many(self, fields: Dict[str, int], ids: Optional[List[str]] = None) -> None:
+        """Atomically ``$inc`` ``fields`` on each of ``ids`` in one bulk write, upserting missing
+        documents; ``ids=None`` increments every existing document of the collection."""
+        started = time.perf_counter()
+        name = self._col.name
+        identity_map.invalidate(name)
+        if ids is None:
+            count = self._col.update_many({}, {"$inc": dict(fields)}).matched_count
+        else:
+            order = list(dict.fromkeys(str(i) for i in ids))
+            if not order:
+                return
+            ops = [UpdateOne({"_id": doc_id}, {"$inc": dict(fields)}, upsert=True) for doc_id in order]
+            self._col.bulk_write(ops, ordered=False)
+            count = len(order)
+        cache_generations.written(name, ids if ids is None else order)
+        profiler.record_op("increment_many", name, time.perf_counter() - started, count)
+
 
 class Transaction:
     def __init__(self, client: "MongoCompatClient"):
@@ -151,6 +826,26 @@ class Transaction:
         doc_ref.delete()
 
 
+@dataclass
+class WriteResult:
+    collection: str
+    doc_id: str
+    op: str
+    ok: bool
+    upserted: bool = False
+    error: Optional[str] = None
+
+
+class BatchWriteError(Exception):
+    """Raised by WriteBatch.commit when some queued ops failed; carries every per-op result."""
+
+    def __init__(self, results: List[WriteResult]):
+        self.results = results
+        self.failed = [r for r in results if not r.ok]
+        self.failed_ids = [f"{r.collection}/{r.doc_id}" for r in self.failed]
+        super().__init__(f"Batch write failed for {len(self.failed)} op(s): {', '.join(self.failed_ids)}")
+
+
 class WriteBatch:
     def __init__(self):
         self._ops = []
@@ -164,15 +859,66 @@ class WriteBatch:
     def delete(self, doc_ref: DocumentReference):
         self._ops.append(("delete", doc_ref, None, None))
 
-    def commit(self):
-        for op, ref, data, merge in self._ops:
-            if op == "set":
-                ref.set(data, merge=bool(merge))
-            elif op == "update":
-                ref.update(data)
-            elif op == "delete":
-                ref.delete()
-        self._ops = []
+    def commit(self) -> List[WriteResult]:
+        """Send queued ops with one bulk_write per collection.
+
+        Ops on distinct documents are sent ``ordered=False``; a collection whose ops
+        touch the same document more than once keeps ``ordered=True`` so the last
+        write still wins. Raises BatchWriteError listing the failed document ids.
+        """
+        ops, self._ops = self._ops, []
+        grouped: Dict[str, List[tuple]] = {}
+        cols: Dict[str, Collection] = {}
+        for op, ref, data, merge in ops:
+            col = ref._collection._col
+            cols[col.name] = col
+            identity_map.invalidate(col.name, ref.id)
+            grouped.setdefault(col.name, []).append((op, ref, data, merge))
+
+        results: List[WriteResult] = []
+        for name, col_ops in grouped.items():
+            requests = [_to_bulk_request(op, ref, data, merge) for op, ref, data, merge in col_ops]
+            col_results = [WriteResult(name, ref.id, op, ok=True) for op, ref, _, _ in col_ops]
+            ordered = len({ref.id for _, ref, _, _ in col_ops}) != len(col_ops)
+            try:
+                res = cols[name].bulk_write(requests, ordered=ordered)
+                upserted = res.upserted_ids or {}
+            except BulkWriteError as exc:
+                details = exc.details or {}
+                upserted = {u.get("index"): u.get("_id") for u in details.get("upserted", []) or []}
+                failed_at = {}
+                for err in details.get("writeErrors", []) or []:
+                    failed_at[int(err.get("index", -1))] = str(err.get("errmsg", "") or "write error")
+                for idx, msg in failed_at.items():
+                    if 0 <= idx < len(col_results):
+                        col_results[idx].ok = False
+                        col_results[idx].error = msg
+                if ordered and failed_at:
+                    # ordered bulk stops at the first error: later ops were never applied
+                    for r in col_results[min(failed_at) + 1 :]:
+                        r.ok = False
+                        r.error = r.error or "not executed"
+            for idx in upserted:
+                if 0 <= idx < len(col_results):
+                    col_results[idx].upserted = True
+            cache_generations.written(name, [r.doc_id for r in col_results if r.ok])
+            results.extend(col_results)
+
+        if any(not r.ok for r in results):
+            raise BatchWriteError(results)
+        return results
+
+
+def _to_bulk_request(op: str, ref: DocumentReference, data: Optional[Dict[str, Any]], merge: Optional[bool]):
+    if op == "delete":
+        return DeleteOne({"_id": ref.id})
+    payload = _normalize_payload(data or {})
+    if op == "update":
+        return UpdateOne({"_id": ref.id}, {"$set": payload}, upsert=False)
+    if merge:
+        return UpdateOne({"_id": ref.id}, {"$set": payload}, upsert=True)
+    payload["_id"] = ref.id
+    return ReplaceOne({"_id": ref.id}, payload, upsert=True)
 
 
 class MongoCompatClient:
@@ -188,6 +934,153 @@ class MongoCompatClient:
     def batch(self) -> WriteBatch:
         return WriteBatch()
 
+    def get_all(self, refs: List[DocumentReference]) -> List[DocumentSnapshot]:
+        """Fetch many references with one ``$in`` query per collection; snapshots follow ``refs`` order."""
+        by_col: Dict[str, tuple] = {}
+        for ref in refs:
+            col = ref._collection
+            by_col.setdefault(col._col.name, (col, []))[1].append(ref.id)
+        snaps: Dict[tuple, DocumentSnapshot] = {}
+        for name, (col, ids) in by_col.items():
+            for snap in col.get_many(ids):
+                snaps[(name, snap.id)] = snap
+        return [snaps[(ref._collection._col.name, ref.id)] for ref in refs]
+
+    def post_ledger(
+        self,
+        account_id: str,
+        amount: int,
+        tx_data: Dict[str, Any],
+        min_balance: Optional[int] = None,
+        accounts: str = "students",
+        ledger: str = "transactions",
+        tx_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Apply ``amount`` to ``accounts/<account_id>.balance`` and append a ledger row.
+
+        The balance change is a single server-side ``$inc`` (``find_one_and_update``
+        returning the document after the update), so concurrent postings never lose
+        updates. When ``min_balance`` is given, the guard ``balance + amount >= min_balance``
+        is part of the same filter and InsufficientBalance is raised if it does not hold.
+        The ledger row is written with the returned ``balance_after``.
+        """
+        account_id = str(account_id)
+        amount = int(amount)
+        acc_col = self._db[accounts]
+        identity_map.invalidate(accounts, account_id)
+
+        query: Dict[str, Any] = {"_id": account_id}
+        if min_balance is not None:
+            threshold = int(min_balance) - amount
+            if threshold <= 0:
+                # a missing balance field counts as 0
+                query["$or"] = [{"balance": {"$gte": threshold}}, {"balance": {"$exists": False}}]
+            else:
+                query["balance"] = {"$gte": threshold}
+
+        doc = acc_col.find_one_and_update(
+            query,
+            {"$inc": {"balance": amount}},
+            projection={"balance": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            if min_balance is not None and acc_col.count_documents({"_id": account_id}, limit=1):
+                raise InsufficientBalance(f"Insufficient balance: {account_id}")
+            raise AccountNotFound(f"Document not found: {accounts}/{account_id}")
+
+        cache_generations.written(accounts, [account_id])
+        balance_after = int(doc.get("balance", 0) or 0)
+        payload = _normalize_payload(tx_data)
+        payload.setdefault("amount", amount)
+        payload["balance_after"] = balance_after
+        payload["_id"] = str(tx_id) if tx_id else str(ObjectId())
+        try:
+            self._db[ledger].insert_one(payload)
+        except Exception:
+            # keep balance and ledger consistent: undo the $inc if the row could not be written
+            acc_col.update_one({"_id": account_id}, {"$inc": {"balance": -amount}})
+            cache_generations.written(accounts, [account_id])
+            raise
+        cache_generations.written(ledger)
+        return {"tx_id": payload["_id"], "balance_after": balance_after}
+
+    def post_ledger_bulk(
+        self,
+        filters: List[QueryFilter],
+        amount: int,
+        tx_data: Dict[str, Any],
+        accounts: str = "students",
+        ledger: str = "transactions",
+    ) -> List[Dict[str, Any]]:
+        """Apply the same ``amount`` to every account matching ``filters`` in four round-trips.
+
+        One ``find`` captures the matching account ids, one ``update_many($inc)`` on exactly
+        those ids applies the amount, one ``find`` reads back their new balances, and one
+        ``insert_many`` writes a ledger row per account (``tx_data`` plus
+        ``student_id``/``amount``/``balance_after``). Accounts whose ledger row could not be
+        written get their ``$inc`` reversed, as in ``post_ledger``.
+        Returns ``[{"student_id", "tx_id", "balance_after"}, ...]``.
+        """
+        amount = int(amount)
+        acc_col = self._db[accounts]
+        identity_map.invalidate(accounts)
+
+        ids = [doc["_id"] for doc in acc_col.find(_filters_to_mongo(filters), projection={"_id": 1})]
+        if not ids:
+            return []
+        acc_col.update_many({"_id": {"$in": ids}}, {"$inc": {"balance": amount}})
+        docs = list(acc_col.find({"_id": {"$in": ids}}, projection={"balance": 1}))
+        cache_generations.written(accounts, [str(doc.get("_id")) for doc in docs])
+
+        base = _normalize_payload(tx_data)
+        rows, out = [], []
+        for doc in docs:
+            account_id = str(doc.get("_id"))
+            balance_after = int(doc.get("balance", 0) or 0)
+            tx_id = str(ObjectId())
+            rows.append({**base, "_id": tx_id, "student_id": account_id, "amount": amount, "balance_after": balance_after})
+            out.append({"student_id": account_id, "tx_id": tx_id, "balance_after": balance_after})
+        try:
+            self._db[ledger].insert_many(rows, ordered=False)
+        except Exception:
+            # keep balance and ledger consistent: undo the $inc for every account left without a row
+            written = {doc["_id"] for doc in self._db[ledger].find({"_id": {"$in": [r["_id"] for r in rows]}}, projection={"_id": 1})}
+            unpaid = [r["student_id"] for r in rows if r["_id"] not in written]
+            if unpaid:
+                acc_col.update_many({"_id": {"$in": unpaid}}, {"$inc": {"balance": -amount}})
+                cache_generations.written(accounts, unpaid)
+            if written:
+                cache_generations.written(ledger)
+            raise
+        cache_generations.written(ledger)
+        return out
+
+
+    def acquire_lease(self, name: str, owner: str, ttl_seconds: int, collection: str = "scheduler_leases") -> bool:
+        """Take (or renew) the named distributed lease for ``ttl_seconds``.
+
+        Succeeds when the lease is free, expired or already held by ``owner``; the
+        upsert races on ``_id`` so exactly one contender wins.
+        """
+        now = datetime.now(timezone.utc)
+        try:
+            doc = self._db[collection].find_one_and_update(
+                {"_id": str(name), "$or": [{"expires_at": {"$lte": now}}, {"owner": str(owner)}]},
+                {"$set": {"owner": str(owner), "expires_at": now + timedelta(seconds=int(ttl_seconds)), "renewed_at": now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            return False
+        return bool(doc) and doc.get("owner") == str(owner)
+
+    def release_lease(self, name: str, owner: str, collection: str = "scheduler_leases"):
+        self._db[collection].update_one(
+            {"_id": str(name), "owner": str(owner)},
+            {"$set": {"expires_at": datetime.now(timezone.utc)}},
+        )
+
 
 class _MongoNamespace:
     Query = Query
@@ -203,6 +1096,64 @@ class _MongoNamespace:
 mongo = _MongoNamespace()
 
 
+# Every index the app's queries rely on: (collection, [(field, direction), ...]).
+REQUIRED_INDEXES: List[tuple] = [
+    ("students", [("name", ASCENDING), ("is_active", ASCENDING)]),
+    ("students", [("is_active", ASCENDING)]),
+    ("transactions", [("student_id", ASCENDING), ("created_at", DESCENDING)]),
+    ("transactions", [("student_id", ASCENDING), ("related_tx", ASCENDING)]),
+    ("transactions", [("created_at", DESCENDING)]),
+    ("savings", [("status", ASCENDING), ("maturity_utc", ASCENDING)]),
+    ("savings", [("student_id", ASCENDING), ("status", ASCENDING)]),
+    ("savings", [("start_utc", DESCENDING)]),
+    ("lottery_rounds", [("status", ASCENDING), ("round_no", DESCENDING)]),
+    ("lottery_entries", [("round_id", ASCENDING), ("submitted_at", ASCENDING)]),
+    ("lottery_entries", [("student_id", ASCENDING), ("round_id", ASCENDING)]),
+    ("auction_rounds", [("status", ASCENDING), ("round_no", DESCENDING)]),
+    ("auction_bids", [("round_id", ASCENDING)]),
+    ("invest_price_history", [("product_id", ASCENDING), ("created_at", DESCENDING)]),
+    ("invest_ledger", [("student_id", ASCENDING), ("buy_at", DESCENDING)]),
+    ("invest_ledger", [("buy_at", DESCENDING)]),
+    ("mart_requests", [("student_id", ASCENDING), ("week_key", ASCENDING), ("status", ASCENDING)]),
+    ("mart_requests", [("status", ASCENDING), ("created_at", ASCENDING)]),
+    ("credit_adjustments", [("student_id", ASCENDING)]),
+    ("credit_adjustments", [("created_at", DESCENDING)]),
+    ("stat_submissions", [("created_at", DESCENDING)]),
+    ("deposit_requests", [("created_at", ASCENDING)]),
+    ("treasury_ledger", [("created_at", DESCENDING)]),
+    ("job_salary", [("order", ASCENDING)]),
+]
+
+
+def _index_name(keys: List[tuple]) -> str:
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+def ensure_indexes(database: Optional[Database] = None, check_only: bool = False) -> List[str]:
+    """Create every index in REQUIRED_INDEXES (idempotent).
+
+    With ``check_only=True`` nothing is created; the return value lists the
+    missing indexes as ``"collection.index_name"`` (empty when all are present).
+    """
+    database = database if database is not None else get_database()
+    existing: Dict[str, set] = {}
+    missing: List[str] = []
+    for col_name, keys in REQUIRED_INDEXES:
+        if col_name not in existing:
+            existing[col_name] = {
+                # index_information() gives "key" as [(field, direction), ...]; 1.0 == 1 so
+                # server-side floats still match, and "text"/"hashed" keys compare as-is
+                tuple(tuple(k) for k in info.get("key", []))
+                for info in database[col_name].index_information().values()
+            }
+        if tuple(keys) in existing[col_name]:
+            continue
+        missing.append(f"{col_name}.{_index_name(keys)}")
+        if not check_only:
+            database[col_name].create_index(keys, name=_index_name(keys))
+    return missing
+
+
 def init_db(uri: Optional[str] = None, db_name: Optional[str] = None) -> MongoCompatClient:
     global _client, _db
     mongo_uri = uri or os.environ.get("MONGO_URI")
@@ -212,23 +1163,28 @@ def init_db(uri: Optional[str] = None, db_name: Optional[str] = None) -> MongoCo
     resolved_db_name = db_name or os.environ.get("MONGO_DB_NAME", "class_point_app")
 
     if _client is None:
-        _client = MongoClient(mongo_uri)
+        _client = MongoClient(mongo_uri, event_listeners=[_ProfilerCommandListener(profiler)])
     if _db is None or _db.name != resolved_db_name:
         _db = _client[resolved_db_name]
 
     return MongoCompatClient(_db)
 
 
-def get_collection(name: str) -> Collection:
+def get_database() -> Database:
     if _db is None:
         init_db()
-    return _db[name]
+    return _db
+
+
+def get_collection(name: str) -> Collection:
+    return get_database()[name]
 
 
 def insert_document(collection_name: str, data: Dict[str, Any]) -> str:
     col = get_collection(collection_name)
     payload = _normalize_payload(data)
     result = col.insert_one(payload)
+    cache_generations.written(collection_name, [str(result.inserted_id)])
     return str(result.inserted_id)
 
 
@@ -239,13 +1195,17 @@ def find_documents(collection_name: str, query: Optional[Dict[str, Any]] = None)
 
 def update_document(collection_name: str, query: Dict[str, Any], update_data: Dict[str, Any], upsert: bool = False) -> int:
     col = get_collection(collection_name)
+    identity_map.invalidate(collection_name)
     result = col.update_one(query, {"$set": _normalize_payload(update_data)}, upsert=upsert)
+    cache_generations.written(collection_name)
     return result.modified_count
 
 
 def delete_document(collection_name: str, query: Dict[str, Any]) -> int:
     col = get_collection(collection_name)
+    identity_map.invalidate(collection_name)
     result = col.delete_one(query)
+    cache_generations.written(collection_name)
     return result.deleted_count
 
 
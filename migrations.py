@@ -0,0 +1,115 @@
+"""One-shot data migrations and index maintenance.
+
+Usage:
+    MONGO_URI=... [MONGO_DB_NAME=...] python -m migrations savings-maturity
+    MONGO_URI=... python -m migrations drop-bulk-posting-tag
+    MONGO_URI=... python -m migrations bump-roles-version   # after editing roles outside the app
+    MONGO_URI=... python -m migrations ensure-indexes
+    MONGO_URI=... python -m migrations check-indexes   # exit 1 if any index is missing
+"""
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.database import Database
+
+import db as db_module
+
+SAVINGS_COL = "savings"
+
+
+def _as_utc(value: Any) -> Optional[datetime]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    try:
+        dt = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return dt.astimezone(timezone.utc) if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def backfill_savings_maturity(database: Database, batch_size: int = 500) -> int:
+    """Normalize legacy savings documents to BSON-date ``start_utc``/``maturity_utc``.
+
+    Covers both historical schemas: ISO strings in ``start_utc``/``maturity_utc`` and
+    datetimes in ``start_date``/``maturity_date``. Missing maturities are derived from
+    the start date and ``weeks``. Returns the number of documents updated.
+    """
+    col = database[SAVINGS_COL]
+    legacy = col.find(
+        {"maturity_utc": {"$not": {"$type": "date"}}},
+        projection={"start_utc": 1, "start_date": 1, "created_at": 1, "maturity_utc": 1, "maturity_date": 1, "weeks": 1},
+    )
+
+    ops, updated = [], 0
+    for doc in legacy:
+        start = _as_utc(doc.get("start_utc")) or _as_utc(doc.get("start_date")) or _as_utc(doc.get("created_at"))
+        maturity = _as_utc(doc.get("maturity_utc")) or _as_utc(doc.get("maturity_date"))
+        if maturity is None and start is not None and int(doc.get("weeks", 0) or 0) > 0:
+            maturity = start + timedelta(days=int(doc.get("weeks", 0) or 0) * 7)
+        if maturity is None:
+            continue
+
+        fields = {"maturity_utc": maturity}
+        if start is not None:
+            fields["start_utc"] = start
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}))
+        if len(ops) >= batch_size:
+            updated += col.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        updated += col.bulk_write(ops, ordered=False).modified_count
+
+    col.create_index([("status", ASCENDING), ("maturity_utc", ASCENDING)])
+    return updated
+
+
+def drop_bulk_posting_tag(database: Database) -> int:
+    """Remove the obsolete ``last_bulk_posting`` tag earlier bulk postings left on student documents."""
+    return database["students"].update_many(
+        {"last_bulk_posting": {"$exists": True}}, {"$unset": {"last_bulk_posting": ""}}
+    ).modified_count
+
+
+def bump_roles_version(database: Database) -> int:
+    """Bump ``config/roles_version`` so every replica rebuilds its role index (after shell/script edits)."""
+    result = database["config"].update_one({"_id": "roles_version"}, {"$inc": {"version": 1}}, upsert=True)
+    return result.modified_count + (1 if result.upserted_id is not None else 0)
+
+
+MIGRATIONS = {
+    "savings-maturity": backfill_savings_maturity,
+    "drop-bulk-posting-tag": drop_bulk_posting_tag,
+    "bump-roles-version": bump_roles_version,
+}
+INDEX_COMMANDS = ("ensure-indexes", "check-indexes")
+
+
+def main(argv=None) -> int:
+    args = list(sys.argv[1:] if argv is None else argv)
+    commands = list(MIGRATIONS) + list(INDEX_COMMANDS)
+    if len(args) != 1 or args[0] not in commands:
+        print(f"usage: python -m migrations {{{'|'.join(commands)}}}", file=sys.stderr)
+        return 2
+    db_module.init_db()
+    database = db_module.get_database()
+
+    if args[0] in INDEX_COMMANDS:
+        check_only = args[0] == "check-indexes"
+        missing = db_module.ensure_indexes(database, check_only=check_only)
+        verb = "missing" if check_only else "created"
+        for name in missing:
+            print(f"{verb}: {name}")
+        print(f"{len(missing)} index(es) {verb}")
+        return 1 if (check_only and missing) else 0
+
+    count = MIGRATIONS[args[0]](database)
+    print(f"{args[0]}: {count} document(s) updated")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,18 @@
+import pytest
+
+pytest.importorskip("pymongo")
+mongomock = pytest.importorskip("mongomock")
+
+import db as db_module
+
+
+def test_ensure_indexes_is_idempotent_on_existing_indexes():
+    database = mongomock.MongoClient()["class_point_app_test"]
+    database["students"].create_index([("name", 1), ("is_active", 1)], name="name_1_is_active_1")
+
+    created = db_module.ensure_indexes(database)
+    assert "students.name_1_is_active_1" not in created
+    assert len(created) == len(db_module.REQUIRED_INDEXES) - 1
+
+    assert db_module.ensure_indexes(database) == []
+    assert db_module.ensure_indexes(database, check_only=True) == []